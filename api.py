@@ -0,0 +1,380 @@
+"""
+HTTP/JSON chat API, for clients that do not use the Streamlit UI.
+
+    python api.py [--host 0.0.0.0] [--port 8000]      (or: uvicorn api:app)
+
+    GET  /v1/characters               characters available to chat with
+    GET  /v1/characters/{id}          one character, with its summary
+    POST /v1/chat                     {"character": id, "message": ...} -> {"reply": ...}
+    POST /v1/chat/stream              same request; the reply as server-sent events
+    GET  /v1/history?character={id}   stored messages, newest page first (?before=N&limit=N)
+    GET  /healthz, /metrics
+
+Sessions are stateless on the server: the first chat response carries a
+signed session token, which the client sends back as "Authorization: Bearer
+<token>". The conversation itself lives in the conversation store, so any
+process sharing the store and API_SECRET can serve the next turn. Model calls
+run in worker threads behind the same gateway as the UI.
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+# Load environment variables before the modules below read their configuration
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # python-dotenv not installed, skip
+
+import anyio
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from catalog import (find_character, get_available_characters, get_character_quotes, get_character_summary,
+                     load_character_info)
+from chat import (MAX_INPUT_LENGTH, fallback_response, generate_response, initialize_vertex_ai,
+                  new_conversation_memory, stream_response)
+from conversation_store import CONVERSATION_PAGE_MESSAGES, Conversation, get_conversation_store
+from gateway import Rejected
+from logging_config import set_log_context, setup_logging
+from warmup import start_warmup
+
+logger = logging.getLogger(__name__)
+
+# Signs session tokens; set it (the same on every instance) so tokens survive restarts
+API_SECRET = os.environ.get("API_SECRET", "")
+API_TOKEN_TTL_SECONDS = int(os.environ.get("API_TOKEN_TTL_SECONDS", str(30 * 86400)))
+
+_secret = API_SECRET.encode("utf-8") or secrets.token_bytes(32)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+
+# =============================================================================
+# Session tokens
+# =============================================================================
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_token(session_id):
+    """A signed token naming the session: base64(payload).base64(HMAC-SHA256)."""
+    payload = _b64encode(json.dumps({"sid": session_id, "iat": int(time.time())}).encode("utf-8"))
+    signature = _b64encode(hmac.new(_secret, payload.encode("ascii"), hashlib.sha256).digest())
+    return f"{payload}.{signature}"
+
+
+def verify_token(token):
+    """Return the session id of a valid, unexpired token, else None."""
+    try:
+        payload, signature = token.split(".")
+        expected = _b64encode(hmac.new(_secret, payload.encode("ascii"), hashlib.sha256).digest())
+        # compare_digest refuses non-ASCII str, so compare bytes
+        if not hmac.compare_digest(signature.encode("utf-8"), expected.encode("ascii")):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if time.time() - claims.get("iat", 0) > API_TOKEN_TTL_SECONDS:
+        return None
+    return claims.get("sid")
+
+
+def session_from_request(request, required=False):
+    """(session_id, token) from the Authorization header; a new session unless one is required."""
+    header = request.headers.get("authorization", "")
+    if header.lower().startswith("bearer "):
+        token = header[7:].strip()
+        session_id = verify_token(token)
+        if session_id is None:
+            raise ApiError(401, "Invalid or expired session token")
+        return session_id, token
+    if required:
+        raise ApiError(401, "Missing session token")
+    session_id = uuid.uuid4().hex
+    return session_id, issue_token(session_id)
+
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+def character_id(character):
+    return character['filename'].rsplit('.', 1)[0]
+
+
+def require_character(identifier):
+    character = find_character(identifier)
+    if character is None:
+        raise ApiError(404, f"Unknown character: {identifier}")
+    return character
+
+
+def describe_character(character):
+    return {"id": character_id(character), "name": character['display_name']}
+
+
+async def parse_turn(request):
+    """Validate a chat request; returns (character, message, session_id, token)."""
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ApiError(400, "Request body must be JSON")
+    if not isinstance(body, dict):
+        raise ApiError(400, "Request body must be a JSON object")
+    message = body.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ApiError(400, "Field 'message' must be a non-empty string")
+    message = message.strip()
+    if len(message) > MAX_INPUT_LENGTH:
+        raise ApiError(413, f"Message too long. Please keep messages under {MAX_INPUT_LENGTH} characters.")
+    character = require_character(str(body.get("character", "")))
+    session_id, token = session_from_request(request)
+    set_log_context(session_id=session_id, character=character['display_name'])
+    return character, message, session_id, token
+
+
+def open_turn(character, message, session_id):
+    """Open the stored conversation, add the user message and return the generation arguments."""
+    if not initialize_vertex_ai():
+        raise ApiError(503, "Service temporarily unavailable. Please try again later.")
+    name = character['display_name']
+    conversation = Conversation.open(get_conversation_store(), session_id, name, new_conversation_memory())
+    args = (
+        name,
+        message,
+        load_character_info(character['filename']),
+        get_character_quotes(character['script_name']),
+        list(conversation.messages),
+        character['script_name'],
+        conversation.memory,
+        session_id,
+    )
+    conversation.append("user", message)
+    logger.info(f"[{name}] User: {message}", extra={"event": "user_message", "chars": len(message), "api": True})
+    return conversation, args
+
+
+def finish_turn(conversation, reply):
+    conversation.append("assistant", reply)
+    conversation.end_turn()
+    logger.info(f"[{conversation.character}] Assistant reply ({len(reply)} chars)",
+                extra={"event": "assistant_message", "chars": len(reply), "api": True})
+
+
+def rejected_error(error):
+    # Sending too fast is the client's doing (429); a full queue is a temporary outage (503)
+    status = 429 if error.reason == "rate_limited" else 503
+    retry_after = max(1, round(error.retry_after))
+    return ApiError(status, "Too many requests right now; please try again shortly.",
+                    headers={"Retry-After": str(retry_after)})
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """Closes the body generator however the response ends, so its cleanup runs within the request.
+
+    After a client disconnect the generator may be left suspended at a yield, and would
+    otherwise only be closed whenever it is garbage-collected.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# =============================================================================
+# Endpoints
+# =============================================================================
+
+async def list_characters(request):
+    characters = await run_in_threadpool(get_available_characters)
+    return JSONResponse({"characters": [describe_character(character) for character in characters]})
+
+
+async def get_character(request):
+    character = require_character(request.path_params["character_id"])
+    summary = await run_in_threadpool(get_character_summary, character['filename'])
+    return JSONResponse({**describe_character(character), "summary": summary})
+
+
+async def chat_turn(request):
+    character, message, session_id, token = await parse_turn(request)
+    conversation, args = await run_in_threadpool(open_turn, character, message, session_id)
+    started = time.perf_counter()
+    try:
+        reply = await run_in_threadpool(generate_response, *args)
+    except Rejected as e:
+        await run_in_threadpool(conversation.discard_last)
+        raise rejected_error(e)
+    await run_in_threadpool(finish_turn, conversation, reply)
+    metrics.turn_seconds.observe(time.perf_counter() - started, character=character['display_name'], phase="turn")
+    return JSONResponse({
+        "reply": reply,
+        "fallback": reply == fallback_response(character['display_name']),
+        "session_token": token,
+    })
+
+
+async def chat_stream(request):
+    character, message, session_id, token = await parse_turn(request)
+    conversation, args = await run_in_threadpool(open_turn, character, message, session_id)
+    started = time.perf_counter()
+    chunks = stream_response(*args)
+    # Wait for the first chunk before answering, so a refused turn gets a proper status code
+    try:
+        first = await run_in_threadpool(next, chunks, None)
+    except Rejected as e:
+        await run_in_threadpool(conversation.discard_last)
+        raise rejected_error(e)
+
+    streamed = [first] if first is not None else []
+
+    def record():
+        # Collected in the worker thread, so a chunk read as the client leaves is kept too
+        for chunk in chunks:
+            streamed.append(chunk)
+            yield chunk
+
+    recorder = record()
+
+    def end_turn():
+        # In a worker thread: no model call is executing here any more, so both close
+        recorder.close()
+        chunks.close()  # Frees the model slot
+        if streamed:
+            finish_turn(conversation, "".join(streamed))
+        else:
+            conversation.discard_last()
+
+    async def events():
+        try:
+            yield sse("session", {"session_token": token})
+            if first is not None:
+                yield sse("chunk", {"text": first})
+            async for chunk in iterate_in_threadpool(recorder):
+                yield sse("chunk", {"text": chunk})
+            reply = "".join(streamed)
+            yield sse("done", {"reply": reply, "fallback": reply == fallback_response(character['display_name'])})
+        finally:
+            # A client disconnect cancels this task; shielded, the turn still ends and keeps what was said
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(end_turn)
+            metrics.turn_seconds.observe(time.perf_counter() - started, character=character['display_name'],
+                                         phase="turn")
+
+    return ClosingStreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def history(request):
+    session_id, _ = session_from_request(request, required=True)
+    character = require_character(request.query_params.get("character", ""))
+    try:
+        limit = min(max(int(request.query_params.get("limit", CONVERSATION_PAGE_MESSAGES)), 1), 200)
+        before = request.query_params.get("before")
+        before = int(before) if before is not None else None
+    except ValueError:
+        raise ApiError(400, "'limit' and 'before' must be integers")
+
+    def load():
+        store = get_conversation_store()
+        latest = store.latest(session_id, character['display_name'])
+        if latest is None:
+            return 0, []
+        total = store.count(latest[0])
+        end = total if before is None else min(max(before, 0), total)
+        start = max(0, end - limit)
+        return start, store.load(latest[0], start, end)
+
+    start, messages = await run_in_threadpool(load)
+    return JSONResponse({"start": start, "messages": messages, "has_earlier": start > 0})
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+async def handle_api_error(request, error):
+    return JSONResponse({"error": error.message}, status_code=error.status, headers=error.headers)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    if not API_SECRET:
+        logger.warning("API_SECRET is not set; session tokens will not be valid after a restart "
+                       "or on another worker process")
+    start_warmup()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/characters", list_characters),
+        Route("/v1/characters/{character_id}", get_character),
+        Route("/v1/chat", chat_turn, methods=["POST"]),
+        Route("/v1/chat/stream", chat_stream, methods=["POST"]),
+        Route("/v1/history", history),
+        Route("/healthz", healthz),
+        Route("/metrics", metrics_endpoint),
+    ],
+    exception_handlers={ApiError: handle_api_error},
+    lifespan=lifespan,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (share API_SECRET and the stores)")
+    args = parser.parse_args()
+    if args.workers > 1 and not API_SECRET:
+        # Each worker would sign with its own random key and reject the others' tokens
+        print("Set API_SECRET to run more than one worker", file=sys.stderr)
+        return 2
+
+    import uvicorn
+
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,13 +4,11 @@ Chat with your favorite LOTR characters using Vertex AI's Gemini 2.5 Flash
 """
 
 import streamlit as st
-import pandas as pd
-import json
 import os
-import re
 import logging
-from pathlib import Path
-from datetime import datetime
+import re
+import time
+import uuid
 
 # Load environment variables from .env file if it exists
 try:
@@ -19,28 +17,21 @@ try:
 except ImportError:
     pass  # python-dotenv not installed, skip
 
-import vertexai
-from vertexai.generative_models import GenerativeModel, ChatSession
+from catalog import (get_available_characters, get_character_quotes, get_character_summary, get_search_filters,
+                     load_character_info, search_catalog)
+from chat import (MAX_INPUT_LENGTH, council_message, council_responses, fallback_response, generate_response,
+                  initialize_vertex_ai, new_conversation_memory, stream_response)
+from conversation_store import CONVERSATION_PAGE_MESSAGES, Conversation, get_conversation_store
+from gateway import Rejected
+from logging_config import set_log_context, setup_logging
+from metrics import start_metrics_export, turn_seconds
+from warmup import start_warmup
 
 # =============================================================================
 # Logging Configuration
 # =============================================================================
 
-# Set up logging
-log_dir = Path(__file__).parent / "logs"
-log_dir.mkdir(exist_ok=True)
-
-# Create log file with timestamp
-log_file = log_dir / f"conversations_{datetime.now().strftime('%Y%m%d')}.log"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()  # Also log to console
-    ]
-)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -48,14 +39,33 @@ logger = logging.getLogger(__name__)
 # Configuration
 # =============================================================================
 
-# Update these with your Google Cloud settings
-PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT_ID")
-LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
-MODEL_NAME = "gemini-2.5-flash"
+# Stream replies token-by-token into the chat (set STREAM_RESPONSES=false to disable)
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "true").lower() not in ("0", "false", "no")
+
+# Session ids travel in the page URL (?session=...), so a reload resumes the stored conversation
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Messages rendered in the chat; older ones appear on "Load earlier messages", so a turn's
+# rendering cost does not grow with the length of the conversation
+CHAT_DISPLAY_MESSAGES = int(os.environ.get("CHAT_DISPLAY_MESSAGES", "20"))
+
+# Council mode: several characters answer each message. The council has one stored
+# conversation per session, under this name; the Fellowship is the default council.
+COUNCIL_NAME = "Council"
+COUNCIL_MAX_MEMBERS = int(os.environ.get("COUNCIL_MAX_MEMBERS", "9"))
+FELLOWSHIP = ("Frodo Baggins", "Samwise Gamgee", "Gandalf", "Aragorn", "Legolas", "Gimli", "Boromir",
+              "Meriadoc Brandybuck", "Peregrin Took")
 
-# Paths
-CHARACTERS_DIR = Path(__file__).parent / "characters"
-SCRIPTS_CSV = Path(__file__).parent / "lotr_scripts.csv"
+# Sidebar search: results listed per query, and the shortest query that is searched
+SEARCH_RESULTS = int(os.environ.get("SEARCH_RESULTS", "8"))
+SEARCH_MIN_CHARS = 2
+ALL_CHARACTERS = "All characters"
+ALL_MOVIES = "All movies"
+
+# Preload every character and the Vertex AI client in the background (once per process;
+# serve.py starts this before the server accepts connections)
+start_warmup()
+start_metrics_export()
 
 # =============================================================================
 # Page Configuration
@@ -72,8 +82,7 @@ st.set_page_config(
 # Custom CSS - Middle-Earth Theme
 # =============================================================================
 
-st.markdown("""
-<style>
+THEME_CSS = """
     @import url('https://fonts.googleapis.com/css2?family=Cinzel:wght@400;600;700&family=Crimson+Text:ital,wght@0,400;0,600;1,400&display=swap');
     
     /* Main background */
@@ -398,274 +407,273 @@ st.markdown("""
             overflow-x: hidden;
         }
     }
-</style>
-""", unsafe_allow_html=True)
+"""
 
-# =============================================================================
-# Data Loading Functions
-# =============================================================================
 
-@st.cache_data
-def load_scripts():
-    """Load the movie scripts CSV file."""
-    try:
-        df = pd.read_csv(SCRIPTS_CSV)
-        # Clean up column names
-        df.columns = df.columns.str.strip()
-        return df
-    except Exception as e:
-        logger.error(f"Error loading scripts: {str(e)}", exc_info=True)
-        st.error("Unable to load movie scripts. Please try again later.")
-        return pd.DataFrame()
-
-@st.cache_data
-def load_character_info(character_filename):
-    """Load character information from text file."""
-    try:
-        # Security: Prevent path traversal attacks
-        if '..' in character_filename or '/' in character_filename or '\\' in character_filename:
-            logger.warning(f"Invalid character filename detected: {character_filename}")
-            return None, None
-        
-        filepath = CHARACTERS_DIR / character_filename
-        
-        # Security: Ensure file is within the characters directory
-        if not str(filepath.resolve()).startswith(str(CHARACTERS_DIR.resolve())):
-            logger.warning(f"Path traversal attempt detected: {character_filename}")
-            return None, None
-        
-        if not filepath.exists():
-            logger.warning(f"Character file not found: {character_filename}")
-            return None, None
-        
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Parse JSON content
-        data = json.loads(content)
-        
-        # Extract the wiki content
-        pages = data.get('query', {}).get('pages', {})
-        for page_id, page_data in pages.items():
-            revisions = page_data.get('revisions', [])
-            if revisions:
-                wiki_content = revisions[0].get('*', '')
-                title = page_data.get('title', '')
-                return title, wiki_content
-        
-        return None, None
-    except Exception as e:
-        logger.error(f"Error loading character info for {character_filename}: {str(e)}", exc_info=True)
-        return None, None
-
-@st.cache_data
-def get_character_quotes(scripts_df, character_name):
-    """Get all quotes for a specific character."""
-    if scripts_df.empty:
-        return []
-    
-    # Normalize character name for matching
-    char_upper = character_name.upper()
-    
-    # Filter quotes for this character
-    char_quotes = scripts_df[scripts_df['char'].str.upper().str.strip() == char_upper]
-    
-    quotes = []
-    for _, row in char_quotes.iterrows():
-        dialog = str(row.get('dialog', '')).strip()
-        movie = str(row.get('movie', '')).strip()
-        if dialog and dialog != 'nan':
-            quotes.append({'dialog': dialog, 'movie': movie})
-    
-    return quotes
-
-@st.cache_data
-def get_available_characters():
-    """Get list of characters that have both wiki info and movie quotes."""
-    scripts_df = load_scripts()
-    
-    # Get characters from scripts
-    script_characters = set()
-    if not scripts_df.empty:
-        script_characters = set(scripts_df['char'].str.strip().str.upper().unique())
-    
-    # Get characters from txt files
-    file_characters = {}
-    if CHARACTERS_DIR.exists():
-        for filepath in CHARACTERS_DIR.glob("*.txt"):
-            # Convert filename to character name
-            name = filepath.stem.replace("_", " ")
-            file_characters[name.upper()] = filepath.name
-    
-    # Build list of characters with proper display names
-    available = []
-    
-    # Map script names to file names
-    name_mapping = {
-        "GANDALF": ("Gandalf", "Gandalf.txt"),
-        "FRODO": ("Frodo Baggins", "Frodo_Baggins.txt"),
-        "SAM": ("Samwise Gamgee", "Samwise_Gamgee.txt"),
-        "ARAGORN": ("Aragorn", "Aragorn_II_Elessar.txt"),
-        "LEGOLAS": ("Legolas", "Legolas.txt"),
-        "GIMLI": ("Gimli", "Gimli.txt"),
-        "BOROMIR": ("Boromir", "Boromir.txt"),
-        "MERRY": ("Meriadoc Brandybuck", "Meriadoc_Brandybuck.txt"),
-        "PIPPIN": ("Peregrin Took", "Peregrin_Took.txt"),
-        "GOLLUM": ("Gollum", "Gollum.txt"),
-        "SARUMAN": ("Saruman", "Saruman.txt"),
-        "ELROND": ("Elrond", "Elrond.txt"),
-        "GALADRIEL": ("Galadriel", "Galadriel.txt"),
-        "ARWEN": ("Arwen", "Arwen.txt"),
-        "THÉODEN": ("Théoden", "Théoden.txt"),
-        "THEODEN": ("Théoden", "Théoden.txt"),
-        "ÉOWYN": ("Éowyn", "Éowyn.txt"),
-        "EOWYN": ("Éowyn", "Éowyn.txt"),
-        "ÉOMER": ("Éomer", "Éomer.txt"),
-        "EOMER": ("Éomer", "Éomer.txt"),
-        "FARAMIR": ("Faramir", "Faramir.txt"),
-        "DENETHOR": ("Denethor II", "Denethor_II.txt"),
-        "TREEBEARD": ("Treebeard", "Treebeard.txt"),
-        "BILBO": ("Bilbo Baggins", "Bilbo_Baggins.txt"),
-        "WITCH-KING": ("Witch-king of Angmar", "Witch-king_of_Angmar.txt"),
-        "GRIMA": ("Gríma Wormtongue", "Gríma_Wormtongue.txt"),
-        "WORMTONGUE": ("Gríma Wormtongue", "Gríma_Wormtongue.txt"),
-        "CELEBORN": ("Celeborn", "Celeborn.txt"),
-        "HALDIR": ("Haldir", "Haldir_(Lorien).txt"),
-        "GAMLING": ("Gamling", "Gamling.txt"),
-        "BARLIMAN": ("Barliman Butterbur", "Barliman_Butterbur.txt"),
-    }
-    
-    for script_name in script_characters:
-        if script_name in name_mapping:
-            display_name, filename = name_mapping[script_name]
-            if (CHARACTERS_DIR / filename).exists():
-                available.append({
-                    'display_name': display_name,
-                    'script_name': script_name,
-                    'filename': filename
-                })
-    
-    # Sort by display name
-    available.sort(key=lambda x: x['display_name'])
-    
-    return available
-
-def extract_character_summary(wiki_content):
-    """Extract a brief summary from wiki content."""
-    if not wiki_content:
-        return ""
-    
-    # Remove wiki markup
-    text = re.sub(r'\{\{[^}]+\}\}', '', wiki_content)
-    text = re.sub(r'\[\[[^\]|]+\|([^\]]+)\]\]', r'\1', text)
-    text = re.sub(r'\[\[([^\]]+)\]\]', r'\1', text)
-    text = re.sub(r"'''?", '', text)
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\n+', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Get first few sentences
-    sentences = text.split('.')
-    summary = '. '.join(sentences[:3]) + '.'
-    
-    return summary[:500] if len(summary) > 500 else summary
+def compact_css(css):
+    """Drop comments and layout whitespace from a stylesheet; spaces inside selectors are kept."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    return re.sub(r"\s*([{};,])\s*", r"\1", re.sub(r"\s+", " ", css)).strip()
+
+
+# Streamlit removes any element a full page run does not repeat, so every full run (first load,
+# character change, search result chosen) sends the theme again, compacted to about half the size.
+# A chat turn or search keystroke reruns only its fragment and sends nothing here.
+st.markdown(f"<style>{compact_css(THEME_CSS)}</style>", unsafe_allow_html=True)
 
 # =============================================================================
-# Vertex AI Integration
+# Main Application
 # =============================================================================
 
-@st.cache_resource
-def initialize_vertex_ai():
-    """Initialize Vertex AI."""
+def timed_stream(chunks, timings, started, on_first=None):
+    """Pass chunks through, recording the time to the first one and the time spent rendering in timings."""
+    render_seconds = 0.0
+    for chunk in chunks:
+        if 'first_token_ms' not in timings:
+            timings['first_token_ms'] = round((time.perf_counter() - started) * 1000)
+            if on_first is not None:
+                on_first()
+        yielded = time.perf_counter()
+        yield chunk
+        render_seconds += time.perf_counter() - yielded
+        timings['render_ms'] = round(render_seconds * 1000)
+
+def show_earlier_messages():
+    st.session_state.shown_messages += CONVERSATION_PAGE_MESSAGES
+
+def rejected_message(name, error):
+    """What to tell the user when the gateway did not admit their turn."""
+    retry = f"Please try again in about {max(1, round(error.retry_after))} seconds."
+    if error.reason == "rate_limited":
+        return f"⏳ You're sending messages too fast. {retry}"
+    return f"⏳ {name} has too many visitors right now. {retry}"
+
+
+def council_turn(prompt, conversation, members):
+    """Ask every council member at once and show each reply as soon as it is ready."""
+    waiting = st.empty()
+    pending = [member['display_name'] for member in members]
+    waiting.info(f"⏳ {', '.join(pending)} consider your words...")
+    replies = council_responses(
+        [(member['display_name'], load_character_info(member['filename']),
+          get_character_quotes(member['script_name']), member['script_name']) for member in members],
+        prompt,
+        conversation.messages[:-1],  # History before the message just added
+        st.session_state.memory,
+        st.session_state.session_id,
+    )
+    started = time.perf_counter()
+    answered = 0
     try:
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        return True
-    except Exception as e:
-        logger.error(f"Failed to initialize Vertex AI: {str(e)}", exc_info=True)
-        # Don't expose error details to users in production
-        return False
+        for name, response in replies:
+            pending.remove(name)
+            if pending:
+                waiting.info(f"⏳ {', '.join(pending)} still consider your words...")
+            else:
+                waiting.empty()
+            with st.chat_message("assistant", avatar="🧝"):
+                st.markdown(council_message(name, response))
+            fallback = response == fallback_response(name)
+            logger.info(f"[{name}] Council reply ({len(response)} chars)",
+                        extra={"event": "assistant_message", "character": name, "chars": len(response), "council": True,
+                               "fallback": fallback, "duration_ms": round((time.perf_counter() - started) * 1000)})
+            # A member who could not answer said nothing; the apology is not fed to later prompts
+            if not fallback:
+                conversation.append("assistant", council_message(name, response))
+                answered += 1
+    except Rejected as e:
+        # Drop the unanswered message so it can simply be sent again
+        waiting.warning(rejected_message("The council", e))
+        conversation.discard_last()
+        logger.info(f"[{COUNCIL_NAME}] Turn not admitted: {e}", extra={"event": "turn_rejected", "reason": e.reason})
+        return
+    if not answered:
+        # Nobody answered: drop the message too, so it can be sent again
+        conversation.discard_last()
+        return
+    turn_seconds.observe(time.perf_counter() - started, character=COUNCIL_NAME, phase="turn")
+    conversation.end_turn()
+    st.session_state.shown_messages = CHAT_DISPLAY_MESSAGES
+    logger.info(f"Conversation now has {len(conversation)} messages")
+
+def search_result_prompt(entry):
+    """The message a search result puts in the chat input, for the user to finish or send."""
+    if entry['kind'] == 'quote':
+        return f'{entry["character"]} once said: "{entry["text"]}" '[:MAX_INPUT_LENGTH]
+    return f"Tell me about {entry['heading'].split(' > ')[-1]} ({entry['character']}). "
+
+@st.fragment
+def search_panel(character_name):
+    """Search every quote and wiki passage as the user types. Typing reruns only this fragment."""
+    # A fragment rerun runs on a fresh thread, without the log context main() set
+    set_log_context(session_id=st.session_state.session_id, character=character_name)
+    st.markdown("## 🔍 Search the Archives")
+    query = st.text_input("Search quotes and lore:", key="search_query", type="search", live=True,
+                          placeholder="e.g. balrog, second breakfast")
+    characters, movies = get_search_filters()
+    character = st.selectbox("Character:", [ALL_CHARACTERS, *characters], key="search_character")
+    movie = st.selectbox("Movie:", [ALL_MOVIES, *movies], key="search_movie")
+    if len(query.strip()) < SEARCH_MIN_CHARS:
+        return
 
-def get_model():
-    """Get the Gemini model."""
-    return GenerativeModel(MODEL_NAME)
+    results = search_catalog(
+        query,
+        character=None if character == ALL_CHARACTERS else character,
+        movie=None if movie == ALL_MOVIES else movie,
+        k=SEARCH_RESULTS
+    )
+    if not results:
+        st.caption("Nothing in the archives matches.")
+        return
+    for i, entry in enumerate(results):
+        text = entry['text'] if len(entry['text']) <= 80 else entry['text'][:80].rsplit(' ', 1)[0] + "…"
+        if entry['kind'] == 'quote':
+            label = f'📜 "{text}" — {entry["character"]}'
+        else:
+            label = f"📖 {entry['character']} · {entry['heading'].split(' > ')[-1]}: {text}"
+        if st.button(label, key=f"search_result_{i}", help=entry['text'][:500], use_container_width=True):
+            # The chat input is outside this fragment, so the whole page reruns to show the text there
+            st.session_state.chat_prompt = search_result_prompt(entry)
+            logger.info(f"Search result chosen for query {query!r}", extra={"event": "search_result"})
+            st.rerun()
 
-def create_character_prompt(character_info, quotes, character_name):
-    """Create the system prompt for the character."""
-    
-    # Extract summary from wiki content
-    _, wiki_content = character_info if character_info else (None, None)
-    summary = extract_character_summary(wiki_content) if wiki_content else ""
+@st.fragment
+def chat_area(selected_char, council=None):
+    """The conversation and its input. A turn reruns only this fragment, not the page header and sidebar.
+
+    council is the list of members in council mode, who all answer each message.
+    """
+    conversation = st.session_state.conversation
+    selected_display_name = selected_char['display_name'] if not council else "the council"
+    # A fragment rerun runs on a fresh thread, without the log context main() set
+    set_log_context(session_id=st.session_state.session_id,
+                    character=COUNCIL_NAME if council else selected_char['display_name'])
     
-    # Format some example quotes
-    quote_examples = ""
-    if quotes:
-        sample_quotes = quotes[:15]  # Take up to 15 quotes
-        quote_examples = "\n".join([f'- "{q["dialog"]}" ({q["movie"]})' for q in sample_quotes])
+    # Main chat area
+    chat_container = st.container()
     
-    prompt = f"""You are {character_name} from J.R.R. Tolkien's "The Lord of the Rings" as portrayed in Peter Jackson's film trilogy.
-
-CHARACTER BACKGROUND:
-{summary}
-
-EXAMPLE QUOTES FROM THE FILMS (use these to understand speech patterns and vocabulary):
-{quote_examples}
-
-ROLEPLAY INSTRUCTIONS:
-1. Stay completely in character as {character_name} at all times
-2. Speak in the same manner and style as shown in the films - match the vocabulary, tone, and speech patterns from the quotes above
-3. Reference events, places, and people from Middle-Earth appropriately based on what {character_name} would know
-4. Express the personality, wisdom, fears, hopes, and motivations that {character_name} displays in the films
-5. Use appropriate expressions, oaths, or phrases the character might use (e.g., Gandalf might say "Fool of a Took!" or reference his pipe-weed)
-6. If asked about things outside Middle-Earth or the character's knowledge, respond as the character would - with confusion, curiosity, or by relating it to something they do understand
-7. Keep responses conversational and engaging, as if truly speaking with someone
-8. Never break character or acknowledge being an AI
-
-Remember: You ARE {character_name}. Respond as they would, with their voice, their concerns, and their perspective on the world."""
-
-    return prompt
-
-def generate_response(character_name, user_message, character_info, quotes, chat_history):
-    """Generate a character response using Gemini."""
+    with chat_container:
+        # Welcome message if no messages yet
+        if not len(conversation):
+            st.markdown(f"""
+            <div class="character-info">
+                <h4>🌟 You are now speaking with {selected_display_name}</h4>
+                {f"<p>Seated at the council: {', '.join(member['display_name'] for member in council)}.</p>" if council else ""}
+                <p>Begin your conversation below. Ask questions, seek wisdom, or simply chat with this legendary character from Middle-Earth.</p>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # Only the most recent messages are rendered; older ones are paged in on request
+        # (from the store once they have left memory)
+        hidden = len(conversation) - st.session_state.shown_messages
+        if hidden > 0:
+            st.button(f"⬆️ Load earlier messages ({hidden} more)", on_click=show_earlier_messages)
+        shown = min(st.session_state.shown_messages, len(conversation))
+        while len(conversation.messages) < shown and conversation.has_earlier:
+            conversation.load_earlier()
+        
+        # Display chat messages
+        for message in conversation.messages[len(conversation.messages) - shown:]:
+            avatar = "🧝" if message["role"] == "assistant" else "🗡️"
+            with st.chat_message(message["role"], avatar=avatar):
+                st.markdown(message["content"])
     
-    try:
-        logger.info(f"[{character_name}] Generating response... (conversation history: {len(chat_history)} messages)")
-        model = get_model()
+    # Chat input, pinned to the bottom of the page as it would be outside the fragment
+    with st.bottom:
+        prompt = st.chat_input(f"Speak to {selected_display_name}...", key="chat_prompt")
+    if prompt:
+        # Sanitize and validate user input
+        prompt = prompt.strip()
+        if not prompt:
+            st.warning("Please enter a message.")
+            return
+        
+        # Limit input length to prevent abuse
+        if len(prompt) > MAX_INPUT_LENGTH:
+            st.warning(f"Message too long. Please keep messages under {MAX_INPUT_LENGTH} characters.")
+            return
         
-        # Create the character system prompt
-        system_prompt = create_character_prompt(character_info, quotes, character_name)
+        # Log user message
+        logger.info(f"[{selected_display_name}] User: {prompt}", extra={"event": "user_message", "chars": len(prompt)})
         
-        # Build conversation history
-        conversation = f"{system_prompt}\n\n"
+        # Add user message
+        conversation.append("user", prompt)
         
-        for msg in chat_history[-10:]:  # Keep last 10 messages for context
-            role = "User" if msg["role"] == "user" else character_name
-            conversation += f"{role}: {msg['content']}\n\n"
+        with st.chat_message("user", avatar="🗡️"):
+            st.markdown(prompt)
         
-        conversation += f"User: {user_message}\n\n{character_name}:"
+        if council:
+            council_turn(prompt, conversation, council)
+            return
         
         # Generate response
-        response = model.generate_content(
-            conversation,
-            generation_config={
-                "max_output_tokens": 1024,
-                "temperature": 0.9,
-                "top_p": 0.95,
-            }
-        )
-        
-        logger.info(f"[{character_name}] Response generated successfully (length: {len(response.text)} chars)")
-        return response.text
+        with st.chat_message("assistant", avatar="🧝"):
+            waiting = st.empty()
+
+            def show_position(position):
+                # Called while the model gateway queues this turn behind other sessions
+                ahead = f"{position} ahead of you" if position else "you are next"
+                waiting.info(f"⏳ Many seek {selected_display_name}'s counsel. Waiting in line ({ahead})...")
+
+            response_args = (
+                selected_display_name,
+                prompt,
+                st.session_state.get('character_info'),
+                st.session_state.get('character_quotes', []),
+                conversation.messages[:-1],  # History before the message just added
+                selected_char['script_name'],
+                st.session_state.memory,
+                st.session_state.session_id,
+                show_position
+            )
+            timings = {}
+            started = time.perf_counter()
+            try:
+                if STREAM_RESPONSES:
+                    # Render partial text as it arrives; write_stream returns the assembled reply
+                    response = st.write_stream(
+                        timed_stream(stream_response(*response_args), timings, started, on_first=waiting.empty)
+                    )
+                else:
+                    with st.spinner(f"{selected_display_name} is thinking..."):
+                        response = generate_response(*response_args)
+                        waiting.empty()
+                        rendering = time.perf_counter()
+                        st.markdown(response)
+                        timings['render_ms'] = round((time.perf_counter() - rendering) * 1000)
+            except Rejected as e:
+                # Busy or sending too fast: drop the unanswered message so it can simply be sent again
+                waiting.warning(rejected_message(selected_display_name, e))
+                conversation.discard_last()
+                logger.info(f"[{selected_display_name}] Turn not admitted: {e}",
+                            extra={"event": "turn_rejected", "reason": e.reason})
+                return
+            timings['duration_ms'] = round((time.perf_counter() - started) * 1000)
+            turn_seconds.observe(timings.get('render_ms', 0) / 1000, character=selected_display_name, phase="render")
+            turn_seconds.observe(timings['duration_ms'] / 1000, character=selected_display_name, phase="turn")
         
-    except Exception as e:
-        logger.error(f"[{character_name}] Error generating response: {str(e)}", exc_info=True)
-        # Return user-friendly message without exposing error details
-        return f"*{character_name} seems lost in thought* Forgive me, I cannot speak clearly at this moment. Please try again."
-
-# =============================================================================
-# Main Application
-# =============================================================================
+        # Log assistant response
+        logger.info(
+            f"[{selected_display_name}] Assistant: {response[:200]}..." if len(response) > 200 else f"[{selected_display_name}] Assistant: {response}",
+            extra={"event": "assistant_message", "chars": len(response), **timings}
+        )
+        # Add assistant message; older messages then leave memory
+        conversation.append("assistant", response)
+        conversation.end_turn()
+        st.session_state.shown_messages = CHAT_DISPLAY_MESSAGES
+        logger.info(f"Conversation now has {len(conversation)} messages")
 
 def main():
+    # Tag every log record of this run with the session (and, once selected, the character)
+    if "session_id" not in st.session_state:
+        session_id = st.query_params.get("session", "")
+        if not SESSION_ID_PATTERN.fullmatch(session_id):
+            session_id = uuid.uuid4().hex
+            st.query_params["session"] = session_id
+        st.session_state.session_id = session_id
+    set_log_context(session_id=st.session_state.session_id, character=None)
+    store = get_conversation_store()
+    
     # Header
     st.markdown('<h1 class="main-title">⚔️ Middle-Earth Messenger ⚔️</h1>', unsafe_allow_html=True)
     st.markdown('<p class="subtitle">"Not all those who wander are lost"</p>', unsafe_allow_html=True)
@@ -678,7 +686,6 @@ def main():
         st.stop()
     
     # Load data
-    scripts_df = load_scripts()
     available_characters = get_available_characters()
     
     if not available_characters:
@@ -693,13 +700,15 @@ def main():
         # Character selector
         character_options = [c['display_name'] for c in available_characters]
         
-        # Find Gandalf's index for default selection
+        # Default to the character of the session's last conversation, else Gandalf
+        if "resumed_character" not in st.session_state:
+            latest = store.latest(st.session_state.session_id)
+            st.session_state.resumed_character = latest[1] if latest else None
         default_index = 0
-        try:
-            gandalf_index = character_options.index("Gandalf")
-            default_index = gandalf_index
-        except ValueError:
-            pass  # Gandalf not found, use index 0
+        for default_name in (st.session_state.resumed_character, "Gandalf"):
+            if default_name in character_options:
+                default_index = character_options.index(default_name)
+                break
         
         selected_display_name = st.selectbox(
             "Select a character to speak with:",
@@ -712,6 +721,21 @@ def main():
             (c for c in available_characters if c['display_name'] == selected_display_name),
             None
         )
+        set_log_context(character=selected_display_name if selected_char else None)
+        
+        # Council mode: put the message to several characters at once
+        council = None
+        if st.toggle("🏛️ Council mode", value=st.session_state.resumed_character == COUNCIL_NAME,
+                     help="Several characters answer each message"):
+            council_names = st.multiselect(
+                "Council members:",
+                options=character_options,
+                default=[name for name in FELLOWSHIP if name in character_options][:COUNCIL_MAX_MEMBERS],
+                max_selections=COUNCIL_MAX_MEMBERS
+            )
+            council = [c for c in available_characters if c['display_name'] in council_names]
+            if not council:
+                st.info("Choose at least one council member.")
         
         st.markdown("---")
         
@@ -719,9 +743,13 @@ def main():
         if st.button("🗡️ Start New Conversation", use_container_width=True):
             current_char = st.session_state.get('current_character_name', 'Unknown')
             logger.info(f"=== Conversation cleared by user for character: {current_char} ===")
-            logger.info(f"Previous conversation had {len(st.session_state.messages)} messages")
-            st.session_state.messages = []
-            # Keep current character but clear conversation
+            if "conversation" in st.session_state:
+                logger.info(f"Previous conversation had {len(st.session_state.conversation)} messages")
+                # Keep current character but start a new stored conversation
+                st.session_state.conversation = Conversation.open(
+                    store, st.session_state.session_id, current_char, st.session_state.memory, new=True
+                )
+                st.session_state.shown_messages = CHAT_DISPLAY_MESSAGES
             st.rerun()
         
         st.markdown("---")
@@ -729,7 +757,7 @@ def main():
         if selected_char:
             # Load character data
             char_info = load_character_info(selected_char['filename'])
-            char_quotes = get_character_quotes(scripts_df, selected_char['script_name'])
+            char_quotes = get_character_quotes(selected_char['script_name'])
             
             # Store in session state
             st.session_state.current_character = selected_char
@@ -740,7 +768,7 @@ def main():
             
             # Show character summary
             if char_info[1]:
-                summary = extract_character_summary(char_info[1])
+                summary = get_character_summary(selected_char['filename'])
                 st.markdown(f'<div class="character-info">{summary}</div>', unsafe_allow_html=True)
             
             # Show quote count
@@ -751,87 +779,37 @@ def main():
                 sample = char_quotes[0]
                 st.markdown("**Sample quote:**")
                 st.markdown(f'<div class="quote-box">"{sample["dialog"]}"<br><small>— {sample["movie"]}</small></div>', unsafe_allow_html=True)
+        
+        st.markdown("---")
+        search_panel(selected_display_name if selected_char else None)
     
     # Initialize chat history
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    if "memory" not in st.session_state:
+        st.session_state.memory = new_conversation_memory()
         logger.info("=== New session started ===")
     
     if "current_character_name" not in st.session_state:
         st.session_state.current_character_name = None
         logger.info("=== Character tracking initialized ===")
     
-    # Check if character changed - clear conversation history when switching
-    current_char_name = selected_display_name if selected_char else None
+    # Check if character changed - switch to the session's stored conversation with that character
+    current_char_name = COUNCIL_NAME if council is not None else selected_display_name if selected_char else None
     if st.session_state.current_character_name != current_char_name:
         old_char = st.session_state.current_character_name
-        old_message_count = len(st.session_state.messages)
         logger.info(f"=== Character switched: {old_char} -> {current_char_name} ===")
-        logger.info(f"Previous conversation had {old_message_count} messages")
-        st.session_state.messages = []
+        if "conversation" in st.session_state:
+            logger.info(f"Previous conversation had {len(st.session_state.conversation)} messages")
+        st.session_state.conversation = Conversation.open(
+            store, st.session_state.session_id, current_char_name, st.session_state.memory
+        )
         st.session_state.current_character_name = current_char_name
-        logger.info(f"New conversation started with {current_char_name}")
+        st.session_state.shown_messages = CHAT_DISPLAY_MESSAGES
+        logger.info(f"Conversation with {current_char_name} opened ({len(st.session_state.conversation)} messages)")
     
-    # Main chat area
-    chat_container = st.container()
-    
-    with chat_container:
-        # Welcome message if no messages yet
-        if not st.session_state.messages and selected_char:
-            st.markdown(f"""
-            <div class="character-info">
-                <h4>🌟 You are now speaking with {selected_display_name}</h4>
-                <p>Begin your conversation below. Ask questions, seek wisdom, or simply chat with this legendary character from Middle-Earth.</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Display chat messages
-        for message in st.session_state.messages:
-            avatar = "🧝" if message["role"] == "assistant" else "🗡️"
-            with st.chat_message(message["role"], avatar=avatar):
-                st.markdown(message["content"])
-    
-    # Chat input
-    if prompt := st.chat_input(f"Speak to {selected_display_name}..."):
-        # Sanitize and validate user input
-        prompt = prompt.strip()
-        if not prompt:
-            st.warning("Please enter a message.")
-            st.stop()
-        
-        # Limit input length to prevent abuse
-        MAX_INPUT_LENGTH = 2000
-        if len(prompt) > MAX_INPUT_LENGTH:
-            st.warning(f"Message too long. Please keep messages under {MAX_INPUT_LENGTH} characters.")
-            st.stop()
-        
-        # Log user message
-        logger.info(f"[{selected_display_name}] User: {prompt}")
-        
-        # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        
-        with st.chat_message("user", avatar="🗡️"):
-            st.markdown(prompt)
-        
-        # Generate response
-        with st.chat_message("assistant", avatar="🧝"):
-            with st.spinner(f"{selected_display_name} is thinking..."):
-                response = generate_response(
-                    selected_display_name,
-                    prompt,
-                    st.session_state.get('character_info'),
-                    st.session_state.get('character_quotes', []),
-                    st.session_state.messages
-                )
-                st.markdown(response)
-        
-        # Log assistant response
-        logger.info(f"[{selected_display_name}] Assistant: {response[:200]}..." if len(response) > 200 else f"[{selected_display_name}] Assistant: {response}")
-        logger.info(f"Conversation now has {len(st.session_state.messages)} messages")
-        
-        # Add assistant message
-        st.session_state.messages.append({"role": "assistant", "content": response})
+    if council:
+        chat_area(selected_char, council)
+    elif selected_char and council is None:
+        chat_area(selected_char)
 
 if __name__ == "__main__":
     main()
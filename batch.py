@@ -0,0 +1,270 @@
+"""
+Generate character replies in bulk from a JSONL file.
+
+    python batch.py prompts.jsonl -o replies.jsonl [--concurrency 8]
+    python batch.py prompts.jsonl -o replies.jsonl --resume      # after an interruption
+
+Each input line is a JSON object:
+
+    {"id": "q1", "character": "Gandalf", "message": "...", "history": [{"role": "user", "content": "..."}, ...]}
+
+"character" is a display name, wiki file name or script name; "id" and
+"history" are optional. The input is read as a stream and replies are written
+as they finish, one JSON object per line with the input line number, so the
+output order differs from the input. Model calls go through the gateway, so
+--concurrency above GATEWAY_MAX_CONCURRENT only queues.
+
+Progress is checkpointed next to the output (<output>.checkpoint): the line up
+to which every record is done, its byte offset in the input and the records
+finished beyond it. --resume continues from there. Records that got the
+fallback reply (model unavailable) or failed are not done, so --resume
+retries them. Delivery is at-least-once: retried records and records finished
+after the last checkpoint write appear again, so keep the last result per
+"line" if that matters. The exit status is 1 when any record fell back or
+failed.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+# Load environment variables before the modules below read their configuration
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # python-dotenv not installed, skip
+
+from catalog import find_character, get_character_quotes, load_character_info
+from chat import MAX_INPUT_LENGTH, fallback_response, generate_response, initialize_vertex_ai, new_conversation_memory
+from gateway import Rejected
+from logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL_SECONDS = 2.0
+MAX_REJECTED_RETRIES = 5
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def parse_record(line):
+    """Validate an input line; returns (id, character, message, history)."""
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise InvalidRecord(f"Not valid JSON: {e}")
+    if not isinstance(record, dict):
+        raise InvalidRecord("Not a JSON object")
+    message = record.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise InvalidRecord("Field 'message' must be a non-empty string")
+    if len(message) > MAX_INPUT_LENGTH:
+        raise InvalidRecord(f"Message longer than {MAX_INPUT_LENGTH} characters")
+    character = find_character(str(record.get("character", "")))
+    if character is None:
+        raise InvalidRecord(f"Unknown character: {record.get('character')!r}")
+    history = record.get("history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+        for m in history
+    ):
+        raise InvalidRecord("Field 'history' must be a list of {role: user|assistant, content} objects")
+    return record.get("id"), character, message.strip(), history
+
+
+def generate(character, message, history):
+    """One reply, as in the app; the memory window and retrieval apply to the given history."""
+    return generate_response(
+        character['display_name'],
+        message,
+        load_character_info(character['filename']),
+        get_character_quotes(character['script_name']),
+        history,
+        character['script_name'],
+        new_conversation_memory(),
+    )
+
+
+class Checkpoint:
+    """The contiguous prefix of finished input lines, plus the lines finished beyond it."""
+
+    def __init__(self, path, line=0, offset=0, done=()):
+        self.path = Path(path)
+        self.line = line  # Every line before this one is finished
+        self.offset = offset  # Byte offset of self.line in the input
+        self.done = set(done)
+        self._offsets = {}  # line -> byte offset of the line after it, for lines beyond self.line
+
+    @classmethod
+    def load(cls, path, input_path):
+        path = Path(path)
+        if not path.exists():
+            return cls(path)
+        state = json.loads(path.read_text(encoding="utf-8"))
+        if state.get("input") != str(input_path):
+            raise SystemExit(f"{path} belongs to {state.get('input')}, not {input_path}")
+        return cls(path, state["line"], state["offset"], state.get("done", ()))
+
+    def finish(self, line, next_offset):
+        self.done.add(line)
+        self._offsets[line] = next_offset
+        while self.line in self.done:
+            self.done.discard(self.line)
+            self.offset = self._offsets.pop(self.line, self.offset)
+            self.line += 1
+
+    def save(self, input_path):
+        state = {"input": str(input_path), "line": self.line, "offset": self.offset, "done": sorted(self.done)}
+        temporary = self.path.with_suffix(self.path.suffix + ".tmp")
+        temporary.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(temporary, self.path)
+
+
+class Summary:
+    def __init__(self):
+        self.counts = {"ok": 0, "fallback": 0, "invalid": 0, "error": 0}
+        self.latencies = []
+        self.started = time.perf_counter()
+
+    def add(self, status, seconds=None):
+        self.counts[status] += 1
+        if seconds is not None:
+            self.latencies.append(seconds)
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 3) if latencies else 0.0
+
+        total = sum(self.counts.values())
+        return {
+            "records": total,
+            **self.counts,
+            "wall_s": round(wall, 3),
+            "records_per_s": round(total / wall, 3) if wall else 0.0,
+            "latency_p50_s": percentile(0.50),
+            "latency_p95_s": percentile(0.95),
+        }
+
+
+async def run_batch(input_path, output_path, concurrency, resume):
+    checkpoint_path = output_path.with_name(output_path.name + ".checkpoint")
+    if resume:
+        checkpoint = Checkpoint.load(checkpoint_path, input_path)
+    else:
+        checkpoint = Checkpoint(checkpoint_path)
+        output_path.write_text("", encoding="utf-8")
+    if checkpoint.line or checkpoint.done:
+        logger.info(f"Resuming at line {checkpoint.line} ({len(checkpoint.done)} later lines already done)")
+
+    summary = Summary()
+    queue = asyncio.Queue(maxsize=concurrency * 2)  # Reading the input waits for the workers
+    last_saved = time.monotonic()
+
+    def write_result(result, line, next_offset, done=True):
+        nonlocal last_saved
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        if done:
+            checkpoint.finish(line, next_offset)
+        if time.monotonic() - last_saved >= CHECKPOINT_INTERVAL_SECONDS:
+            checkpoint.save(input_path)
+            last_saved = time.monotonic()
+
+    async def process(line, raw, next_offset):
+        result = {"line": line}
+        try:
+            record_id, character, message, history = parse_record(raw)
+        except InvalidRecord as e:
+            summary.add("invalid")
+            write_result({**result, "status": "invalid", "error": str(e)}, line, next_offset)
+            return
+        result.update(id=record_id, character=character['display_name'], message=message)
+
+        started = time.perf_counter()
+        for attempt in range(MAX_REJECTED_RETRIES + 1):
+            try:
+                reply = await asyncio.to_thread(generate, character, message, history)
+                break
+            except Rejected as e:
+                # The gateway is saturated (e.g. by live traffic); wait as advised and try again
+                if attempt == MAX_REJECTED_RETRIES:
+                    summary.add("error")
+                    write_result({**result, "status": "error", "error": str(e)}, line, next_offset, done=False)
+                    return
+                await asyncio.sleep(max(e.retry_after, 1.0))
+        elapsed = time.perf_counter() - started
+        status = "fallback" if reply == fallback_response(character['display_name']) else "ok"
+        summary.add(status, elapsed)
+        # A fallback reply is left out of the checkpoint, so --resume asks the model again
+        write_result({**result, "status": status, "reply": reply if status == "ok" else None,
+                      "elapsed_ms": round(elapsed * 1000)}, line, next_offset, done=status == "ok")
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await process(*item)
+            except Exception as e:
+                logger.error(f"Record on line {item[0]} failed: {str(e)}", exc_info=True)
+                summary.add("error")
+                write_result({"line": item[0], "status": "error", "error": str(e)}, item[0], item[2], done=False)
+            finally:
+                queue.task_done()
+
+    with open(output_path, "a", encoding="utf-8") as output, open(input_path, "rb") as source:
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        source.seek(checkpoint.offset)
+        line = checkpoint.line
+        while True:
+            raw = source.readline()
+            if not raw:
+                break
+            if raw.strip() and line not in checkpoint.done:
+                await queue.put((line, raw.decode("utf-8", errors="replace"), source.tell()))
+            else:
+                checkpoint.finish(line, source.tell())  # Blank, or already done before the restart
+            line += 1
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        checkpoint.save(input_path)
+
+    return summary.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", type=Path, help="JSONL file of {character, message, history?, id?} records")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="JSONL file for the replies")
+    parser.add_argument("--concurrency", type=int, default=8, help="Records generated at the same time")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output's checkpoint")
+    parser.add_argument("--summary", type=Path, help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    setup_logging()
+    if not initialize_vertex_ai():
+        print("Vertex AI could not be initialized; see the log output", file=sys.stderr)
+        return 2
+
+    report = asyncio.run(run_batch(args.input, args.output, max(args.concurrency, 1), args.resume))
+    print(json.dumps(report, indent=2))
+    if args.summary:
+        args.summary.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    return 1 if report["error"] or report["fallback"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
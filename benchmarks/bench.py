@@ -0,0 +1,205 @@
+"""
+Offline micro-benchmarks for the data loading and per-turn paths.
+
+Runs without network access: the model is the stub from stub_model.py and the
+response cache is disabled. Results are written as JSON and compared against a
+stored baseline; model time simulated by the stub is subtracted, so the
+per-turn numbers measure the app's own overhead.
+
+    python benchmarks/bench.py                      # compare with benchmarks/baseline.json
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --update-baseline    # after an intended change, on the reference machine
+
+Exits with status 1 when a benchmark regressed beyond the tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Configure the app modules before importing them
+os.environ["MODEL_BACKEND"] = "stub"
+os.environ["RESPONSE_CACHE"] = "off"
+os.environ["WARMUP"] = "off"
+
+import catalog  # noqa: E402
+import chat  # noqa: E402
+import stub_model  # noqa: E402
+from wiki import extract_character_summary  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+CHARACTER_FILE = "Gandalf.txt"
+CHARACTER_NAME = "Gandalf"
+SCRIPT_NAME = "GANDALF"
+USER_MESSAGE = "What did you find in the archives of Minas Tirith about the Ring?"
+HISTORY = [
+    {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+    for i, text in enumerate([
+        "Who are you?",
+        "I am Gandalf, and Gandalf means me.",
+        "Where are you travelling to?",
+        "To Minas Tirith, to search the archives for the history of a certain ring.",
+        "Is it dangerous?",
+        "It is the most dangerous thing in all of Middle-earth, and it is here, in the Shire.",
+    ])
+]
+
+
+def measure(func, setup=None, min_time=0.5, min_iterations=5, max_iterations=2000):
+    """Time func repeatedly; a float returned by func is excluded from the sample (simulated model time)."""
+    samples = []
+    spent = 0.0
+    while len(samples) < max_iterations and (len(samples) < min_iterations or spent < min_time):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        excluded = result if isinstance(result, float) else 0.0
+        spent += elapsed
+        samples.append(max(elapsed - excluded, 0.0))
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples) * 1e6, 1),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6, 1),
+        "min_us": round(samples[0] * 1e6, 1),
+        "iterations": len(samples),
+    }
+
+
+def run_turn(stream, latency=0.0, tokens_per_second=0.0):
+    """One full turn through generate_response or stream_response; returns the simulated model time."""
+    character_info = catalog.load_character_info(CHARACTER_FILE)
+    quotes = catalog.get_character_quotes(SCRIPT_NAME)
+    model = chat.get_character_model(CHARACTER_NAME, character_info, quotes)
+    stub_model.STUB_LATENCY_SECONDS = latency
+    stub_model.STUB_TOKENS_PER_SECOND = tokens_per_second
+    simulated = model.simulated_seconds
+
+    args = (CHARACTER_NAME, USER_MESSAGE, character_info, quotes, HISTORY, SCRIPT_NAME, chat.new_conversation_memory())
+    if stream:
+        reply = "".join(chat.stream_response(*args))
+    else:
+        reply = chat.generate_response(*args)
+    if reply == chat.fallback_response(CHARACTER_NAME):
+        raise RuntimeError("Turn failed; see the log output above")
+    return model.simulated_seconds - simulated
+
+
+def run_benchmarks(min_time):
+    character_info = catalog.load_character_info(CHARACTER_FILE)
+    quotes = catalog.get_character_quotes(SCRIPT_NAME)
+    wiki_content = character_info[1]
+    # Build the retrieval indexes and the character model before timing turns
+    chat.get_character_model(CHARACTER_NAME, character_info, quotes)
+    catalog.get_quote_index()
+    catalog.get_lore_index()
+
+    cases = {
+        "load_scripts.cold": (catalog.load_scripts, catalog.load_scripts.cache_clear),
+        "load_character_info.cold": (
+            lambda: catalog.load_character_info(CHARACTER_FILE), catalog.load_character_info.cache_clear
+        ),
+        "load_character_info.cached": (lambda: catalog.load_character_info(CHARACTER_FILE), None),
+        "get_character_quotes.cold": (
+            lambda: catalog.get_character_quotes(SCRIPT_NAME), catalog.get_quotes_by_character.cache_clear
+        ),
+        "get_character_quotes.cached": (lambda: catalog.get_character_quotes(SCRIPT_NAME), None),
+        "extract_character_summary.cold": (
+            lambda: extract_character_summary(wiki_content), extract_character_summary.cache_clear
+        ),
+        "create_character_prompt": (
+            lambda: chat.create_character_prompt(character_info, quotes, CHARACTER_NAME), None
+        ),
+        "prepare_turn": (
+            lambda: chat.prepare_turn(CHARACTER_NAME, USER_MESSAGE, character_info, quotes, HISTORY, SCRIPT_NAME,
+                                      chat.new_conversation_memory()),
+            None
+        ),
+        "generate_response.overhead": (lambda: run_turn(stream=False), None),
+        "stream_response.overhead": (lambda: run_turn(stream=True), None),
+        # Same turn with realistic model timing; the simulated time is subtracted
+        "stream_response.overhead_with_latency": (
+            lambda: run_turn(stream=True, latency=0.02, tokens_per_second=2000), None
+        ),
+    }
+
+    results = {}
+    for name, (func, setup) in cases.items():
+        results[name] = measure(func, setup, min_time=min_time)
+        print(f"{name:<42} {results[name]['median_us']:>12.1f} us  (p95 {results[name]['p95_us']:.1f}, "
+              f"n={results[name]['iterations']})")
+    return results
+
+
+def compare(results, baseline, tolerance, floor_us):
+    """Return the names of benchmarks whose median is slower than the baseline beyond tolerance."""
+    regressions = []
+    print(f"\n{'benchmark':<42} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            print(f"{name:<42} {'-':>12} {current['median_us']:>12.1f} {'new':>8}")
+            continue
+        ratio = current["median_us"] / previous["median_us"] if previous["median_us"] else float("inf")
+        regressed = ratio > 1 + tolerance and current["median_us"] - previous["median_us"] > floor_us
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{name:<42} {previous['median_us']:>12.1f} {current['median_us']:>12.1f} {ratio - 1:>+8.0%}{marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--floor-us", type=float, default=50.0,
+                        help="Ignore slowdowns smaller than this many microseconds (timer noise)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds to spend timing each benchmark")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": catalog.get_corpus() is not None,
+        },
+        "results": run_benchmarks(args.min_time),
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    if baseline.get("meta", {}).get("corpus") != report["meta"]["corpus"]:
+        print("\nNote: the baseline was recorded with a different data source (compiled corpus vs raw files)")
+    regressions = compare(report["results"], baseline, args.tolerance, args.floor_us)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
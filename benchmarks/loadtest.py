@@ -0,0 +1,349 @@
+"""
+Concurrent-session load test of the Streamlit app against the stub model.
+
+Drives many sessions through app.py at once with Streamlit's AppTest, all in
+this process like sessions in one container, replaying the conversations of a
+conversation-log directory or a built-in set. For each concurrency level
+it reports throughput, turns shed by the model gateway, p50/p95/p99 turn
+latency, CPU use and the memory each live session adds, and points out where
+scaling stops (the knee).
+
+    python benchmarks/loadtest.py --builtin
+    python benchmarks/loadtest.py --logs /srv/tolkien/logs --concurrency 1,4,16,64 --turns 4 --output load.json
+    STUB_LATENCY_SECONDS=1.0 STUB_TOKENS_PER_SECOND=30 python benchmarks/loadtest.py --builtin
+
+Running AppTest sessions concurrently in one process needs two patches to
+Streamlit internals (below), so the script refuses to run on any Streamlit
+release other than the one they were written for.
+
+Turn latency is measured server-side: the script rerun that handles a message,
+including the (simulated) model call and the rendering of the reply.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+APP_PATH = ROOT / "app.py"
+# The Streamlit release the patches below were written for; check them before raising it
+PATCHED_STREAMLIT = "1.65"
+
+# Configure the app before it is first imported; its own logs and stored conversations go to a
+# scratch directory so synthetic sessions never end up in logs/ (and in the next replay)
+SCRATCH_DIR = Path(tempfile.mkdtemp(prefix="loadtest-"))
+os.environ["MODEL_BACKEND"] = "stub"
+os.environ.setdefault("RESPONSE_CACHE", "off")
+os.environ.setdefault("LOG_CONSOLE", "off")
+os.environ["LOG_DIR"] = str(SCRATCH_DIR / "logs")
+os.environ["CONVERSATION_STORE_PATH"] = str(SCRATCH_DIR / "conversations.sqlite3")
+
+import streamlit  # noqa: E402
+
+if not streamlit.__version__.startswith(PATCHED_STREAMLIT + "."):
+    sys.exit(f"loadtest.py patches Streamlit {PATCHED_STREAMLIT}.x internals; "
+             f"Streamlit {streamlit.__version__} is installed")
+
+from streamlit.runtime import Runtime  # noqa: E402
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import chat  # noqa: E402
+
+USER_LINE = re.compile(r'^\[(?P<character>[^\]]+)\] User: (?P<text>.*)$', re.DOTALL)
+LEGACY_USER_LINE = re.compile(r' - INFO - \[(?P<character>[^\]]+)\] User: (?P<text>.*)$')
+MAX_MESSAGE_CHARS = 2000
+
+BUILTIN_CONVERSATIONS = [
+    ("Gandalf", ["Who are you?", "What do you know of the Ring?", "Should I go to Mordor?",
+                 "What happened in Moria?", "Will we see each other again?"]),
+    ("Frodo Baggins", ["How did you leave the Shire?", "What was Sam like on the road?",
+                       "Was the Ring heavy?", "What do you miss most?"]),
+    ("Aragorn", ["Why did you hide your name?", "Tell me about Arwen.", "What happened at Helm's Deep?",
+                 "Are you afraid of the Black Gate?"]),
+    ("Gollum", ["What is your name?", "Where is the precious?", "Do you hate hobbits?",
+                "What are taters?"]),
+    ("Galadriel", ["What did you see in the Mirror?", "Why did you refuse the Ring?",
+                   "What gift did you give Frodo?"]),
+]
+
+# AppTest recompiles the script on every run, from every session thread at once, which both
+# overstates the per-turn cost and trips a CPython 3.11 race in the compiler. A real server
+# keeps one bytecode cache for all sessions; do the same.
+_bytecode = {}
+_bytecode_lock = threading.Lock()
+_original_get_bytecode = ScriptCache.get_bytecode
+
+
+def _shared_get_bytecode(self, script_path):
+    with _bytecode_lock:
+        if script_path not in _bytecode:
+            _bytecode[script_path] = _original_get_bytecode(self, script_path)
+        return _bytecode[script_path]
+
+
+ScriptCache.get_bytecode = _shared_get_bytecode
+
+# Each AppTest run installs a mock Runtime singleton and removes it when done, which pulls
+# it from under the sessions still running. Keep serving the last one installed.
+_last_runtime = None
+
+
+def _runtime_instance(cls):
+    global _last_runtime
+    if cls._instance is not None:
+        _last_runtime = cls._instance
+    if _last_runtime is None:
+        raise RuntimeError("Runtime hasn't been created!")
+    return _last_runtime
+
+
+Runtime.instance = classmethod(_runtime_instance)
+Runtime.exists = classmethod(lambda cls: cls._instance is not None or _last_runtime is not None)
+
+
+def load_conversations(log_dir, max_turns):
+    """(character, [user messages]) per logged session, from JSON-lines and legacy text logs."""
+    sessions = {}
+    for path in sorted(Path(log_dir).glob("conversations_*.jsonl*")):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                match = USER_LINE.match(record.get("message", "")) if record.get("event") == "user_message" else None
+                if match:
+                    key = (record.get("session_id"), match.group("character"))
+                    sessions.setdefault(key, []).append(match.group("text"))
+
+    # Older plain-text logs have no session ids; take each character's messages in order
+    for path in sorted(Path(log_dir).glob("conversations_*.log")):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = LEGACY_USER_LINE.search(line.rstrip("\n"))
+                if match:
+                    sessions.setdefault((path.name, match.group("character")), []).append(match.group("text"))
+
+    conversations = []
+    for (_, character), messages in sessions.items():
+        messages = [m for m in messages if m.strip() and len(m) <= MAX_MESSAGE_CHARS]
+        for start in range(0, len(messages), max_turns):
+            conversations.append((character, messages[start:start + max_turns]))
+    return conversations
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakRss:
+    """Sample RSS in the background and keep the maximum."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def run_session(character, messages, latencies, errors, shed, keep_alive):
+    """Open a session, pick the character and send each message, timing every answered turn.
+
+    Turns the model gateway refused (the app drops the message and asks to retry) count as shed.
+    """
+    try:
+        at = AppTest.from_file(str(APP_PATH), default_timeout=300).run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        if character in at.selectbox[0].options:
+            at.selectbox[0].select(character).run()
+        fallback = chat.fallback_response(at.selectbox[0].value)
+        for message in messages:
+            started = time.perf_counter()
+            at.chat_input[0].set_value(message).run()
+            elapsed = time.perf_counter() - started
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            history = at.session_state.conversation.messages
+            if not history or history[-1]["role"] != "assistant":
+                shed.append(elapsed)
+                continue
+            latencies.append(elapsed)
+            if history[-1]["content"] == fallback:
+                errors.append("fallback reply")
+        keep_alive.append(at)  # Sessions stay alive until the level ends, like open browser tabs
+    except Exception as e:
+        errors.append(repr(e))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def run_level(concurrency, conversations, sessions_per_worker, offset):
+    latencies, errors, shed, keep_alive = [], [], [], []
+
+    def worker(worker_id):
+        for i in range(sessions_per_worker):
+            character, messages = conversations[(offset + worker_id * sessions_per_worker + i) % len(conversations)]
+            run_session(character, messages, latencies, errors, shed, keep_alive)
+
+    gc.collect()
+    rss_before = rss_bytes()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    with PeakRss() as peak:
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    sessions = len(keep_alive)
+    keep_alive.clear()
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "sessions": concurrency * sessions_per_worker,
+        "turns": len(latencies),
+        "errors": len(errors),
+        "shed": len(shed),
+        "error_samples": sorted(set(errors))[:3],
+        "wall_s": round(wall, 3),
+        "throughput_turns_per_s": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_p50_s": round(percentile(latencies, 0.50), 3),
+        "latency_p95_s": round(percentile(latencies, 0.95), 3),
+        "latency_p99_s": round(percentile(latencies, 0.99), 3),
+        "latency_mean_s": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "cpu_cores": round(cpu / wall, 2) if wall else 0.0,
+        "peak_rss_mb": round(peak.peak / 2**20, 1),
+        "memory_per_session_mb": round((peak.peak - rss_before) / 2**20 / sessions, 2) if sessions else 0.0,
+    }
+
+
+def find_knee(levels, min_gain=0.1, max_slowdown=2.0):
+    """First concurrency at which throughput stops growing or p95 latency has doubled since the first level."""
+    if not levels:
+        return None
+    base_p95 = levels[0]["latency_p95_s"] or 1e-9
+    for previous, level in zip(levels, levels[1:]):
+        gain = level["throughput_turns_per_s"] / previous["throughput_turns_per_s"] - 1 \
+            if previous["throughput_turns_per_s"] else 0.0
+        if gain < min_gain or level["latency_p95_s"] > max_slowdown * base_p95:
+            return previous["concurrency"]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32",
+                        help="Comma-separated numbers of simultaneous sessions")
+    parser.add_argument("--sessions-per-worker", type=int, default=2,
+                        help="Conversations each simulated user runs back to back per level")
+    parser.add_argument("--turns", type=int, default=4, help="Maximum messages per conversation")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--logs", type=Path, help="Directory of conversation logs to replay")
+    source.add_argument("--builtin", action="store_true", help="Replay the built-in conversations")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Session threads without a script context make Streamlit warn on every access; AppTest resets
+    # Streamlit's log levels on each run, so filter the records instead
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: record.levelno >= logging.ERROR
+    )
+
+    if args.builtin:
+        conversations = [(character, messages[:args.turns]) for character, messages in BUILTIN_CONVERSATIONS]
+        source = f"{len(conversations)} built-in conversations"
+    else:
+        conversations = load_conversations(args.logs, args.turns)
+        if not conversations:
+            parser.error(f"no user messages found in the conversation logs in {args.logs}")
+        source = f"{len(conversations)} conversations from {args.logs}"
+    print(f"Replaying {source}")
+    print(f"Stub model: {os.environ.get('STUB_LATENCY_SECONDS', '0.5')}s to first token, "
+          f"{os.environ.get('STUB_TOKENS_PER_SECOND', '50')} tokens/s\n")
+
+    # A first session loads the catalogue and indexes, so levels measure steady-state turns
+    run_session(*conversations[0], [], [], [], [])
+
+    header = (f"{'sessions':>8} {'turns':>6} {'shed':>5} {'err':>4} {'turns/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+              f"{'cpu':>5} {'MB/sess':>8} {'rss MB':>7}")
+    print(header)
+    levels = []
+    offset = 0
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        level = run_level(concurrency, conversations, args.sessions_per_worker, offset)
+        offset += level["sessions"]
+        levels.append(level)
+        print(f"{concurrency:>8} {level['turns']:>6} {level['shed']:>5} {level['errors']:>4} {level['throughput_turns_per_s']:>8.2f} "
+              f"{level['latency_p50_s']:>7.2f} {level['latency_p95_s']:>7.2f} {level['latency_p99_s']:>7.2f} "
+              f"{level['cpu_cores']:>5.2f} {level['memory_per_session_mb']:>8.2f} {level['peak_rss_mb']:>7.0f}")
+        for sample in level["error_samples"]:
+            print(f"{'':>8} error: {sample}")
+
+    knee = find_knee(levels)
+    if knee is None:
+        print("\nNo knee within the tested range; try higher concurrency")
+    else:
+        print(f"\nScaling knee at about {knee} concurrent sessions "
+              f"(beyond it throughput stops growing or p95 latency doubles)")
+
+    if args.output:
+        report = {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "conversations": source,
+                "stub_latency_seconds": os.environ.get("STUB_LATENCY_SECONDS", "0.5"),
+                "stub_tokens_per_second": os.environ.get("STUB_TOKENS_PER_SECOND", "50"),
+            },
+            "levels": levels,
+            "knee_concurrency": knee,
+        }
+        args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
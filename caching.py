@@ -0,0 +1,23 @@
+"""
+Process-wide memoization shared by the modules that load things once.
+"""
+
+import functools
+import threading
+
+
+def load_once(func):
+    """Memoize a zero-argument loader for the process; concurrent callers wait for the first call."""
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(func)
+    def wrapper():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(func())
+        return result[0]
+
+    wrapper.cache_clear = result.clear
+    return wrapper
@@ -0,0 +1,396 @@
+"""
+Character catalogue: wiki pages, movie quotes and the retrieval indexes over them.
+
+Loaded once per process and shared by every session, independent of Streamlit,
+so the warm-up thread (warmup.py) can fill the caches before the first visitor.
+pandas and NumPy are only imported when the raw data files or an index need them.
+"""
+
+import functools
+import logging
+import os
+from pathlib import Path
+from types import MappingProxyType
+
+from caching import load_once
+from character_store import is_safe_filename, open_character_store
+from corpus import CorpusIndex, CorpusFormatError
+from memory import token_estimator
+from wiki import extract_character_summary, parse_wiki_page, split_passages
+
+logger = logging.getLogger(__name__)
+
+# Paths
+CHARACTERS_DIR = Path(__file__).parent / "characters"
+# Wiki files are served from the archive when CHARACTERS_DIR has not been extracted
+CHARACTERS_ZIP = Path(__file__).parent / "characters.zip"
+CHARACTER_CACHE_SIZE = int(os.environ.get("CHARACTER_CACHE_SIZE", "32"))
+SCRIPTS_CSV = Path(__file__).parent / "lotr_scripts.csv"
+
+# Compiled corpus (build with `python corpus.py build`); used instead of the CSV/wiki files when present
+CORPUS_PATH = Path(os.environ.get("CORPUS_PATH", Path(__file__).parent / "corpus.bin"))
+# Voice profiles (build with `python voice.py build`); computed on first use when missing or stale
+VOICE_PROFILES_PATH = Path(os.environ.get("VOICE_PROFILES_PATH", Path(__file__).parent / "voice_profiles.json"))
+
+LORE_PASSAGE_CHARS = 600
+
+# Map script names to display names and wiki file names
+NAME_MAPPING = {
+    "GANDALF": ("Gandalf", "Gandalf.txt"),
+    "FRODO": ("Frodo Baggins", "Frodo_Baggins.txt"),
+    "SAM": ("Samwise Gamgee", "Samwise_Gamgee.txt"),
+    "ARAGORN": ("Aragorn", "Aragorn_II_Elessar.txt"),
+    "LEGOLAS": ("Legolas", "Legolas.txt"),
+    "GIMLI": ("Gimli", "Gimli.txt"),
+    "BOROMIR": ("Boromir", "Boromir.txt"),
+    "MERRY": ("Meriadoc Brandybuck", "Meriadoc_Brandybuck.txt"),
+    "PIPPIN": ("Peregrin Took", "Peregrin_Took.txt"),
+    "GOLLUM": ("Gollum", "Gollum.txt"),
+    "SARUMAN": ("Saruman", "Saruman.txt"),
+    "ELROND": ("Elrond", "Elrond.txt"),
+    "GALADRIEL": ("Galadriel", "Galadriel.txt"),
+    "ARWEN": ("Arwen", "Arwen.txt"),
+    "THÉODEN": ("Théoden", "Théoden.txt"),
+    "THEODEN": ("Théoden", "Théoden.txt"),
+    "ÉOWYN": ("Éowyn", "Éowyn.txt"),
+    "EOWYN": ("Éowyn", "Éowyn.txt"),
+    "ÉOMER": ("Éomer", "Éomer.txt"),
+    "EOMER": ("Éomer", "Éomer.txt"),
+    "FARAMIR": ("Faramir", "Faramir.txt"),
+    "DENETHOR": ("Denethor II", "Denethor_II.txt"),
+    "TREEBEARD": ("Treebeard", "Treebeard.txt"),
+    "BILBO": ("Bilbo Baggins", "Bilbo_Baggins.txt"),
+    "WITCH-KING": ("Witch-king of Angmar", "Witch-king_of_Angmar.txt"),
+    "GRIMA": ("Gríma Wormtongue", "Gríma_Wormtongue.txt"),
+    "WORMTONGUE": ("Gríma Wormtongue", "Gríma_Wormtongue.txt"),
+    "CELEBORN": ("Celeborn", "Celeborn.txt"),
+    "HALDIR": ("Haldir", "Haldir_(Lorien).txt"),
+    "GAMLING": ("Gamling", "Gamling.txt"),
+    "BARLIMAN": ("Barliman Butterbur", "Barliman_Butterbur.txt"),
+}
+
+
+@load_once
+def get_corpus():
+    """Memory-map the compiled corpus, or return None to fall back to the raw data files."""
+    if not CORPUS_PATH.exists():
+        logger.info(f"No compiled corpus at {CORPUS_PATH}, loading raw data files")
+        return None
+
+    try:
+        corpus = CorpusIndex(CORPUS_PATH)
+    except CorpusFormatError as e:
+        logger.warning(f"Ignoring compiled corpus: {str(e)}")
+        return None
+
+    if corpus.is_stale(SCRIPTS_CSV, CHARACTERS_DIR, CHARACTERS_ZIP):
+        logger.warning(f"Compiled corpus {CORPUS_PATH} is older than the data files, loading raw data files")
+        corpus.close()
+        return None
+
+    logger.info(f"Using compiled corpus {CORPUS_PATH}")
+    return corpus
+
+
+@load_once
+def get_character_store():
+    """Open the wiki file store: the extracted directory if present, else characters.zip."""
+    store = open_character_store(CHARACTERS_DIR, CHARACTERS_ZIP, cache_size=CHARACTER_CACHE_SIZE)
+    if store is None:
+        logger.error(f"No character data found at {CHARACTERS_DIR} or {CHARACTERS_ZIP}")
+    else:
+        logger.info(f"Serving character files from {store.source}")
+    return store
+
+
+@load_once
+def load_scripts():
+    """Load the movie scripts CSV file."""
+    import pandas as pd
+
+    try:
+        df = pd.read_csv(SCRIPTS_CSV)
+        # Clean up column names
+        df.columns = df.columns.str.strip()
+        return df
+    except Exception as e:
+        logger.error(f"Error loading scripts: {str(e)}", exc_info=True)
+        return pd.DataFrame()
+
+
+@functools.lru_cache(maxsize=CHARACTER_CACHE_SIZE)
+def load_character_info(character_filename):
+    """Load character information from text file."""
+    try:
+        # Security: Prevent path traversal attacks
+        if not is_safe_filename(character_filename):
+            logger.warning(f"Invalid character filename detected: {character_filename}")
+            return None, None
+
+        corpus = get_corpus()
+        if corpus is not None and corpus.has_wiki(character_filename):
+            return corpus.get_wiki(character_filename)
+
+        # The store re-checks that the file stays within the characters directory
+        store = get_character_store()
+        content = store.read_text(character_filename) if store is not None else None
+        if content is None:
+            logger.warning(f"Character file not found: {character_filename}")
+            return None, None
+
+        return parse_wiki_page(content)
+    except Exception as e:
+        logger.error(f"Error loading character info for {character_filename}: {str(e)}", exc_info=True)
+        return None, None
+
+
+@load_once
+def get_quotes_by_character():
+    """Each speaker's curated quote set (see quote_sets.py), once per process.
+
+    Returns a read-only mapping of SPEAKER -> tuple of {'dialog', 'movie'} dicts, best first.
+    """
+    corpus = get_corpus()
+    if corpus is not None:
+        grouped = {name: tuple(corpus.get_quotes(name)) for name in corpus.character_names}
+        return MappingProxyType(grouped)
+
+    scripts_df = load_scripts()
+    if scripts_df.empty:
+        return MappingProxyType({})
+
+    import pandas as pd
+
+    from quote_sets import curate_quotes
+
+    # Clean every column once, then split into speakers in a single groupby pass
+    speaker = scripts_df['char'].astype(str).str.upper().str.strip()
+    dialog = scripts_df['dialog'].astype(str).str.strip()
+    movie = scripts_df['movie'].astype(str).str.strip()
+    valid = dialog.ne('') & dialog.ne('nan') & scripts_df['char'].notna()
+    quotes = pd.DataFrame({'speaker': speaker, 'dialog': dialog, 'movie': movie})[valid]
+
+    curated = curate_quotes({
+        name: list(zip(group['dialog'], group['movie'])) for name, group in quotes.groupby('speaker', sort=False)
+    })
+    grouped = {
+        name: tuple({'dialog': dialog, 'movie': movie} for dialog, movie in pairs) for name, pairs in curated.items()
+    }
+    logger.info(f"Curated {sum(map(len, grouped.values()))} of {int(valid.sum())} quotes for {len(grouped)} speakers")
+    return MappingProxyType(grouped)
+
+
+def get_character_quotes(character_name):
+    """Get all quotes for a specific character."""
+    return get_quotes_by_character().get(character_name.upper(), ())
+
+
+@load_once
+def get_quote_index():
+    """Build the BM25 index over every script quote, grouped by speaker.
+
+    Returns (index, quotes) where index doc ids point into the quotes list.
+    """
+    from retrieval import BM25Index
+
+    quotes, groups = [], []
+    for speaker, speaker_quotes in get_quotes_by_character().items():
+        quotes.extend(speaker_quotes)
+        groups.extend([speaker] * len(speaker_quotes))
+
+    index = BM25Index([q['dialog'] for q in quotes], groups=groups)
+    logger.info(f"Built quote index: {len(quotes)} quotes, {len(index.vocabulary)} terms")
+    return index, quotes
+
+
+def find_relevant_quotes(script_name, user_message, k, skip_first=0):
+    """Get the character's quotes most relevant to the user's message, best first.
+
+    The first skip_first quotes of the character (those shown in the system prompt) are never returned.
+    """
+    if not script_name or k <= 0:
+        return []
+
+    index, quotes = get_quote_index()
+    shown_quotes = index.group_members(script_name.upper())[:skip_first]
+    hits = index.search(user_message, k=k, group=script_name.upper(), exclude=shown_quotes)
+    return [quotes[doc_id] for doc_id, _ in hits]
+
+
+@load_once
+def get_lore_index():
+    """Build the BM25 index over wiki passages of every available character, grouped by page title.
+
+    Returns (index, passages) where passages are (heading, text) pairs.
+    """
+    from retrieval import BM25Index
+
+    passages, groups = [], []
+    for filename in sorted({c['filename'] for c in get_available_characters()}):
+        title, wiki_content = load_character_info(filename)
+        if not wiki_content:
+            continue
+        for passage in split_passages(wiki_content, max_chars=LORE_PASSAGE_CHARS):
+            passages.append(passage)
+            groups.append(title)
+
+    # Index headings with the text so "early life"-style questions find their section
+    index = BM25Index([f"{heading} {text}" for heading, text in passages], groups=groups)
+    logger.info(f"Built lore index: {len(passages)} passages, {len(index.vocabulary)} terms")
+    return index, passages
+
+
+def find_relevant_lore(character_info, user_message, k, token_budget):
+    """Get the wiki passages most relevant to the user's message that fit in the token budget."""
+    title = character_info[0] if character_info else None
+    if not title or k <= 0 or token_budget <= 0:
+        return []
+
+    index, passages = get_lore_index()
+    selected, used_tokens = [], 0
+    for doc_id, _ in index.search(user_message, k=k, group=title):
+        cost = token_estimator.estimate(passages[doc_id][1])
+        if used_tokens + cost > token_budget:
+            continue
+        selected.append(passages[doc_id])
+        used_tokens += cost
+    return selected
+
+
+@load_once
+def get_search_index():
+    """Build the full-text index behind the sidebar search: every quote and every wiki passage.
+
+    Returns (index, entries, facets). entries are {'kind', 'character', 'movie', 'heading', 'text'}
+    dicts in index order ('quote' or 'lore'; lore has no movie). facets maps (character, movie) pairs,
+    with None for "any", to the ids of the matching entries.
+    """
+    from retrieval import BM25Index
+
+    entries = []
+    for speaker, speaker_quotes in get_quotes_by_character().items():
+        character = NAME_MAPPING[speaker][0] if speaker in NAME_MAPPING else speaker.title()
+        entries.extend({'kind': 'quote', 'character': character, 'movie': quote['movie'], 'heading': None,
+                        'text': quote['dialog']} for quote in speaker_quotes)
+    for character in get_available_characters():
+        _, wiki_content = load_character_info(character['filename'])
+        for heading, text in split_passages(wiki_content or "", max_chars=LORE_PASSAGE_CHARS):
+            entries.append({'kind': 'lore', 'character': character['display_name'], 'movie': None,
+                            'heading': heading, 'text': text})
+
+    facets = {}
+    for entry_id, entry in enumerate(entries):
+        for key in ((entry['character'], None), (None, entry['movie']), (entry['character'], entry['movie'])):
+            if key != (None, None):
+                facets.setdefault(key, []).append(entry_id)
+
+    index = BM25Index([f"{entry['heading'] or ''} {entry['text']}" for entry in entries])
+    logger.info(f"Built search index: {len(entries)} entries, {len(index.vocabulary)} terms")
+    return index, entries, MappingProxyType(facets)
+
+
+def get_search_filters():
+    """The characters and movies the search can be narrowed to, sorted."""
+    _, _, facets = get_search_index()
+    return sorted({character for character, _ in facets if character}), sorted({movie for _, movie in facets if movie})
+
+
+def search_catalog(query, character=None, movie=None, k=10):
+    """Quotes and wiki passages matching a query as typed so far, best first.
+
+    The last word of the query also matches as a prefix. character (display name) and movie narrow
+    the search; a movie leaves only quotes.
+    """
+    index, entries, facets = get_search_index()
+    within = facets.get((character, movie), ()) if character or movie else None
+    return [entries[entry_id] for entry_id, _ in index.search(query, k=k, prefix=True, within=within)]
+
+
+@load_once
+def get_available_characters():
+    """Get the characters that have both wiki info and movie quotes, sorted by display name."""
+    corpus = get_corpus()
+
+    # Get characters with quotes in the scripts and the wiki files that exist
+    script_characters = set(get_quotes_by_character())
+    wiki_files = set()
+    if corpus is not None:
+        wiki_files = set(corpus.wiki_filenames)
+    else:
+        store = get_character_store()
+        if store is not None:
+            wiki_files = set(store.list_files())
+
+    # Build list of characters with proper display names
+    available = []
+    for script_name in script_characters:
+        if script_name in NAME_MAPPING:
+            display_name, filename = NAME_MAPPING[script_name]
+            if filename in wiki_files:
+                available.append({
+                    'display_name': display_name,
+                    'script_name': script_name,
+                    'filename': filename
+                })
+
+    # Sort by display name
+    available.sort(key=lambda x: x['display_name'])
+
+    return tuple(available)
+
+
+def find_character(identifier):
+    """Look a character up by display name, wiki file name (with or without .txt) or script name; None if unknown."""
+    for character in get_available_characters():
+        if identifier in (character['display_name'], character['filename'], character['script_name'],
+                          character['filename'].rsplit('.', 1)[0]):
+            return character
+    return None
+
+
+@load_once
+def get_voice_profiles():
+    """Voice profiles by normalized script speaker: the prebuilt file when current, else computed now."""
+    from voice import build_profiles, load_profiles
+
+    if VOICE_PROFILES_PATH.exists():
+        built = VOICE_PROFILES_PATH.stat().st_mtime
+        if SCRIPTS_CSV.exists() and SCRIPTS_CSV.stat().st_mtime > built:
+            logger.warning(f"Voice profiles {VOICE_PROFILES_PATH} are older than the scripts, recomputing them")
+        else:
+            profiles = load_profiles(VOICE_PROFILES_PATH)
+            if profiles is not None:
+                logger.info(f"Using voice profiles {VOICE_PROFILES_PATH}")
+                return MappingProxyType(profiles)
+
+    # Every script line counts here, not only the curated quote sets
+    if SCRIPTS_CSV.exists():
+        from corpus import read_script_quotes
+
+        quotes_by_speaker = read_script_quotes(SCRIPTS_CSV)
+        lines = {speaker: [dialog for dialog, _ in quotes] for speaker, quotes in quotes_by_speaker.items()}
+    else:
+        quotes_by_speaker = get_quotes_by_character()
+        lines = {speaker: [quote['dialog'] for quote in quotes] for speaker, quotes in quotes_by_speaker.items()}
+    profiles = build_profiles(lines)
+    logger.info(f"Computed voice profiles for {len(profiles)} speakers")
+    return MappingProxyType(profiles)
+
+
+@functools.lru_cache(maxsize=None)
+def get_voice_profile(character_name):
+    """The voice profile of a character, by display or script name; None for characters with few lines."""
+    character = find_character(character_name)
+    script_name = character['script_name'] if character is not None else character_name
+    return get_voice_profiles().get(script_name.upper())
+
+
+@functools.lru_cache(maxsize=None)
+def get_character_summary(character_filename):
+    """Get the stripped wiki summary for a character, precomputed when the corpus is compiled."""
+    corpus = get_corpus()
+    if corpus is not None and corpus.has_wiki(character_filename):
+        return corpus.get_summary(character_filename)
+
+    _, wiki_content = load_character_info(character_filename)
+    return extract_character_summary(wiki_content)
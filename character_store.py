@@ -0,0 +1,125 @@
+"""
+Storage backends for the character wiki dumps.
+
+The files can be served from an extracted `characters/` directory or directly
+from `characters.zip`, in which case members are decompressed on demand and a
+bounded LRU keeps the most recently decoded ones.
+"""
+
+import logging
+import threading
+import zipfile
+from collections import OrderedDict
+from pathlib import Path, PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+CHARACTER_FILE_SUFFIX = ".txt"
+
+
+def is_safe_filename(filename):
+    """Reject names that could escape the character store (path traversal)."""
+    return bool(filename) and '..' not in filename and '/' not in filename and '\\' not in filename
+
+
+def _member_name(info):
+    """Decode a member name, recovering UTF-8 names stored without the UTF-8 flag.
+
+    zipfile falls back to cp437 for such names, which mangles e.g. "Théoden.txt".
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('utf-8')
+    except UnicodeError:
+        return info.filename
+
+
+class DirectoryCharacterStore:
+    """Character files in an extracted directory."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.source = self.root
+
+    def list_files(self):
+        return sorted(p.name for p in self.root.glob(f"*{CHARACTER_FILE_SUFFIX}"))
+
+    def _path(self, filename):
+        if not is_safe_filename(filename):
+            return None
+        filepath = self.root / filename
+        # Security: Ensure file is within the characters directory
+        if not str(filepath.resolve()).startswith(str(self.root.resolve())):
+            return None
+        return filepath
+
+    def exists(self, filename):
+        filepath = self._path(filename)
+        return filepath is not None and filepath.is_file()
+
+    def read_text(self, filename):
+        """Return the file contents, or None if it is not in the store."""
+        filepath = self._path(filename)
+        if filepath is None or not filepath.is_file():
+            return None
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+class ZipCharacterStore:
+    """Character files read straight from a zip archive with lazy random access."""
+
+    def __init__(self, archive_path, cache_size=32):
+        self.source = Path(archive_path)
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._zip = zipfile.ZipFile(self.source)
+
+        # Index members once by bare filename; the archive keeps them under characters/
+        self._members = {}
+        for info in self._zip.infolist():
+            member = PurePosixPath(_member_name(info))
+            if info.is_dir() or member.suffix != CHARACTER_FILE_SUFFIX or len(member.parts) > 2:
+                continue
+            if not is_safe_filename(member.name):
+                logger.warning(f"Skipping unsafe archive member: {info.filename}")
+                continue
+            self._members[member.name] = info
+
+    def list_files(self):
+        return sorted(self._members)
+
+    def exists(self, filename):
+        return filename in self._members
+
+    def read_text(self, filename):
+        """Return the decoded member, or None if it is not in the archive."""
+        info = self._members.get(filename)
+        if info is None:
+            return None
+
+        with self._lock:
+            if filename in self._cache:
+                self._cache.move_to_end(filename)
+                return self._cache[filename]
+            # ZipFile reads share one file handle, so decompress under the lock
+            text = self._zip.read(info).decode('utf-8')
+            self._cache[filename] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return text
+
+    def close(self):
+        self._zip.close()
+
+
+def open_character_store(characters_dir, archive_path, cache_size=32):
+    """Open the extracted directory if present, otherwise the zip archive; None if neither exists."""
+    characters_dir, archive_path = Path(characters_dir), Path(archive_path)
+    if characters_dir.is_dir():
+        return DirectoryCharacterStore(characters_dir)
+    if archive_path.is_file():
+        return ZipCharacterStore(archive_path, cache_size=cache_size)
+    return None
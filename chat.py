@@ -0,0 +1,570 @@
+"""
+Character replies from Gemini on Vertex AI.
+
+Builds each character's cached system prompt and the per-turn input (memory
+window, retrieved quotes and lore), and generates replies, whole or streamed,
+through the persistent response cache. Independent of Streamlit; vertexai is
+only imported when the first model is needed.
+"""
+
+import contextvars
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from pathlib import Path
+
+import metrics
+from caching import load_once
+from catalog import find_relevant_lore, find_relevant_quotes, get_voice_profile
+from gateway import Rejected, get_gateway
+from logging_config import set_log_context
+from memory import ConversationMemory, extractive_summarizer, token_estimator
+from resilience import ModelChain, is_retryable
+from response_cache import ResponseCache, make_cache_key
+from wiki import extract_character_summary
+
+logger = logging.getLogger(__name__)
+
+# Update these with your Google Cloud settings
+PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT_ID")
+LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
+# Models tried in order: each gets retries, then the next one answers (see resilience.py)
+MODEL_NAMES = [name.strip() for name in os.environ.get("MODEL_NAMES", "gemini-2.5-flash,gemini-2.0-flash").split(",")
+               if name.strip()]
+if not MODEL_NAMES:
+    raise ValueError("MODEL_NAMES names no models")
+# "stub" replaces Gemini with the offline stand-in in stub_model.py (benchmarks, load tests)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "vertex").lower()
+
+# Prompt prefix caching: each character's system prompt is built once and bound to a
+# model as a reusable prefix. "local" keeps an in-process LRU of models carrying the prompt
+# as a system_instruction; "vertex" additionally stores the prefix as server-side cached
+# content (falling back to "local" if that fails, e.g. the prompt is below the minimum size).
+PROMPT_CACHE_BACKEND = os.environ.get("PROMPT_CACHE_BACKEND", "local").lower()
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "64"))
+PROMPT_CACHE_TTL_SECONDS = int(os.environ.get("PROMPT_CACHE_TTL_SECONDS", "3600"))
+
+# Quotes in the cached system prompt (voice examples) and retrieved per turn by relevance
+PROMPT_QUOTE_COUNT = int(os.environ.get("PROMPT_QUOTE_COUNT", "5"))
+RELEVANT_QUOTES_K = int(os.environ.get("RELEVANT_QUOTES_K", "8"))
+# A character's voice profile (voice.py) conveys how they speak, so fewer quotes are needed
+# for it: the prompt and each turn then carry these many quotes instead of the two above
+VOICE_PROFILES_ENABLED = os.environ.get("VOICE_PROFILES", "on").lower() not in ("0", "off", "false", "no")
+VOICE_PROFILE_QUOTE_COUNT = int(os.environ.get("VOICE_PROFILE_QUOTE_COUNT", "0"))
+VOICE_PROFILE_RELEVANT_QUOTES_K = int(os.environ.get("VOICE_PROFILE_RELEVANT_QUOTES_K", "2"))
+
+# Wiki passages retrieved per turn, within a fixed token budget
+LORE_PASSAGES_K = int(os.environ.get("LORE_PASSAGES_K", "4"))
+LORE_TOKEN_BUDGET = int(os.environ.get("LORE_TOKEN_BUDGET", "400"))
+
+# Conversation memory: newest turns fill the history budget, older ones are folded into a
+# rolling summary ("extractive" keeps the first sentence of each turn, "model" asks Gemini)
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1500"))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", "300"))
+MEMORY_SUMMARIZER = os.environ.get("MEMORY_SUMMARIZER", "extractive").lower()
+# Model summaries queue in the gateway as this one tenant, so together they take one
+# round-robin turn among the sessions instead of one per session
+SUMMARY_GATEWAY_TENANT = "memory-summaries"
+
+# Longest user message accepted, in characters
+MAX_INPUT_LENGTH = 2000
+
+# Council mode: replies of one council turn generated at the same time (the gateway
+# still bounds model calls across all sessions)
+COUNCIL_MAX_CONCURRENT = int(os.environ.get("COUNCIL_MAX_CONCURRENT", "4"))
+# Council replies are stored as "**Name:** reply"
+COUNCIL_SPEAKER_PATTERN = re.compile(r"\*\*(?P<name>[^*\n]+):\*\* ")
+
+GENERATION_CONFIG = {
+    "max_output_tokens": 1024,
+    "temperature": 0.9,
+    "top_p": 0.95,
+}
+
+# Response cache: repeated questions in the same conversation state are answered from disk.
+# Set RESPONSE_CACHE=off when sampling variety matters more than cost and latency.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE", "on").lower() not in ("0", "off", "false", "no")
+RESPONSE_CACHE_PATH = Path(os.environ.get("RESPONSE_CACHE_PATH", Path(__file__).parent / "cache" / "responses.sqlite3"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+# Replies depend on the model, its sampling settings and the prompt layout
+RESPONSE_CACHE_NAMESPACE = (f"{MODEL_NAMES[0]}|{sorted(GENERATION_CONFIG.items())}|{PROMPT_QUOTE_COUNT}|{RELEVANT_QUOTES_K}"
+                            f"|{VOICE_PROFILES_ENABLED and (VOICE_PROFILE_QUOTE_COUNT, VOICE_PROFILE_RELEVANT_QUOTES_K)}")
+
+# (character_name, model_name) -> (model, created_at), least recently used first
+_character_models = OrderedDict()
+_character_models_lock = threading.Lock()
+
+
+@load_once
+def initialize_vertex_ai():
+    """Initialize Vertex AI."""
+    if MODEL_BACKEND == "stub":
+        return True
+    try:
+        import vertexai
+
+        vertexai.init(project=PROJECT_ID, location=LOCATION)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to initialize Vertex AI: {str(e)}", exc_info=True)
+        # Don't expose error details to users in production
+        return False
+
+
+@load_once
+def get_response_cache():
+    """Open the persistent response cache, or return None when it is disabled or unavailable."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    try:
+        return ResponseCache(
+            RESPONSE_CACHE_PATH,
+            ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES
+        )
+    except Exception as e:
+        logger.error(f"Response cache unavailable, continuing without it: {str(e)}", exc_info=True)
+        return None
+
+
+@load_once
+def get_model_chain():
+    """The retrying, circuit-breaking fallback chain over MODEL_NAMES, shared by all sessions."""
+    return ModelChain(MODEL_NAMES, slots=get_gateway())
+
+
+def get_model(system_instruction=None, model_name=None):
+    """Get a Gemini model (the first in the chain unless model_name is given)."""
+    if MODEL_BACKEND == "stub":
+        from stub_model import StubGenerativeModel as GenerativeModel
+    else:
+        from vertexai.generative_models import GenerativeModel
+
+    return GenerativeModel(model_name or MODEL_NAMES[0], system_instruction=system_instruction)
+
+
+def create_cached_prefix_model(character_name, system_prompt, model_name):
+    """Store a system prompt as server-side cached content and return a model bound to it."""
+    from vertexai.preview import caching
+    from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+
+    # Outlive the local cache entry so we never hold a handle to expired server content
+    cached_content = caching.CachedContent.create(
+        model_name=model_name,
+        system_instruction=system_prompt,
+        ttl=timedelta(seconds=PROMPT_CACHE_TTL_SECONDS + 300),
+        display_name=f"tolkien-{re.sub(r'[^a-z0-9-]+', '-', character_name.lower())}"
+    )
+    logger.info(f"[{character_name}] Created server-side prompt cache: {cached_content.name}")
+    return PreviewGenerativeModel.from_cached_content(cached_content=cached_content)
+
+
+def prompt_voice(character_name):
+    """(voice profile or None, quotes in the system prompt, quotes retrieved per turn) for a character."""
+    profile = get_voice_profile(character_name) if VOICE_PROFILES_ENABLED else None
+    if profile:
+        return profile, VOICE_PROFILE_QUOTE_COUNT, VOICE_PROFILE_RELEVANT_QUOTES_K
+    return None, PROMPT_QUOTE_COUNT, RELEVANT_QUOTES_K
+
+
+def create_character_prompt(character_info, quotes, character_name):
+    """Create the system prompt for the character."""
+
+    # Extract summary from wiki content
+    _, wiki_content = character_info if character_info else (None, None)
+    summary = extract_character_summary(wiki_content) if wiki_content else ""
+
+    # The measured voice profile, when there is one, replaces the example quotes
+    profile, quote_count, _ = prompt_voice(character_name)
+    voice = ""
+    if profile:
+        from voice import describe_voice
+
+        voice = f"\nHOW {character_name.upper()} SPEAKS IN THE FILMS (measured from their lines):\n{describe_voice(profile)}\n"
+
+    # Format some example quotes (more are retrieved per turn by relevance)
+    quote_examples = ""
+    if quotes and quote_count > 0:
+        quote_examples = "\n".join([f'- "{q["dialog"]}" ({q["movie"]})' for q in quotes[:quote_count]])
+        quote_examples = f"""
+EXAMPLE QUOTES FROM THE FILMS (use these to understand speech patterns and vocabulary):
+{quote_examples}
+"""
+    style_source = "described and quoted" if profile and quote_examples else "described" if profile else "from the quotes"
+
+    prompt = f"""You are {character_name} from J.R.R. Tolkien's "The Lord of the Rings" as portrayed in Peter Jackson's film trilogy.
+
+CHARACTER BACKGROUND:
+{summary}
+{voice}{quote_examples}
+ROLEPLAY INSTRUCTIONS:
+1. Stay completely in character as {character_name} at all times
+2. Speak in the same manner and style as shown in the films - match the vocabulary, tone, and speech patterns {style_source} above
+3. Reference events, places, and people from Middle-Earth appropriately based on what {character_name} would know
+4. Express the personality, wisdom, fears, hopes, and motivations that {character_name} displays in the films
+5. Use appropriate expressions, oaths, or phrases the character might use (e.g., Gandalf might say "Fool of a Took!" or reference his pipe-weed)
+6. If asked about things outside Middle-Earth or the character's knowledge, respond as the character would - with confusion, curiosity, or by relating it to something they do understand
+7. Keep responses conversational and engaging, as if truly speaking with someone
+8. Never break character or acknowledge being an AI
+
+Remember: You ARE {character_name}. Respond as they would, with their voice, their concerns, and their perspective on the world."""
+
+    return prompt
+
+
+def _create_character_model(character_name, character_info, quotes, model_name):
+    system_prompt = create_character_prompt(character_info, quotes, character_name)
+
+    if PROMPT_CACHE_BACKEND == "vertex" and MODEL_BACKEND != "stub":
+        try:
+            return create_cached_prefix_model(character_name, system_prompt, model_name)
+        except Exception as e:
+            logger.warning(f"[{character_name}] Server-side prompt cache unavailable, using local prefix: {str(e)}")
+
+    logger.info(f"[{character_name}] Cached system prompt locally for {model_name} ({len(system_prompt)} chars)")
+    return get_model(system_instruction=system_prompt, model_name=model_name)
+
+
+def get_character_model(character_name, character_info, quotes, model_name=None):
+    """Get a model with the character's system prompt attached as a reusable prefix.
+
+    Cached per character and model (LRU of PROMPT_CACHE_SIZE; entries expire with the
+    server-side cache when PROMPT_CACHE_BACKEND is "vertex"), so the prompt is
+    built once rather than on every turn. Fallback models are only created when needed.
+    """
+    model_name = model_name or MODEL_NAMES[0]
+    key = (character_name, model_name)
+    ttl = PROMPT_CACHE_TTL_SECONDS if PROMPT_CACHE_BACKEND == "vertex" else None
+    with _character_models_lock:
+        entry = _character_models.get(key)
+        if entry is not None and (ttl is None or time.monotonic() - entry[1] < ttl):
+            _character_models.move_to_end(key)
+            return entry[0]
+
+    model = _create_character_model(character_name, character_info, quotes, model_name)
+    with _character_models_lock:
+        _character_models[key] = (model, time.monotonic())
+        _character_models.move_to_end(key)
+        while len(_character_models) > PROMPT_CACHE_SIZE:
+            _character_models.popitem(last=False)
+    return model
+
+
+def warm_model_client(model):
+    """Open the model's client (credentials and channel) ahead of the first call.
+
+    The SDK connects lazily, so this makes a real request: count_tokens, which is not billed.
+    """
+    if MODEL_BACKEND == "stub":
+        return
+    model.count_tokens("Hello")
+
+
+def build_conversation(character_name, user_message, chat_history, relevant_quotes=(), relevant_lore=(), summary=""):
+    """Build the per-turn model input: conversation summary, recent history, retrieved context and the new message.
+
+    The system prompt is not included; it travels as the model's cached prefix.
+    chat_history should already be trimmed to the memory window.
+    """
+    parts = []
+
+    if summary:
+        parts.append(f"[Earlier in this conversation:\n{summary}]")
+
+    # Build conversation history (in council mode, other characters' replies carry their name)
+    for msg in chat_history:
+        role = "User" if msg["role"] == "user" else msg.get("name", character_name)
+        parts.append(f"{role}: {msg['content']}")
+
+    if relevant_lore:
+        lore_lines = "\n\n".join([f"({heading}) {text}" if heading else text for heading, text in relevant_lore])
+        parts.append(f"[What {character_name} knows that relates to the next message:\n{lore_lines}]")
+
+    if relevant_quotes:
+        quote_lines = "\n".join([f'- "{q["dialog"]}" ({q["movie"]})' for q in relevant_quotes])
+        parts.append(f"[Lines {character_name} has spoken in the films that relate to the next message:\n{quote_lines}]")
+
+    parts.append(f"User: {user_message}")
+    parts.append(f"{character_name}:")
+
+    return "\n\n".join(parts)
+
+
+def summarize_with_model(summary, messages, character_name, token_budget):
+    """Fold older messages into the rolling summary using the model.
+
+    The call waits for a gateway slot like a reply does; when it is not admitted, the
+    memory falls back to the extractive summary.
+    """
+    transcript = "\n".join(
+        f"{'User' if msg['role'] == 'user' else character_name}: {msg['content']}" for msg in messages
+    )
+    prompt = (
+        f"Update this summary of a conversation between a user and {character_name} with the new messages. "
+        f"Keep the facts, names and promises that matter later. Reply with the summary only, "
+        f"in at most {token_budget * 3 // 4} words.\n\n"
+        f"SUMMARY SO FAR:\n{summary or '(none)'}\n\nNEW MESSAGES:\n{transcript}"
+    )
+    with get_gateway().slot(SUMMARY_GATEWAY_TENANT, rate_limited=False):
+        response, _ = get_model_chain().call(
+            lambda model_name: get_model(model_name=model_name),
+            lambda model: model.generate_content(
+                prompt, generation_config={"max_output_tokens": token_budget, "temperature": 0.2}
+            )
+        )
+    return response.text.strip()
+
+
+def new_conversation_memory():
+    """Create the per-session conversation memory."""
+    summarizer = summarize_with_model if MEMORY_SUMMARIZER == "model" else extractive_summarizer
+    return ConversationMemory(
+        token_budget=HISTORY_TOKEN_BUDGET,
+        summary_token_budget=SUMMARY_TOKEN_BUDGET,
+        summarizer=summarizer
+    )
+
+
+def prepare_turn(character_name, user_message, character_info, quotes, chat_history, script_name, memory):
+    """Get the character's models, the per-turn input and the response cache key for a message.
+
+    The models are returned as a function of the model name, for the fallback chain.
+    """
+    def models(model_name):
+        return get_character_model(character_name, character_info, quotes, model_name)
+
+    models(MODEL_NAMES[0])  # Build the system prompt as part of preparing the turn
+
+    if memory is None:
+        memory = new_conversation_memory()
+    summary, recent_history = memory.window(chat_history, character_name)
+
+    # Skip the quotes the cached system prompt already shows
+    _, prompt_quotes, relevant_quotes_k = prompt_voice(character_name)
+    relevant_quotes = find_relevant_quotes(script_name, user_message, relevant_quotes_k, skip_first=prompt_quotes)
+    relevant_lore = find_relevant_lore(character_info, user_message, LORE_PASSAGES_K, LORE_TOKEN_BUDGET)
+    conversation = build_conversation(
+        character_name, user_message, recent_history, relevant_quotes, relevant_lore, summary
+    )
+    cache_key = make_cache_key(RESPONSE_CACHE_NAMESPACE, character_name, user_message, summary, recent_history)
+    return models, conversation, cache_key
+
+
+def record_usage(character_name, text, response):
+    """Record the response's token usage and refine the local token estimate from it."""
+    usage = getattr(response, "usage_metadata", None)
+    metrics.record_usage(character_name, usage)
+    token_count = getattr(usage, "candidates_token_count", 0) if usage is not None else 0
+    if token_count:
+        token_estimator.calibrate(text, token_count)
+
+
+def fallback_response(character_name):
+    """User-friendly reply used when the model call fails."""
+    return f"*{character_name} seems lost in thought* Forgive me, I cannot speak clearly at this moment. Please try again."
+
+
+def generate_response(character_name, user_message, character_info, quotes, chat_history, script_name=None, memory=None,
+                      session_id=None, on_wait=None, rate_limited=True):
+    """Generate a character response using Gemini.
+
+    chat_history holds the earlier messages only, not user_message itself. The model call
+    goes through the gateway: on_wait(position) is called while it waits for a slot, and
+    gateway.Rejected is raised when the call is shed or the session exceeds its rate limit
+    (unless rate_limited is False because the caller already counted the turn).
+    """
+
+    try:
+        logger.info(f"[{character_name}] Generating response... (conversation history: {len(chat_history)} messages)")
+        with metrics.span(character_name, "prompt"):
+            models, conversation, cache_key = prepare_turn(
+                character_name, user_message, character_info, quotes, chat_history, script_name, memory
+            )
+
+        def call_model():
+            # Retries, hedging and fallback models happen inside the one gateway slot
+            with get_gateway().slot(session_id, on_wait, rate_limited), metrics.span(character_name, "model"):
+                response, _ = get_model_chain().call(
+                    models,
+                    lambda model: model.generate_content(conversation, generation_config=GENERATION_CONFIG),
+                    hedge=True
+                )
+            record_usage(character_name, response.text, response)
+            return response.text
+
+        # Generate response (identical concurrent requests share one model call)
+        cache = get_response_cache()
+        if cache is not None:
+            text, source = cache.get_or_generate(cache_key, call_model)
+            metrics.response_cache_total.inc(character=character_name, result=source)
+            if source != "miss":
+                logger.info(f"[{character_name}] Response served from cache ({source}; {cache.stats()})")
+        else:
+            text = call_model()
+
+        logger.info(f"[{character_name}] Response generated successfully (length: {len(text)} chars)")
+        return text
+
+    except Rejected as e:
+        logger.warning(f"[{character_name}] Model call not admitted: {e}")
+        raise
+
+    except Exception as e:
+        logger.error(f"[{character_name}] Error generating response: {str(e)}", exc_info=True)
+        metrics.errors_total.inc(character=character_name, stage="generate")
+        metrics.fallbacks_total.inc(character=character_name)
+        # Return user-friendly message without exposing error details
+        return fallback_response(character_name)
+
+
+def stream_response(character_name, user_message, character_info, quotes, chat_history, script_name=None, memory=None,
+                    session_id=None, on_wait=None):
+    """Generate a character response using Gemini, yielding text chunks as they arrive.
+
+    chat_history holds the earlier messages only, not user_message itself. session_id and
+    on_wait are passed to the gateway as in generate_response; Rejected is raised before
+    the first chunk.
+    """
+
+    streamed = []
+    cache, flight, reply, model_name = None, None, None, None
+    try:
+        logger.info(f"[{character_name}] Streaming response... (conversation history: {len(chat_history)} messages)")
+        with metrics.span(character_name, "prompt"):
+            models, conversation, cache_key = prepare_turn(
+                character_name, user_message, character_info, quotes, chat_history, script_name, memory
+            )
+
+        def start_stream(model):
+            # Errors usually surface with the first chunk, so it is part of the retried call
+            responses = iter(model.generate_content(conversation, generation_config=GENERATION_CONFIG, stream=True))
+            return next(responses, None), responses
+
+        cache = get_response_cache()
+        if cache is not None:
+            cached, source = cache.get(cache_key), "hit"
+            if cached is None:
+                # Become the single in-flight generation for this key, or wait for the current one
+                is_leader, flight = cache.claim(cache_key)
+                if not is_leader:
+                    cached, source = cache.wait(flight), "shared"
+                    flight = None
+            metrics.response_cache_total.inc(character=character_name, result=source if cached is not None else "miss")
+            if cached is not None:
+                logger.info(f"[{character_name}] Response served from cache ({cache.stats()})")
+                yield cached
+                return
+
+        # The slot is held until the stream ends
+        with get_gateway().slot(session_id, on_wait):
+            started = time.perf_counter()
+            paused = 0.0  # Time suspended while the caller renders chunks, not spent on the model
+            # Retries and fallback models apply until the first chunk; a reply is never restarted midway
+            (first, responses), model_name = get_model_chain().call(models, start_stream)
+
+            chunk = None
+            for chunk in itertools.chain([first] if first is not None else [], responses):
+                text = chunk.text
+                if text:
+                    if not streamed:
+                        metrics.turn_seconds.observe(time.perf_counter() - started, character=character_name, phase="first_token")
+                    streamed.append(text)
+                    yielded = time.perf_counter()
+                    yield text
+                    paused += time.perf_counter() - yielded
+            metrics.turn_seconds.observe(time.perf_counter() - started - paused, character=character_name, phase="model")
+
+        # Usage metadata for the whole reply arrives with the last chunk
+        reply = "".join(streamed)
+        record_usage(character_name, reply, chunk)
+        logger.info(f"[{character_name}] Response streamed successfully (length: {len(reply)} chars)")
+
+    except Rejected as e:
+        logger.warning(f"[{character_name}] Model call not admitted: {e}")
+        raise
+
+    except Exception as e:
+        streamed_chars = sum(len(text) for text in streamed)
+        logger.error(f"[{character_name}] Error streaming response after {streamed_chars} chars: {str(e)}", exc_info=True)
+        metrics.errors_total.inc(character=character_name, stage="stream")
+        if model_name is not None and is_retryable(e):
+            get_model_chain().record_failure(model_name, e)
+        # Keep a partial reply as-is; only fall back when nothing was shown yet
+        if not streamed:
+            metrics.fallbacks_total.inc(character=character_name)
+            yield fallback_response(character_name)
+
+    finally:
+        # Only complete replies are cached; waiters fall back to their own call otherwise
+        if flight is not None:
+            cache.release(cache_key, flight, reply)
+
+
+def council_message(character_name, reply):
+    """A council member's reply as stored in and shown from the council conversation."""
+    return f"**{character_name}:** {reply}"
+
+
+def council_history(messages, character_name):
+    """The council conversation as one member's chat history: its own replies, and the others' by name."""
+    history = []
+    for message in messages:
+        match = COUNCIL_SPEAKER_PATTERN.match(message["content"]) if message["role"] == "assistant" else None
+        if match is None:
+            history.append(message)
+        elif match["name"] == character_name:
+            history.append({"role": "assistant", "content": message["content"][match.end():]})
+        else:
+            history.append({"role": "assistant", "name": match["name"], "content": message["content"][match.end():]})
+    return history
+
+
+def council_responses(members, user_message, chat_history, memory=None, session_id=None,
+                      max_concurrent=COUNCIL_MAX_CONCURRENT):
+    """Ask several characters the same message at once, yielding (character_name, reply) as each is ready.
+
+    members are (character_name, character_info, quotes, script_name) tuples; each member
+    gets its own prompt and replies through generate_response, at most max_concurrent at
+    a time. memory belongs to the council conversation: it windows and summarizes the
+    shared history once for all members. The turn counts once against the session's rate
+    limit; gateway.Rejected is raised before any reply when it is exceeded.
+    """
+    if session_id is not None:
+        get_gateway().check_rate(session_id)
+    if memory is None:
+        memory = new_conversation_memory()
+    summary, recent_history = memory.window(chat_history, "the council")
+
+    def respond(member):
+        character_name, character_info, quotes, script_name = member
+        set_log_context(character=character_name)
+        member_memory = new_conversation_memory()
+        member_memory.summary = summary
+        try:
+            return character_name, generate_response(
+                character_name, user_message, character_info, quotes, council_history(recent_history, character_name),
+                script_name, member_memory, session_id, rate_limited=False
+            )
+        except Rejected:
+            # Shed by an overloaded gateway; the other members still answer
+            return character_name, fallback_response(character_name)
+
+    logger.info(f"Council of {len(members)} answering... (conversation history: {len(chat_history)} messages)")
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_concurrent, len(members))), thread_name_prefix="council")
+    try:
+        # Each member runs in a copy of the caller's log context
+        pending = {pool.submit(contextvars.copy_context().run, respond, member) for member in members}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # If the caller stops early (e.g. the session reran), members not started yet are dropped
+        pool.shutdown(wait=False, cancel_futures=True)
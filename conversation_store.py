@@ -0,0 +1,314 @@
+"""
+Durable conversations, so sessions survive restarts and long chats leave RAM.
+
+Every message is written to the store as it is sent, together with the
+conversation memory's rolling summary. A session only keeps a bounded window
+of recent messages in memory and pages older ones back in on demand.
+Conversations belong to a session id (carried in the page URL) and a character,
+so a reloaded page, or one served by a new process, picks up where it left off.
+
+CONVERSATION_STORE selects the backend: "sqlite" (default, a local file; WAL
+lets several server processes share it) or "memory" (per process, nothing
+survives a restart).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from caching import load_once
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_STORE = os.environ.get("CONVERSATION_STORE", "sqlite").lower()
+CONVERSATION_STORE_PATH = Path(os.environ.get(
+    "CONVERSATION_STORE_PATH", Path(__file__).parent / "data" / "conversations.sqlite3"
+))
+CONVERSATION_RETENTION_DAYS = float(os.environ.get("CONVERSATION_RETENTION_DAYS", "30"))
+# Recent messages a session keeps in memory, and how many "load earlier" brings back at a time
+CONVERSATION_WINDOW_MESSAGES = int(os.environ.get("CONVERSATION_WINDOW_MESSAGES", "40"))
+CONVERSATION_PAGE_MESSAGES = int(os.environ.get("CONVERSATION_PAGE_MESSAGES", "20"))
+
+
+class ConversationStore(ABC):
+    """Interface of the conversation backends. Messages are numbered from 0 within a conversation."""
+
+    @abstractmethod
+    def latest(self, session_id, character=None):
+        """(conversation_id, character) of the session's most recently updated conversation, or None."""
+
+    @abstractmethod
+    def create(self, session_id, character):
+        """Start a new, empty conversation and return its id."""
+
+    @abstractmethod
+    def append(self, conversation_id, role, content):
+        """Add a message at the end of the conversation."""
+
+    @abstractmethod
+    def truncate(self, conversation_id, count):
+        """Delete every message from number `count` on."""
+
+    @abstractmethod
+    def count(self, conversation_id):
+        """Number of messages in the conversation."""
+
+    @abstractmethod
+    def load(self, conversation_id, start, end=None):
+        """Messages start (inclusive) to end (exclusive, default: the last one) as role/content dicts."""
+
+    @abstractmethod
+    def load_memory(self, conversation_id):
+        """The saved (summary, summarized_count) of the conversation memory."""
+
+    @abstractmethod
+    def save_memory(self, conversation_id, summary, summarized_count):
+        """Save the conversation memory's summary and how many messages it covers."""
+
+
+class SqliteConversationStore(ConversationStore):
+    """Conversations in a SQLite file; conversations idle for longer than retention_days are deleted."""
+
+    def __init__(self, path, retention_days=CONVERSATION_RETENTION_DAYS):
+        self.path = Path(path)
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                character TEXT NOT NULL,
+                summary TEXT NOT NULL DEFAULT '',
+                summarized_count INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE INDEX IF NOT EXISTS conversations_session
+            ON conversations (session_id, character, updated_at)
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            ) WITHOUT ROWID
+        """)
+        self.remove_expired()
+
+    def remove_expired(self):
+        cutoff = time.time() - self.retention_days * 86400
+        with self._lock:
+            removed = self._db.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,)).rowcount
+        if removed:
+            logger.info(f"Removed {removed} conversations idle for more than {self.retention_days:g} days")
+
+    def latest(self, session_id, character=None):
+        query = "SELECT id, character FROM conversations WHERE session_id = ?"
+        params = [session_id]
+        if character is not None:
+            query += " AND character = ?"
+            params.append(character)
+        with self._lock:
+            row = self._db.execute(query + " ORDER BY updated_at DESC, id DESC LIMIT 1", params).fetchone()
+        return tuple(row) if row else None
+
+    def create(self, session_id, character):
+        now = time.time()
+        with self._lock:
+            return self._db.execute(
+                "INSERT INTO conversations (session_id, character, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, character, now, now)
+            ).lastrowid
+
+    def append(self, conversation_id, role, content):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT INTO messages (conversation_id, seq, role, content, created_at) "
+                    "SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ?, ? FROM messages WHERE conversation_id = ?",
+                    (conversation_id, role, content, now, conversation_id)
+                )
+                self._db.execute("UPDATE conversations SET updated_at = ? WHERE id = ?", (now, conversation_id))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def truncate(self, conversation_id, count):
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE conversation_id = ? AND seq >= ?", (conversation_id, count))
+
+    def count(self, conversation_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()[0]
+
+    def load(self, conversation_id, start, end=None):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (conversation_id, start, end if end is not None else 2 ** 62)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def load_memory(self, conversation_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary, summarized_count FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        return tuple(row) if row else ("", 0)
+
+    def save_memory(self, conversation_id, summary, summarized_count):
+        with self._lock:
+            self._db.execute(
+                "UPDATE conversations SET summary = ?, summarized_count = ? WHERE id = ?",
+                (summary, summarized_count, conversation_id)
+            )
+
+
+class MemoryConversationStore(ConversationStore):
+    """Conversations in this process only; for development and tests."""
+
+    def __init__(self):
+        self._conversations = {}  # id -> {"session_id", "character", "messages", "memory", "updated_at"}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def latest(self, session_id, character=None):
+        with self._lock:
+            matches = [
+                (conversation["updated_at"], conversation_id, conversation["character"])
+                for conversation_id, conversation in self._conversations.items()
+                if conversation["session_id"] == session_id and character in (None, conversation["character"])
+            ]
+        if not matches:
+            return None
+        _, conversation_id, character = max(matches)
+        return conversation_id, character
+
+    def create(self, session_id, character):
+        with self._lock:
+            conversation_id = self._next_id
+            self._next_id += 1
+            self._conversations[conversation_id] = {
+                "session_id": session_id, "character": character, "messages": [], "memory": ("", 0),
+                "updated_at": time.time(),
+            }
+            return conversation_id
+
+    def append(self, conversation_id, role, content):
+        with self._lock:
+            conversation = self._conversations[conversation_id]
+            conversation["messages"].append({"role": role, "content": content})
+            conversation["updated_at"] = time.time()
+
+    def truncate(self, conversation_id, count):
+        with self._lock:
+            del self._conversations[conversation_id]["messages"][count:]
+
+    def count(self, conversation_id):
+        with self._lock:
+            return len(self._conversations[conversation_id]["messages"])
+
+    def load(self, conversation_id, start, end=None):
+        with self._lock:
+            return [dict(message) for message in self._conversations[conversation_id]["messages"][start:end]]
+
+    def load_memory(self, conversation_id):
+        with self._lock:
+            return self._conversations[conversation_id]["memory"]
+
+    def save_memory(self, conversation_id, summary, summarized_count):
+        with self._lock:
+            self._conversations[conversation_id]["memory"] = (summary, summarized_count)
+
+
+@load_once
+def get_conversation_store():
+    """Open the configured store; falls back to the in-memory one if the file cannot be opened."""
+    if CONVERSATION_STORE == "sqlite":
+        try:
+            return SqliteConversationStore(CONVERSATION_STORE_PATH)
+        except Exception as e:
+            logger.error(f"Conversation store unavailable, keeping conversations in memory: {str(e)}", exc_info=True)
+    elif CONVERSATION_STORE != "memory":
+        logger.error(f"Unknown CONVERSATION_STORE {CONVERSATION_STORE!r}, keeping conversations in memory")
+    return MemoryConversationStore()
+
+
+class Conversation:
+    """A session's view of one stored conversation: the recent messages, kept in sync with its memory.
+
+    `messages` holds the conversation from message number `offset` on. Older
+    messages stay in the store once the memory has summarized them.
+    """
+
+    def __init__(self, store, conversation_id, character, memory, window_size=CONVERSATION_WINDOW_MESSAGES):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.character = character
+        self.memory = memory
+        self.window_size = window_size
+
+        total = store.count(conversation_id)
+        memory.reset()
+        memory.summary, memory.summarized_count = store.load_memory(conversation_id)
+        # Messages the memory has not summarized yet must stay in the window
+        self.offset = max(0, min(total - window_size, memory.summarized_count))
+        self.messages = store.load(conversation_id, self.offset)
+        memory.offset = self.offset
+
+    @classmethod
+    def open(cls, store, session_id, character, memory, new=False):
+        """Resume the session's latest conversation with the character, or start one."""
+        latest = None if new else store.latest(session_id, character)
+        conversation_id = latest[0] if latest else store.create(session_id, character)
+        return cls(store, conversation_id, character, memory)
+
+    def __len__(self):
+        """Messages in the whole conversation, including those not in memory."""
+        return self.offset + len(self.messages)
+
+    @property
+    def has_earlier(self):
+        return self.offset > 0
+
+    def append(self, role, content):
+        self.store.append(self.conversation_id, role, content)
+        self.messages.append({"role": role, "content": content})
+
+    def discard_last(self):
+        """Remove the newest message (e.g. a message that was never answered)."""
+        self.messages.pop()
+        self.store.truncate(self.conversation_id, len(self))
+
+    def end_turn(self):
+        """Save the memory and drop messages beyond the window that the memory has already summarized."""
+        self.store.save_memory(self.conversation_id, self.memory.summary, self.memory.summarized_count)
+        keep_from = max(self.offset, min(len(self) - self.window_size, self.memory.summarized_count))
+        if keep_from > self.offset:
+            del self.messages[:keep_from - self.offset]
+            self.offset = self.memory.offset = keep_from
+
+    def load_earlier(self, count=CONVERSATION_PAGE_MESSAGES):
+        """Page older messages back in from the store (dropped again after the next turn)."""
+        start = max(0, self.offset - count)
+        self.messages[:0] = self.store.load(self.conversation_id, start, self.offset)
+        self.offset = self.memory.offset = start
@@ -0,0 +1,261 @@
+"""
+Compiled character corpus.
+
+Packs lotr_scripts.csv and the character wiki dumps into a single binary file
+that the app memory-maps at startup, so serving a character needs neither
+pandas nor JSON parsing. Pages are read-only and shared between processes.
+Quotes are stored as curated sets (see quote_sets.py): normalized,
+deduplicated and ranked best first.
+
+Build it with:
+    python corpus.py build
+
+File layout (little-endian):
+    header      MAGIC, version, table counts and offsets (HEADER)
+    wiki table  per wiki file: filename, title, summary, content   (4 string refs)
+    char table  per script speaker: name, first quote, quote count
+    quote table per quote, best first per speaker: dialog, movie   (2 string refs)
+    strings     UTF-8 blob; a string ref is (offset, length) into it
+"""
+
+import argparse
+import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+
+from character_store import open_character_store
+from wiki import extract_character_summary, parse_wiki_page
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent
+DEFAULT_CORPUS_PATH = BASE_DIR / "corpus.bin"
+DEFAULT_SCRIPTS_CSV = BASE_DIR / "lotr_scripts.csv"
+DEFAULT_CHARACTERS_DIR = BASE_DIR / "characters"
+DEFAULT_CHARACTERS_ZIP = BASE_DIR / "characters.zip"
+
+MAGIC = b"TLKC"
+VERSION = 3  # Bump whenever stored content changes (e.g. summaries from a new markup stripper)
+
+# magic, version, wiki count, char count, quote count, wiki/char/quote/strings offsets
+HEADER = struct.Struct("<4sHxxIIIQQQQ")
+WIKI_ENTRY = struct.Struct("<8I")
+CHAR_ENTRY = struct.Struct("<4I")
+QUOTE_ENTRY = struct.Struct("<4I")
+
+
+class CorpusFormatError(Exception):
+    """Raised when a corpus file is missing, truncated or from another version."""
+
+
+# =============================================================================
+# Compiler
+# =============================================================================
+
+class _StringTable:
+    """Deduplicating UTF-8 string blob."""
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        if text not in self.offsets:
+            self.offsets[text] = len(self.blob)
+            self.blob += text.encode('utf-8')
+        return self.offsets[text], len(text.encode('utf-8'))
+
+
+def read_script_quotes(scripts_csv):
+    """Group script lines by normalized speaker, keeping the app's cleaning rules."""
+    quotes = {}
+    with open(scripts_csv, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            row = {(k or '').strip(): v for k, v in row.items()}
+            speaker = (row.get('char') or '').upper().strip()
+            dialog = (row.get('dialog') or '').strip()
+            movie = (row.get('movie') or '').strip()
+            if speaker and dialog and dialog != 'nan':
+                quotes.setdefault(speaker, []).append((dialog, movie))
+    return quotes
+
+
+def read_wiki_pages(store):
+    """Yield (filename, title, summary, content) for every parseable wiki dump in a character store."""
+    for filename in store.list_files():
+        try:
+            title, content = parse_wiki_page(store.read_text(filename))
+        except Exception as e:
+            logger.warning(f"Skipping unreadable wiki file {filename}: {str(e)}")
+            continue
+        if content is None:
+            continue
+        yield filename, title or '', extract_character_summary(content), content
+
+
+def build_corpus(output_path=DEFAULT_CORPUS_PATH, scripts_csv=DEFAULT_SCRIPTS_CSV,
+                 characters_dir=DEFAULT_CHARACTERS_DIR, characters_zip=DEFAULT_CHARACTERS_ZIP,
+                 quote_set_size=None):
+    """Compile the scripts CSV and wiki dumps into a corpus file. Returns entry counts.
+
+    Wiki dumps come from `characters_dir` if it exists, otherwise from `characters_zip`.
+    Each speaker keeps their best `quote_set_size` quotes (default quote_sets.QUOTE_SET_SIZE).
+    """
+    from quote_sets import QUOTE_SET_SIZE, curate_quotes
+
+    strings = _StringTable()
+
+    store = open_character_store(characters_dir, characters_zip, cache_size=1)
+    if store is None:
+        raise FileNotFoundError(f"No character data at {characters_dir} or {characters_zip}")
+
+    wiki_rows = []
+    for filename, title, summary, content in read_wiki_pages(store):
+        refs = [strings.add(value) for value in (filename, title, summary, content)]
+        wiki_rows.append(WIKI_ENTRY.pack(*(n for ref in refs for n in ref)))
+
+    char_rows, quote_rows = [], []
+    script_quotes = read_script_quotes(scripts_csv)
+    for speaker, quotes in sorted(curate_quotes(script_quotes, quote_set_size or QUOTE_SET_SIZE).items()):
+        char_rows.append(CHAR_ENTRY.pack(*strings.add(speaker), len(quote_rows), len(quotes)))
+        for dialog, movie in quotes:
+            quote_rows.append(QUOTE_ENTRY.pack(*strings.add(dialog), *strings.add(movie)))
+
+    wiki_offset = HEADER.size
+    char_offset = wiki_offset + len(wiki_rows) * WIKI_ENTRY.size
+    quote_offset = char_offset + len(char_rows) * CHAR_ENTRY.size
+    strings_offset = quote_offset + len(quote_rows) * QUOTE_ENTRY.size
+
+    header = HEADER.pack(MAGIC, VERSION, len(wiki_rows), len(char_rows), len(quote_rows),
+                         wiki_offset, char_offset, quote_offset, strings_offset)
+
+    # Write atomically so running servers never map a half-written file
+    output_path = Path(output_path)
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for rows in (wiki_rows, char_rows, quote_rows):
+            f.write(b"".join(rows))
+        f.write(strings.blob)
+    os.replace(tmp_path, output_path)
+
+    return {'wiki_pages': len(wiki_rows), 'characters': len(char_rows), 'quotes': len(quote_rows),
+            'script_lines': sum(len(quotes) for quotes in script_quotes.values())}
+
+
+# =============================================================================
+# Reader
+# =============================================================================
+
+class CorpusIndex:
+    """Read-only, memory-mapped view of a compiled corpus file."""
+
+    def __init__(self, path=DEFAULT_CORPUS_PATH):
+        self.path = Path(path)
+        try:
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise CorpusFormatError(f"Cannot map corpus file {self.path}: {str(e)}") from e
+
+        if len(self._mm) < HEADER.size:
+            raise CorpusFormatError(f"Corpus file {self.path} is truncated")
+        (magic, version, wiki_count, char_count, self._quote_count,
+         self._wiki_offset, self._char_offset, self._quote_offset,
+         self._strings_offset) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise CorpusFormatError(f"Corpus file {self.path} has an unsupported format")
+        if self._strings_offset > len(self._mm):
+            raise CorpusFormatError(f"Corpus file {self.path} is truncated")
+
+        # Only the small name tables are decoded up front; everything else stays in the map
+        self._wiki = {
+            self._string(*WIKI_ENTRY.unpack_from(self._mm, self._wiki_offset + i * WIKI_ENTRY.size)[:2]): i
+            for i in range(wiki_count)
+        }
+        self._chars = {}
+        for i in range(char_count):
+            name_off, name_len, first, count = CHAR_ENTRY.unpack_from(
+                self._mm, self._char_offset + i * CHAR_ENTRY.size)
+            self._chars[self._string(name_off, name_len)] = (first, count)
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._mm[start:start + length].decode('utf-8')
+
+    def _wiki_entry(self, filename):
+        i = self._wiki[filename]
+        return WIKI_ENTRY.unpack_from(self._mm, self._wiki_offset + i * WIKI_ENTRY.size)
+
+    @property
+    def wiki_filenames(self):
+        return self._wiki.keys()
+
+    @property
+    def character_names(self):
+        return self._chars.keys()
+
+    def has_wiki(self, filename):
+        return filename in self._wiki
+
+    def get_wiki(self, filename):
+        """Return (title, wiki_content) for a wiki file, or (None, None)."""
+        if filename not in self._wiki:
+            return None, None
+        refs = self._wiki_entry(filename)
+        return self._string(*refs[2:4]), self._string(*refs[6:8])
+
+    def get_summary(self, filename):
+        """Return the pre-stripped summary for a wiki file."""
+        if filename not in self._wiki:
+            return ""
+        return self._string(*self._wiki_entry(filename)[4:6])
+
+    def get_quotes(self, character_name):
+        """Return the quote dicts for a normalized (upper-case) script speaker."""
+        first, count = self._chars.get(character_name, (0, 0))
+        quotes = []
+        for i in range(first, first + count):
+            refs = QUOTE_ENTRY.unpack_from(self._mm, self._quote_offset + i * QUOTE_ENTRY.size)
+            quotes.append({'dialog': self._string(*refs[:2]), 'movie': self._string(*refs[2:])})
+        return quotes
+
+    def is_stale(self, *sources):
+        """True if any existing source file is newer than the corpus file."""
+        built = self.path.stat().st_mtime
+        return any(Path(s).exists() and Path(s).stat().st_mtime > built for s in sources)
+
+    def close(self):
+        self._mm.close()
+
+
+# =============================================================================
+# Command Line
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the character corpus for the app.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="compile scripts and wiki dumps into a corpus file")
+    build.add_argument("--scripts", default=DEFAULT_SCRIPTS_CSV, help="movie scripts CSV")
+    build.add_argument("--characters", default=DEFAULT_CHARACTERS_DIR, help="wiki dump directory")
+    build.add_argument("--archive", default=DEFAULT_CHARACTERS_ZIP,
+                       help="wiki dump zip archive, used when the directory does not exist")
+    build.add_argument("--output", default=DEFAULT_CORPUS_PATH, help="corpus file to write")
+    build.add_argument("--quote-set-size", type=int, help="quotes kept per speaker")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    counts = build_corpus(args.output, args.scripts, args.characters, args.archive, args.quote_set_size)
+    size = Path(args.output).stat().st_size
+    logger.info(f"Wrote {args.output} ({size} bytes): {counts['wiki_pages']} wiki pages, "
+                f"{counts['characters']} characters, {counts['quotes']} of {counts['script_lines']} script lines")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Admission control for model calls, shared by every session in the process.
+
+At most GATEWAY_MAX_CONCURRENT calls run at once; the others wait in a queue
+that serves sessions round-robin, so one busy session cannot starve the rest.
+Each session also has a token bucket limiting how often it may call the model
+(calls without a session, e.g. from benchmarks or tools, are only queued).
+New calls are shed (rejected with a retry hint) instead of queued when the
+queue is full or the expected wait exceeds GATEWAY_QUEUE_TIMEOUT_SECONDS, so
+an overload slows some users down rather than making every call fail.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import metrics
+from caching import load_once
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_MAX_CONCURRENT = int(os.environ.get("GATEWAY_MAX_CONCURRENT", "8"))
+GATEWAY_MAX_QUEUE = int(os.environ.get("GATEWAY_MAX_QUEUE", "64"))
+GATEWAY_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("GATEWAY_QUEUE_TIMEOUT_SECONDS", "30"))
+# Per-session token bucket: sustained calls per minute and the burst allowed on top
+GATEWAY_SESSION_RATE_PER_MINUTE = float(os.environ.get("GATEWAY_SESSION_RATE_PER_MINUTE", "12"))
+GATEWAY_SESSION_BURST = int(os.environ.get("GATEWAY_SESSION_BURST", "4"))
+
+# How often a waiting caller is told its place in the queue
+WAIT_UPDATE_SECONDS = 0.5
+# Buckets kept for idle sessions before the full ones are pruned
+MAX_IDLE_BUCKETS = 10000
+
+
+class Rejected(Exception):
+    """A call was not admitted; retry_after is a suggested delay in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason} (retry after {retry_after:.0f}s)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `burst` calls at once, refilled at `rate` calls per second."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Take a token; returns 0 on success, else the seconds until one is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Ticket:
+    __slots__ = ("session_id", "granted")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.granted = False
+
+
+class Gateway:
+    """Bounded pool of model-call slots with a fair queue, per-session rate limits and load shedding."""
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout, session_rate_per_minute, session_burst):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.session_rate = session_rate_per_minute / 60
+        self.session_burst = session_burst
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._queues = OrderedDict()  # session_id -> deque of tickets, in round-robin order
+        self._queued = 0
+        self._buckets = {}
+        self._service_seconds = 1.0  # Moving average of how long a slot is held
+        self._condition = threading.Condition()
+
+    def _position(self, ticket):
+        """Number of tickets served before this one under round-robin."""
+        own = self._queues.get(ticket.session_id, ())
+        index = next((i for i, queued in enumerate(own) if queued is ticket), 0)
+        ahead = index
+        seen_own = False
+        for session_id, tickets in self._queues.items():
+            if session_id == ticket.session_id:
+                seen_own = True
+                continue
+            # Sessions before ours in the rotation get one more turn than those after it
+            ahead += min(len(tickets), index + (0 if seen_own else 1))
+        return ahead
+
+    def _dispatch(self):
+        """Grant free slots to the heads of the session queues, one session at a time."""
+        while self.active < self.max_concurrent and self._queues:
+            session_id, tickets = next(iter(self._queues.items()))
+            ticket = tickets.popleft()
+            self._queued -= 1
+            if tickets:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            ticket.granted = True
+            self.active += 1
+        self._condition.notify_all()
+
+    def _withdraw(self, ticket):
+        tickets = self._queues[ticket.session_id]
+        tickets.remove(ticket)
+        self._queued -= 1
+        if not tickets:
+            del self._queues[ticket.session_id]
+
+    def _take_token(self, session_id, now):
+        bucket = self._buckets.get(session_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                self._buckets = {key: b for key, b in self._buckets.items() if not b.is_full(now)}
+            bucket = self._buckets[session_id] = TokenBucket(self.session_rate, self.session_burst)
+        return bucket.take(now)
+
+    def _expected_wait(self):
+        return (self._queued + 1) / self.max_concurrent * self._service_seconds
+
+    def _reject(self, reason, retry_after):
+        self.rejected += 1
+        metrics.gateway_rejections_total.inc(reason=reason)
+        raise Rejected(reason, retry_after)
+
+    def check_rate(self, session_id):
+        """Count one call against the session's rate limit; raises Rejected when it is exceeded."""
+        with self._condition:
+            retry_after = self._take_token(session_id, time.monotonic())
+            if retry_after:
+                self._reject("rate_limited", retry_after)
+
+    def acquire(self, session_id=None, on_wait=None, rate_limited=True):
+        """Wait for a slot; calls on_wait(position) while queued. Raises Rejected when not admitted.
+
+        Only calls with a session_id are rate limited; rate_limited=False skips the limit
+        for calls already counted with check_rate (they are still queued fairly).
+        """
+        queued_at = time.monotonic()
+        with self._condition:
+            free = self.active < self.max_concurrent and not self._queues
+            if not free:
+                expected_wait = self._expected_wait()
+                if self._queued >= self.max_queue or expected_wait > self.queue_timeout:
+                    self._reject("overloaded", expected_wait)
+            # Only a call that runs or is queued counts against the session's rate limit
+            if session_id is not None and rate_limited:
+                retry_after = self._take_token(session_id, queued_at)
+                if retry_after:
+                    self._reject("rate_limited", retry_after)
+            if free:
+                self.active += 1
+                self.admitted += 1
+                return
+
+            ticket = _Ticket(session_id)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._queued += 1
+            deadline = queued_at + self.queue_timeout
+            try:
+                while not ticket.granted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._withdraw(ticket)
+                        self._reject("queue_timeout", self._expected_wait())
+                    if on_wait is not None:
+                        position = self._position(ticket)
+                        # Report outside the lock; the callback may render UI
+                        self._condition.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self._condition.acquire()
+                        if ticket.granted:
+                            break
+                    self._condition.wait(min(remaining, WAIT_UPDATE_SECONDS))
+            except BaseException:
+                # Interrupted (e.g. the session reran): give up the place or the slot already granted
+                if ticket.granted:
+                    self.active -= 1
+                    self._dispatch()
+                elif ticket in self._queues.get(session_id, ()):
+                    self._withdraw(ticket)
+                raise
+            self.admitted += 1
+        metrics.gateway_wait_seconds.observe(time.monotonic() - queued_at)
+
+    def try_acquire(self):
+        """Take a slot only if one is free and nobody is waiting; returns whether it was taken.
+
+        For extra work on behalf of a call that already holds a slot (hedge requests); not rate limited.
+        """
+        with self._condition:
+            if self.active < self.max_concurrent and not self._queues:
+                self.active += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def release(self, held_seconds):
+        with self._condition:
+            self.active -= 1
+            self._service_seconds += 0.2 * (held_seconds - self._service_seconds)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, session_id=None, on_wait=None, rate_limited=True):
+        """Hold a model-call slot for the duration of the block."""
+        self.acquire(session_id, on_wait, rate_limited)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        with self._condition:
+            return {'active': self.active, 'queued': self._queued, 'admitted': self.admitted,
+                    'rejected': self.rejected}
+
+
+@load_once
+def get_gateway():
+    """The process-wide gateway."""
+    return Gateway(
+        max_concurrent=GATEWAY_MAX_CONCURRENT,
+        max_queue=GATEWAY_MAX_QUEUE,
+        queue_timeout=GATEWAY_QUEUE_TIMEOUT_SECONDS,
+        session_rate_per_minute=GATEWAY_SESSION_RATE_PER_MINUTE,
+        session_burst=GATEWAY_SESSION_BURST,
+    )
@@ -0,0 +1,171 @@
+"""
+Asynchronous logging shared by the Streamlit app and the serve.py launcher.
+
+Request threads only put records on a bounded queue; a listener thread writes
+them to the console and, as JSON lines, to logs/conversations_YYYYMMDD.jsonl.
+The file switches at midnight and a day's file rolls over to .1, .2, ... at
+LOG_MAX_BYTES. When the queue is full, records are dropped rather than making
+a chat turn wait on the disk.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+LOG_DIR = Path(os.environ.get("LOG_DIR", Path(__file__).parent / "logs"))
+LOG_FILE_PREFIX = "conversations"
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "10"))  # Size rollovers kept per day
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "14"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_CONSOLE = os.environ.get("LOG_CONSOLE", "on").lower() not in ("0", "off", "false", "no")
+
+# Attributes every LogRecord has; anything else was passed as `extra` and goes into the JSON line
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+# Fields (session_id, character) attached to every record logged from the current thread
+_log_context = contextvars.ContextVar("log_context", default={})
+
+_queue_handler = None
+_lock = threading.Lock()
+
+
+def set_log_context(**fields):
+    """Attach fields to every record subsequently logged from this thread (None removes a field)."""
+    context = {**_log_context.get(), **fields}
+    _log_context.set({key: value for key, value in context.items() if value is not None})
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current log context onto records, without overriding explicit extras."""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DailyRotatingFileHandler(RotatingFileHandler):
+    """Write to <prefix>_YYYYMMDD.jsonl for the day of each record, rolling over by size within a day.
+
+    Daily files older than retention_days are deleted when the day changes.
+    """
+
+    def __init__(self, directory, prefix, max_bytes, backup_count, retention_days):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.retention_days = retention_days
+        self.day = time.strftime("%Y%m%d")
+        super().__init__(self._path_for(self.day), maxBytes=max_bytes, backupCount=backup_count,
+                         encoding="utf-8", delay=True)
+
+    def _path_for(self, day):
+        return self.directory / f"{self.prefix}_{day}.jsonl"
+
+    def emit(self, record):
+        day = time.strftime("%Y%m%d", time.localtime(record.created))
+        if day != self.day:
+            self.day = day
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            self.baseFilename = os.path.abspath(self._path_for(day))
+            self._remove_expired()
+        super().emit(record)
+
+    def _remove_expired(self):
+        cutoff = time.strftime("%Y%m%d", time.localtime(time.time() - self.retention_days * 86400))
+        for path in self.directory.glob(f"{self.prefix}_*.jsonl*"):
+            day = path.name[len(self.prefix) + 1:].split(".", 1)[0]
+            if day.isdigit() and day < cutoff:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue records without ever blocking; counts the records dropped while the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback in the calling thread, but keep them as separate fields
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """Route all logging through the background listener; later calls do nothing.
+
+    Returns the queue handler (its `dropped` counter reports lost records).
+    """
+    global _queue_handler
+    with _lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+
+        file_handler = DailyRotatingFileHandler(
+            LOG_DIR, LOG_FILE_PREFIX, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_RETENTION_DAYS
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers = [file_handler]
+        if LOG_CONSOLE:
+            console_handler = logging.StreamHandler()  # Also log to console
+            console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            handlers.append(console_handler)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(listener.stop)
+
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(_queue_handler)
+        return _queue_handler
@@ -0,0 +1,117 @@
+"""
+Token-budgeted conversation memory.
+
+The prompt keeps as many of the newest turns as fit in a token budget; turns
+that fall out of the window are folded into a rolling summary, updated
+incrementally so each turn is summarized at most once.
+"""
+
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHARS_PER_TOKEN = 4.0  # Typical for English prose; refined by calibrate()
+
+
+class TokenEstimator:
+    """Local token estimate, calibrated against real token counts from the model."""
+
+    def __init__(self, chars_per_token=DEFAULT_CHARS_PER_TOKEN, smoothing=0.1):
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def estimate(self, text):
+        return int(len(text) / self.chars_per_token) + 1
+
+    def calibrate(self, text, token_count):
+        """Blend an observed characters-per-token ratio into the estimate."""
+        if not text or not token_count or token_count <= 0:
+            return
+        observed = len(text) / token_count
+        with self._lock:
+            self.chars_per_token += self.smoothing * (observed - self.chars_per_token)
+
+
+token_estimator = TokenEstimator()
+
+
+def _first_sentence(text, max_chars):
+    text = re.sub(r'\s+', ' ', text).strip()
+    match = re.match(r'(.+?[.!?])(\s|$)', text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+
+def extractive_summarizer(summary, messages, character_name, token_budget, estimator=token_estimator):
+    """Append the gist of each message to the summary, dropping the oldest lines over budget."""
+    lines = summary.split("\n") if summary else []
+    for msg in messages:
+        speaker = "The user" if msg["role"] == "user" else character_name
+        lines.append(f"- {speaker}: {_first_sentence(msg['content'], 160)}")
+    while len(lines) > 1 and estimator.estimate("\n".join(lines)) > token_budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class ConversationMemory:
+    """Per-session view of a conversation that fits a token budget.
+
+    Call window() with the message list before every turn. Messages must only
+    be appended; if the list is cleared the memory resets itself. The list may
+    leave out leading messages that are already in the summary: `offset` is the
+    number left out (see conversation_store.Conversation).
+    """
+
+    def __init__(self, token_budget=1500, summary_token_budget=300, summarizer=extractive_summarizer,
+                 estimator=token_estimator):
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.summarizer = summarizer
+        self.estimator = estimator
+        self.summary = ""
+        self.summarized_count = 0  # Leading messages already folded into the summary
+        self.offset = 0  # Leading messages not passed to window(); at most summarized_count
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_count = 0
+        self.offset = 0
+
+    def _fit(self, messages, budget):
+        """Index of the oldest message in the newest run of messages that fits the budget."""
+        start = self.offset + len(messages)
+        used = 0
+        # Newest turns first, never re-including turns already in the summary
+        while start > max(self.summarized_count, self.offset):
+            cost = self.estimator.estimate(messages[start - 1 - self.offset]["content"]) + 4  # Role label and spacing
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+        return start
+
+    def window(self, messages, character_name):
+        """Return (summary, recent_messages) for the prompt, updating the rolling summary."""
+        if self.summarized_count > self.offset + len(messages):
+            self.reset()
+
+        start = self._fit(messages, self.token_budget)
+        if start > 0 or self.summary:
+            # Part of the conversation lives in the summary; reserve room for it
+            start = self._fit(messages, self.token_budget - self.summary_token_budget)
+
+        if start > self.summarized_count:
+            evicted = messages[self.summarized_count - self.offset:start - self.offset]
+            try:
+                self.summary = self.summarizer(self.summary, evicted, character_name, self.summary_token_budget)
+            except Exception as e:
+                logger.warning(f"[{character_name}] Summarizer failed, using extractive summary: {str(e)}")
+                self.summary = extractive_summarizer(self.summary, evicted, character_name,
+                                                     self.summary_token_budget, self.estimator)
+            self.summarized_count = start
+            logger.info(f"[{character_name}] Folded {len(evicted)} older messages into the conversation summary")
+
+        return self.summary, messages[start - self.offset:]
@@ -0,0 +1,262 @@
+"""
+In-process metrics for chat turns, exported in the Prometheus text format.
+
+Counters and histograms are labelled per character. The current values can be
+scraped over HTTP (METRICS_PORT) and/or written periodically to a file
+(METRICS_FILE, e.g. for node_exporter's textfile collector). Both are off by
+default; recording is cheap either way.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # 0 disables the HTTP endpoint
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_FILE_INTERVAL_SECONDS = float(os.environ.get("METRICS_FILE_INTERVAL_SECONDS", "15"))
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Distribution of observed values per label set, with cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in values:
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}"
+            yield f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(labels)} {state[-1]}"
+
+
+class Registry:
+    """The metrics exported by this process."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+turn_seconds = REGISTRY.histogram(
+    "tolkien_turn_seconds",
+    "Time spent in each phase of a chat turn (prompt, model, first_token, render, turn).",
+    ("character", "phase")
+)
+turn_tokens = REGISTRY.histogram(
+    "tolkien_turn_tokens",
+    "Tokens per model call from the response usage metadata (prompt, output, cached).",
+    ("character", "kind"),
+    buckets=TOKEN_BUCKETS
+)
+errors_total = REGISTRY.counter(
+    "tolkien_errors_total",
+    "Failed reply generations by stage.",
+    ("character", "stage")
+)
+fallbacks_total = REGISTRY.counter(
+    "tolkien_fallbacks_total",
+    "Turns answered with the fallback reply because generation failed.",
+    ("character",)
+)
+response_cache_total = REGISTRY.counter(
+    "tolkien_response_cache_total",
+    "Response cache lookups by result (hit, shared, miss).",
+    ("character", "result")
+)
+model_attempts_total = REGISTRY.counter(
+    "tolkien_model_attempts_total",
+    "Model call attempts by model and outcome (ok, retryable_error, error, hedged, circuit_open).",
+    ("model", "outcome")
+)
+gateway_wait_seconds = REGISTRY.histogram(
+    "tolkien_gateway_wait_seconds",
+    "Time model calls waited in the gateway queue before getting a slot."
+)
+gateway_rejections_total = REGISTRY.counter(
+    "tolkien_gateway_rejections_total",
+    "Model calls refused by the gateway (rate_limited, overloaded, queue_timeout).",
+    ("reason",)
+)
+
+
+@contextmanager
+def span(character, phase):
+    """Time the enclosed block into tolkien_turn_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        turn_seconds.observe(time.perf_counter() - started, character=character, phase=phase)
+
+
+def record_usage(character, usage):
+    """Record the token counts of a response's usage metadata (None is ignored)."""
+    if usage is None:
+        return
+    for kind, field in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                        ("cached", "cached_content_token_count")):
+        count = getattr(usage, field, 0)
+        if count:
+            turn_tokens.observe(count, character=character, kind=kind)
+
+
+def write_metrics_file(path):
+    """Write the current metrics to a file atomically, so readers never see a partial file."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(REGISTRY.render(), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are too frequent to log
+
+
+def _write_metrics_file_forever(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_metrics_file(path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics file {path}: {str(e)}")
+
+
+_export_started = False
+_export_lock = threading.Lock()
+
+
+def start_metrics_export():
+    """Start the configured HTTP endpoint and/or file writer once per process."""
+    global _export_started
+    with _export_lock:
+        if _export_started:
+            return
+        _export_started = True
+
+        if METRICS_PORT:
+            try:
+                server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _MetricsHandler)
+            except OSError as e:
+                logger.warning(f"Metrics endpoint unavailable on port {METRICS_PORT}: {str(e)}")
+            else:
+                server.daemon_threads = True
+                threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+                logger.info(f"Serving metrics on :{METRICS_PORT}/metrics")
+
+        if METRICS_FILE:
+            threading.Thread(
+                target=_write_metrics_file_forever,
+                args=(METRICS_FILE, METRICS_FILE_INTERVAL_SECONDS),
+                name="metrics-file",
+                daemon=True
+            ).start()
+            logger.info(f"Writing metrics to {METRICS_FILE} every {METRICS_FILE_INTERVAL_SECONDS:g}s")
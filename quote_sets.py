@@ -0,0 +1,157 @@
+"""
+Curated quote sets: the movie lines worth showing and sending to the model.
+
+lotr_scripts.csv holds every line as transcribed, with padded and broken
+punctuation, repeats and many one-word lines ("Left.", " Haldir "). Curation
+normalizes each line, drops near-duplicates of a speaker's better lines
+(MinHash over character shingles, with LSH banding so only likely pairs are
+compared), ranks the rest by informativeness and keeps the best
+QUOTE_SET_SIZE per speaker. The first quotes of a set are its best, so the
+sidebar sample and the system prompt take them from the front.
+
+corpus.py stores the curated sets; catalog.py curates on load when it reads
+the raw CSV instead.
+"""
+
+import math
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from retrieval import FUNCTION_WORDS, TOKEN_PATTERN
+
+# Quotes kept per speaker, best first
+QUOTE_SET_SIZE = 80
+# Lines shorter than this are kept only when a speaker has too few longer ones
+MIN_WORDS = 3
+MIN_QUOTES_PER_SPEAKER = 3
+# Lines longer than this many words rank lower the longer they get
+LONG_WORDS = 18
+# Estimated Jaccard similarity of character shingles above which two lines are the same line
+DUPLICATE_SIMILARITY = 0.6
+
+SHINGLE_CHARS = 4
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # of MINHASH_PERMUTATIONS // LSH_BANDS rows; pairs above ~0.5 similarity become candidates
+# Multiply-shift hash functions (odd multipliers, wrapping uint64 arithmetic, top 32 bits)
+_rng = np.random.default_rng(20011219)  # Fixed, so builds are reproducible
+_HASH_A = _rng.integers(0, 1 << 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_HASH_B = _rng.integers(0, 1 << 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+_SPACE_PATTERN = re.compile(r"\s+")
+_STAGE_DIRECTION = re.compile(r"\([^)]*\)")
+_DOUBLED_PUNCTUATION = re.compile(r"([.!?]),")
+# "shape.Sauron" -> "shape. Sauron"; an ellipsis ("......that") is left alone
+_MISSING_SPACE_AFTER_SENTENCE = re.compile(r"(?<=[a-z][.!?])(?=[A-Z])")
+_SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.!?;:])")
+_MISSING_SPACE_AFTER_COMMA = re.compile(r",(?=[A-Za-z])")
+_LEADING_PUNCTUATION = re.compile(r"^[\s,.;:)]+")
+_TRAILING_DEBRIS = re.compile(r"[\s,;:(]+$")
+
+
+def normalize_quote(text):
+    """Collapse whitespace, drop stage directions and repair punctuation: ' You , there ,Sam ' -> 'You, there, Sam'."""
+    text = _STAGE_DIRECTION.sub(" ", text)
+    text = _SPACE_PATTERN.sub(" ", text.replace("\xa0", " "))
+    text = _SPACE_BEFORE_PUNCTUATION.sub(r"\1", text)
+    text = _DOUBLED_PUNCTUATION.sub(r"\1", text)
+    text = _MISSING_SPACE_AFTER_SENTENCE.sub(" ", text)
+    text = _MISSING_SPACE_AFTER_COMMA.sub(", ", text)
+    text = _TRAILING_DEBRIS.sub("", _LEADING_PUNCTUATION.sub("", text))
+    return text[:1].upper() + text[1:]
+
+
+def minhash_signatures(texts):
+    """MinHash signatures of the texts' character shingles, as a (len(texts), MINHASH_PERMUTATIONS) array."""
+    hashes, starts = [], []
+    for text in texts:
+        text = f" {text.lower()} "
+        shingles = {text[i:i + SHINGLE_CHARS] for i in range(max(1, len(text) - SHINGLE_CHARS + 1))}
+        starts.append(len(hashes))
+        hashes.extend(zlib.crc32(shingle.encode('utf-8')) for shingle in shingles)
+    if not texts:
+        return np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32)
+
+    # Every distinct shingle under every permutation at once, then the minimum per text
+    distinct, positions = np.unique(np.array(hashes, dtype=np.uint64), return_inverse=True)
+    permuted = ((distinct[:, None] * _HASH_A[None, :] + _HASH_B[None, :]) >> np.uint64(32)).astype(np.uint32)
+    return np.minimum.reduceat(permuted[positions], np.array(starts), axis=0)
+
+
+def informativeness(texts):
+    """Score each text by the rarity of its content words, damped for very short and very long lines."""
+    tokens = [TOKEN_PATTERN.findall(text.lower()) for text in texts]
+    document_frequency = Counter(token for line in tokens for token in set(line))
+    total = max(len(texts), 1)
+    # Words seen in a single line (names, Elvish, typos) count like words seen in two
+    idf = {token: math.log(total / max(count, 2)) for token, count in document_frequency.items()}
+
+    scores = np.zeros(len(texts))
+    for i, line in enumerate(tokens):
+        content = {token for token in line if token not in FUNCTION_WORDS}
+        if not content:
+            continue
+        information = sum(idf[token] for token in content)
+        # A line made mostly of words found nowhere else is likely not English (spells, Black Speech)
+        unseen = sum(document_frequency[token] == 1 for token in content) / len(content)
+        if unseen > 0.5:
+            information *= 0.5
+        # Up to about two sentences reads well in the sidebar and the prompt; speeches are cut down to size
+        scores[i] = information * min(1.0, len(line) / 6) / (1 + max(0, len(line) - LONG_WORDS) / LONG_WORDS)
+    return scores
+
+
+def _deduplicate(order, signatures):
+    """Walk indices in rank order, keeping those with no near-duplicate among the lines already kept."""
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    buckets = {}
+    kept = []
+    for index in order:
+        signature = signatures[index]
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+        candidates = {other for key in keys for other in buckets.get(key, ())}
+        if any(np.mean(signatures[other] == signature) >= DUPLICATE_SIMILARITY for other in candidates):
+            continue
+        kept.append(index)
+        for key in keys:
+            buckets.setdefault(key, []).append(index)
+    return kept
+
+
+def curate_quotes(quotes_by_speaker, size=QUOTE_SET_SIZE):
+    """Normalize, deduplicate and rank every speaker's quotes.
+
+    quotes_by_speaker maps a speaker to a sequence of (dialog, movie) pairs. Returns
+    {speaker: [(dialog, movie), ...]} with at most `size` pairs per speaker, best first.
+    Every speaker keeps at least one quote.
+    """
+    speakers, dialogs, movies = [], [], []
+    for speaker, quotes in quotes_by_speaker.items():
+        for dialog, movie in quotes:
+            dialog = normalize_quote(dialog)
+            if dialog:
+                speakers.append(speaker)
+                dialogs.append(dialog)
+                movies.append(movie)
+
+    # Rarity is judged against the whole script, so scores compare across speakers
+    scores = informativeness(dialogs)
+    signatures = minhash_signatures(dialogs)
+    word_counts = np.array([len(dialog.split()) for dialog in dialogs])
+
+    by_speaker = {}
+    for index, speaker in enumerate(speakers):
+        by_speaker.setdefault(speaker, []).append(index)
+
+    curated = {}
+    for speaker, indices in by_speaker.items():
+        order = sorted(indices, key=lambda i: -scores[i])
+        unique = _deduplicate(order, signatures)
+        chosen = [i for i in unique if word_counts[i] >= MIN_WORDS]
+        if len(chosen) < MIN_QUOTES_PER_SPEAKER:
+            # Speakers with little to say keep their best short lines too
+            chosen += [i for i in unique if word_counts[i] < MIN_WORDS][:MIN_QUOTES_PER_SPEAKER - len(chosen)]
+        curated[speaker] = [(dialogs[i], movies[i]) for i in chosen[:size]]
+    return curated
@@ -0,0 +1,232 @@
+"""
+Retries, hedging and circuit breaking for model calls.
+
+A ModelChain tries the configured models in order. Each model gets a few
+attempts with jittered exponential backoff on transient errors (429, 5xx,
+timeouts), and its own circuit breaker, which skips a model that keeps failing
+until a probe call succeeds again. Whole (non-streamed) calls can be hedged: if
+no reply has arrived by a high percentile of that model's recent latencies, a
+second identical call is started and the first reply wins. Given the gateway,
+a hedge needs a free slot of its own, held until both calls have finished.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", "3"))  # Per model in the chain
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", "2.0"))
+# Start a second request once the first is slower than this percentile of recent calls (0 disables)
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+# HTTP status codes worth retrying (google.api_core exceptions carry them as .code)
+RETRYABLE_CODES = frozenset({408, 429, 500, 502, 503, 504})
+LATENCY_WINDOW = 200
+
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+class CircuitOpen(Exception):
+    """The model's circuit breaker is open; the call was not attempted."""
+
+
+def is_retryable(error):
+    """Whether an error is transient: rate limits, server errors, timeouts and dropped connections."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY_SECONDS, cap=RETRY_MAX_DELAY_SECONDS):
+    """Full-jitter exponential backoff: uniform between 0 and base * 2**attempt, capped."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after `reset_seconds` lets one probe through."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def cancel_probe(self):
+        """End a probe that was interrupted before it succeeded or failed, so a later call probes again."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        """Count a failure; returns True when this failure opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            # A failed probe reopens the circuit; otherwise it opens at the threshold
+            if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._probing = False
+                return True
+            return False
+
+
+class LatencyWindow:
+    """The most recent call durations, for percentile estimates."""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class ModelChain:
+    """Calls models in fallback order with retries, optional hedging and a circuit breaker per model."""
+
+    def __init__(self, model_names, attempts=RETRY_ATTEMPTS, hedge_percentile=HEDGE_PERCENTILE, slots=None):
+        """slots (e.g. the gateway) provides try_acquire() and release(held_seconds) for hedge requests."""
+        self.model_names = list(model_names)
+        if not self.model_names:
+            raise ValueError("no models configured")
+        self.attempts = max(attempts, 1)
+        self.hedge_percentile = hedge_percentile
+        self.slots = slots
+        self.breakers = {name: CircuitBreaker() for name in self.model_names}
+        self.latencies = {name: LatencyWindow() for name in self.model_names}
+
+    def call(self, get_model, request, hedge=False):
+        """Return (result, model_name) for request(get_model(model_name)) from the first model that succeeds.
+
+        Raises the last error when every model failed, or CircuitOpen when all circuits are open.
+        """
+        last_error = None
+        for name in self.model_names:
+            breaker = self.breakers[name]
+            for attempt in range(self.attempts):
+                if not breaker.allow():
+                    metrics.model_attempts_total.inc(model=name, outcome="circuit_open")
+                    last_error = last_error or CircuitOpen(f"Circuit open for {name}")
+                    break
+                try:
+                    model = get_model(name)
+                    result = self._attempt(name, model, request) if hedge else request(model)
+                except Exception as e:
+                    last_error = e
+                    retryable = is_retryable(e)
+                    metrics.model_attempts_total.inc(model=name, outcome="retryable_error" if retryable else "error")
+                    if not retryable:
+                        # The backend answered, so the circuit stays closed; another model may still accept the request
+                        breaker.record_success()
+                        logger.warning(f"{name} failed ({e}); trying the next model")
+                        break
+                    self.record_failure(name, e)
+                    if attempt + 1 < self.attempts:
+                        delay = backoff_delay(attempt)
+                        logger.warning(f"{name} failed ({e}); retry {attempt + 1} in {delay:.2f}s")
+                        time.sleep(delay)
+                    continue
+                except BaseException:
+                    # Interrupted (e.g. the session reran): no verdict on the model, and no stuck probe
+                    breaker.cancel_probe()
+                    raise
+                breaker.record_success()
+                metrics.model_attempts_total.inc(model=name, outcome="ok")
+                if name != self.model_names[0]:
+                    logger.info(f"Answered by fallback model {name}")
+                return result, name
+        raise last_error
+
+    def record_failure(self, name, error):
+        """Count a transient failure against a model's breaker (also for errors after a stream started)."""
+        if self.breakers[name].record_failure():
+            logger.error(f"Circuit opened for {name} after repeated failures ({error}); "
+                         f"skipping it for {BREAKER_RESET_SECONDS:.0f}s")
+
+    def _release_when_done(self, futures):
+        """Release the hedge's slot once every request has finished, the slower one included."""
+        held_since = time.monotonic()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.slots.release(time.monotonic() - held_since)
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def _attempt(self, name, model, request):
+        """Run request(model), starting a hedge request if it is slower than usual."""
+        window = self.latencies[name]
+        threshold = window.percentile(self.hedge_percentile) if self.hedge_percentile > 0 else None
+        started = time.perf_counter()
+        if threshold is None:
+            result = request(model)
+            window.add(time.perf_counter() - started)
+            return result
+
+        pending = {_hedge_pool.submit(request, model)}
+        done, pending = wait(pending, timeout=threshold)
+        # The hedge runs only in a free slot of its own, so hedging never exceeds the gateway's limit
+        if not done and (self.slots is None or self.slots.try_acquire()):
+            metrics.model_attempts_total.inc(model=name, outcome="hedged")
+            pending.add(_hedge_pool.submit(request, model))
+            if self.slots is not None:
+                self._release_when_done(set(pending))
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    window.add(time.perf_counter() - started)
+                    return future.result()  # The slower request finishes in the background
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
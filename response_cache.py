@@ -0,0 +1,162 @@
+"""
+Persistent cache of character replies.
+
+Replies are stored in SQLite keyed by character, normalized message and a hash
+of the conversation window the model saw, with a TTL and LRU eviction beyond a
+maximum number of entries. Concurrent identical requests are collapsed into a
+single model call (single-flight): the first caller generates, the others wait
+for its reply.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a message."""
+    return re.sub(r'\s+', ' ', message).strip().lower().rstrip('?!.… ')
+
+
+def make_cache_key(namespace, character_name, user_message, summary, history):
+    """Cache key for a turn; history is the list of messages actually sent to the model."""
+    window = json.dumps([summary, [(m["role"], m["content"]) for m in history]], ensure_ascii=False)
+    payload = json.dumps([
+        namespace,
+        character_name,
+        normalize_message(user_message),
+        hashlib.sha256(window.encode('utf-8')).hexdigest(),
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """A generation in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class ResponseCache:
+    """SQLite-backed reply cache with TTL, LRU size limit and single-flight deduplication."""
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=10000, flight_timeout=60.0):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.flight_timeout = flight_timeout
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # WAL lets several server processes share the cache file
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def get(self, key):
+        """Return the cached reply or None, counting the hit or miss."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl_seconds,))
+        excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def claim(self, key):
+        """Join or start the in-flight generation for a key. Returns (is_leader, flight).
+
+        The leader must call release() when done; followers wait on flight.done.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return False, flight
+            flight = self._flights[key] = _Flight()
+            return True, flight
+
+    def release(self, key, flight, response=None):
+        """Finish a claimed generation, caching the reply if there is one."""
+        if response is not None:
+            self.put(key, response)
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.result = response
+        flight.done.set()
+
+    def wait(self, flight):
+        """Wait for another caller's generation; None if it failed or timed out."""
+        flight.done.wait(self.flight_timeout)
+        if flight.result is not None:
+            with self._lock:
+                self.coalesced += 1
+        return flight.result
+
+    def get_or_generate(self, key, generate):
+        """Return (reply, source) where source is "hit", "shared" or "miss"."""
+        cached = self.get(key)
+        if cached is not None:
+            return cached, "hit"
+
+        is_leader, flight = self.claim(key)
+        if not is_leader:
+            shared = self.wait(flight)
+            if shared is not None:
+                return shared, "shared"
+            return generate(), "miss"
+
+        response = None
+        try:
+            response = generate()
+            return response, "miss"
+        finally:
+            self.release(key, flight, response)
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'entries': entries}
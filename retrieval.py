@@ -0,0 +1,155 @@
+"""
+Lightweight BM25 retrieval over short texts (movie quotes, wiki passages).
+
+The index is built once into flat NumPy arrays: per-term postings with their
+BM25 weights precomputed, so a query is a handful of dict lookups followed by
+one bincount and a partial sort. A sorted copy of the vocabulary answers
+prefix queries (search-as-you-type) by binary search.
+"""
+
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+FUNCTION_WORDS = frozenset("""
+a an and are as at be but by do does did for from had has have he her him his how i if in into is it
+its me my no not of on or our she so than that the their them then there these they this those to
+too up us was we were what when where which who whom why will with would you your
+""".split())
+
+# Chat questions wrap the topic in these ("Tell me about the ring"); as search terms they outweigh it
+CONVERSATIONAL_WORDS = frozenset("""
+about am any anything been being can could describe ever explain hello hey hi just know like may might
+more much please really say should some something tell thank thanks thing things think talk very want
+well wonder yes i'm you're what's
+""".split())
+
+STOPWORDS = FUNCTION_WORDS | CONVERSATIONAL_WORDS
+
+
+def tokenize(text):
+    """Lower-case word tokens with stopwords removed."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents, optionally partitioned into groups.
+
+    `groups` gives a key per document (e.g. the speaker); searches can then be
+    restricted to one group while IDF statistics stay corpus-wide.
+    """
+
+    def __init__(self, documents, groups=None, k1=1.2, b=0.75):
+        self.size = len(documents)
+        doc_tokens = [tokenize(doc) for doc in documents]
+        doc_lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=np.float32)
+        avg_length = float(doc_lengths.mean()) if self.size and doc_lengths.mean() > 0 else 1.0
+
+        # Term frequencies per (term, doc), collected as parallel arrays
+        self.vocabulary = {}
+        term_ids, doc_ids, counts = [], [], []
+        for doc_id, tokens in enumerate(doc_tokens):
+            tf = {}
+            for token in tokens:
+                tf[token] = tf.get(token, 0) + 1
+            for token, count in tf.items():
+                term_ids.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                doc_ids.append(doc_id)
+                counts.append(count)
+
+        term_ids = np.array(term_ids, dtype=np.int32)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        counts = np.array(counts, dtype=np.float32)
+
+        # Sort postings by term so each term's postings are one contiguous slice
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, self._postings, counts = term_ids[order], doc_ids[order], counts[order]
+        self._offsets = np.searchsorted(term_ids, np.arange(len(self.vocabulary) + 1)).astype(np.int64)
+        self._sorted_terms = sorted(self.vocabulary)
+
+        doc_freq = np.diff(self._offsets).astype(np.float32)
+        idf = np.log1p((self.size - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = k1 * (1 - b + b * doc_lengths[self._postings] / avg_length)
+        self._weights = (idf[term_ids] * counts * (k1 + 1) / (counts + norm)).astype(np.float32)
+
+        self._groups = {}
+        if groups is not None:
+            members = {}
+            for doc_id, group in enumerate(groups):
+                members.setdefault(group, []).append(doc_id)
+            self._groups = {group: np.array(ids, dtype=np.int32) for group, ids in members.items()}
+
+    def _term_slices(self, terms):
+        for term in set(terms):
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                yield slice(self._offsets[term_id], self._offsets[term_id + 1])
+
+    def prefix_terms(self, prefix):
+        """Indexed terms starting with prefix."""
+        start = bisect_left(self._sorted_terms, prefix)
+        end = bisect_left(self._sorted_terms, prefix + "\uffff", start)
+        return self._sorted_terms[start:end]
+
+    def scores(self, query_terms, prefix=None):
+        """BM25 score of every document for the given query terms.
+
+        A prefix matches every term starting with it, weighted by how much of the term it is
+        ("shire" prefers "shire" to "shirelings"); each document counts its best such term once.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        slices = list(self._term_slices(query_terms))
+        if slices:
+            docs = np.concatenate([self._postings[s] for s in slices])
+            weights = np.concatenate([self._weights[s] for s in slices])
+            scores += np.bincount(docs, weights=weights, minlength=self.size).astype(np.float32)
+        completions = self.prefix_terms(prefix) if prefix else []
+        if completions:
+            slices = [slice(self._offsets[term_id], self._offsets[term_id + 1])
+                      for term_id in (self.vocabulary[term] for term in completions)]
+            best = np.zeros(self.size, dtype=np.float32)
+            np.maximum.at(best, np.concatenate([self._postings[s] for s in slices]),
+                          np.concatenate([self._weights[s] * (len(prefix) / len(term))
+                                          for s, term in zip(slices, completions)]))
+            scores += best
+        return scores
+
+    def search(self, query, k=5, group=None, exclude=(), prefix=False, within=None):
+        """Return up to k (doc_id, score) pairs with a positive score, best first.
+
+        With prefix=True the query is taken as typed so far: its last word also matches longer
+        terms ("gand" finds "gandalf"). within restricts the search to the given doc ids.
+        """
+        if prefix:
+            terms = TOKEN_PATTERN.findall(query.lower())
+            # A word still being typed may be a stopword so far ("the" -> "theoden")
+            last = terms.pop() if terms and query[-1:].isalnum() else None
+            scores = self.scores([t for t in terms if t not in STOPWORDS], prefix=last)
+        else:
+            scores = self.scores(tokenize(query))
+        if group is not None:
+            candidates = self._groups.get(group)
+            if candidates is None:
+                return []
+        else:
+            candidates = np.arange(self.size, dtype=np.int32)
+        if within is not None:
+            candidates = np.intersect1d(candidates, np.asarray(within, dtype=np.int32))
+        if len(exclude):
+            candidates = candidates[~np.isin(candidates, np.fromiter(exclude, dtype=np.int32))]
+
+        candidate_scores = scores[candidates]
+        positive = np.flatnonzero(candidate_scores > 0)
+        if not len(positive):
+            return []
+        if len(positive) > k:
+            positive = positive[np.argpartition(-candidate_scores[positive], k - 1)[:k]]
+        best = positive[np.argsort(-candidate_scores[positive], kind='stable')]
+        return [(int(candidates[i]), float(candidate_scores[i])) for i in best]
+
+    def group_members(self, group):
+        """Document ids in a group, in insertion order."""
+        return self._groups.get(group, np.empty(0, dtype=np.int32))
@@ -0,0 +1,39 @@
+"""
+Production entry point: start the cache warm-up, then the Streamlit server in
+the same process, so the caches are filled before the first visitor arrives.
+
+    python serve.py [streamlit run options, e.g. --server.port=8501]
+
+`streamlit run app.py` still works; it starts the warm-up with the first session.
+"""
+
+import sys
+from pathlib import Path
+
+# Load environment variables before the modules below read their configuration
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # python-dotenv not installed, skip
+
+from logging_config import setup_logging
+from metrics import start_metrics_export
+from warmup import start_warmup
+
+APP_PATH = Path(__file__).parent / "app.py"
+
+
+def main():
+    setup_logging()
+    start_warmup()
+    start_metrics_export()
+
+    from streamlit.web import cli as stcli
+
+    sys.argv = ["streamlit", "run", str(APP_PATH), *sys.argv[1:]]
+    return stcli.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
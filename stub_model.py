@@ -0,0 +1,119 @@
+"""
+Offline stand-in for vertexai's GenerativeModel, for benchmarks and load tests.
+
+Replies after a configurable latency and streams at a configurable token rate,
+with usage metadata shaped like the real responses, so the app can run end to
+end without network access. Selected with MODEL_BACKEND=stub (see chat.py).
+
+Faults can be injected to exercise retries, hedging and fallback models:
+transient errors (STUB_ERROR_RATE), slow outliers (STUB_SLOW_RATE) and models
+that are down altogether (STUB_DOWN_MODELS).
+"""
+
+import os
+import random
+import time
+
+# Read at call time, so benchmarks can change them between runs
+STUB_LATENCY_SECONDS = float(os.environ.get("STUB_LATENCY_SECONDS", "0.5"))  # Until the first token
+STUB_TOKENS_PER_SECOND = float(os.environ.get("STUB_TOKENS_PER_SECOND", "50"))  # 0 streams instantly
+STUB_REPLY_TOKENS = int(os.environ.get("STUB_REPLY_TOKENS", "60"))
+STUB_ERROR_RATE = float(os.environ.get("STUB_ERROR_RATE", "0"))  # Share of calls failing with STUB_ERROR_CODE
+STUB_ERROR_CODE = int(os.environ.get("STUB_ERROR_CODE", "503"))
+STUB_SLOW_RATE = float(os.environ.get("STUB_SLOW_RATE", "0"))  # Share of calls delayed by STUB_SLOW_SECONDS
+STUB_SLOW_SECONDS = float(os.environ.get("STUB_SLOW_SECONDS", "5"))
+STUB_DOWN_MODELS = os.environ.get("STUB_DOWN_MODELS", "")  # Comma-separated model names that always fail
+
+CHUNK_TOKENS = 8
+REPLY_WORDS = (
+    "All we have to decide is what to do with the time that is given us. "
+    "Even the smallest person can change the course of the future."
+).split()
+
+
+class StubServiceError(Exception):
+    """An injected API error; like google.api_core exceptions it carries the HTTP status as .code."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class StubResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class StubGenerativeModel:
+    """Accepts the GenerativeModel arguments the app uses and answers with filler text.
+
+    One word counts as one token. `simulated_seconds` accumulates the time spent
+    sleeping in place of the model, so callers can separate it from their own overhead.
+    """
+
+    def __init__(self, model_name, system_instruction=None, latency=None, tokens_per_second=None,
+                 reply_tokens=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.simulated_seconds = 0.0
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            started = time.perf_counter()
+            time.sleep(seconds)
+            # Count the actual sleep, which overshoots the request slightly
+            self.simulated_seconds += time.perf_counter() - started
+
+    def _plan(self, contents, generation_config):
+        reply_tokens = self.reply_tokens if self.reply_tokens is not None else STUB_REPLY_TOKENS
+        max_tokens = (generation_config or {}).get("max_output_tokens")
+        if max_tokens:
+            reply_tokens = min(reply_tokens, max_tokens)
+        words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(reply_tokens)]
+        prompt_text = f"{self.system_instruction or ''}{contents}"
+        usage = UsageMetadata(prompt_token_count=len(prompt_text) // 4 + 1, candidates_token_count=len(words))
+        return words, usage
+
+    def _token_delay(self, tokens):
+        rate = self.tokens_per_second if self.tokens_per_second is not None else STUB_TOKENS_PER_SECOND
+        return tokens / rate if rate > 0 else 0.0
+
+    def _inject_faults(self):
+        """Delay or fail the call as configured by the STUB_SLOW_* / STUB_ERROR_* / STUB_DOWN_MODELS settings."""
+        if STUB_SLOW_RATE and random.random() < STUB_SLOW_RATE:
+            self._sleep(STUB_SLOW_SECONDS)
+        if self.model_name in [name.strip() for name in STUB_DOWN_MODELS.split(",")]:
+            raise StubServiceError(503, f"Model {self.model_name} is unavailable")
+        if STUB_ERROR_RATE and random.random() < STUB_ERROR_RATE:
+            raise StubServiceError(STUB_ERROR_CODE, "Injected fault")
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        words, usage = self._plan(contents, generation_config)
+        self._sleep(self.latency if self.latency is not None else STUB_LATENCY_SECONDS)
+        self._inject_faults()
+        if stream:
+            return self._stream(words, usage)
+        self._sleep(self._token_delay(len(words)))
+        return StubResponse(" ".join(words), usage)
+
+    def _stream(self, words, usage):
+        for start in range(0, len(words), CHUNK_TOKENS):
+            chunk = words[start:start + CHUNK_TOKENS]
+            if start:
+                self._sleep(self._token_delay(len(chunk)))
+            text = " ".join(chunk) + (" " if start + CHUNK_TOKENS < len(words) else "")
+            # Usage for the whole reply arrives with the last chunk, as with the real API
+            last = start + CHUNK_TOKENS >= len(words)
+            yield StubResponse(text, usage if last else None)
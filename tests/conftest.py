@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Offline backends, set before the modules under test read their configuration
+os.environ.setdefault("MODEL_BACKEND", "stub")
+os.environ.setdefault("STUB_LATENCY_SECONDS", "0.05")
+os.environ.setdefault("RESPONSE_CACHE", "off")
+os.environ.setdefault("CONVERSATION_STORE", "memory")
+os.environ.setdefault("WARMUP", "off")
+os.environ.setdefault("LOG_CONSOLE", "off")
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="tolkien-logs-"))
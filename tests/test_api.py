@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+
+import api
+from conversation_store import get_conversation_store
+
+
+def stream_until_disconnect(spec_version, message):
+    """POST /v1/chat/stream and hang up after the first chunk; returns the session id."""
+    body = json.dumps({"character": "Gandalf", "message": message}).encode("utf-8")
+    scope = {
+        "type": "http", "method": "POST", "path": "/v1/chat/stream", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json")], "scheme": "http",
+        "server": ("testserver", 80), "client": ("testclient", 50000),
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+    }
+    received = []
+
+    async def run():
+        first_chunk = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await first_chunk.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if first_chunk.is_set():
+                raise OSError("Client disconnected")  # How ASGI 2.4 servers report it
+            received.append(message)
+            if message.get("body", b"").startswith(b"event: chunk"):
+                first_chunk.set()
+
+        try:
+            await api.app(scope, receive, send)
+        except Exception:
+            pass  # Starlette raises ClientDisconnect under ASGI 2.4
+
+    asyncio.run(run())
+    session = next(m["body"] for m in received if m.get("body", b"").startswith(b"event: session"))
+    return api.verify_token(json.loads(session.split(b"data: ", 1)[1])["session_token"])
+
+
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+def test_stream_keeps_the_partial_reply_after_a_disconnect(spec_version):
+    session_id = stream_until_disconnect(spec_version, "Tell me about the ring")
+
+    store = get_conversation_store()
+    conversation_id, _ = store.latest(session_id, "Gandalf")
+    messages = store.load(conversation_id, 0)
+    assert [message['role'] for message in messages] == ["user", "assistant"]
+    assert messages[1]['content']
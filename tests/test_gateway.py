@@ -0,0 +1,20 @@
+import pytest
+
+from gateway import Gateway, Rejected
+
+
+def test_overloaded_calls_do_not_spend_the_rate_limit():
+    gateway = Gateway(max_concurrent=1, max_queue=0, queue_timeout=30, session_rate_per_minute=0, session_burst=2)
+    gateway.acquire("other")  # Takes the only slot; the queue holds nothing
+    for _ in range(3):
+        with pytest.raises(Rejected) as rejected:
+            gateway.acquire("session")
+        assert rejected.value.reason == "overloaded"
+    gateway.release(0.1)
+
+    for _ in range(2):
+        with gateway.slot("session"):
+            pass
+    with pytest.raises(Rejected) as rejected:
+        gateway.acquire("session")
+    assert rejected.value.reason == "rate_limited"
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from gateway import Gateway
+from resilience import CircuitBreaker, ModelChain
+
+
+def hedging_chain(gateway):
+    chain = ModelChain(["model"], attempts=1, hedge_percentile=0.5, slots=gateway)
+    for _ in range(20):
+        chain.latencies["model"].add(0.01)
+    return chain
+
+
+def new_gateway(max_concurrent):
+    return Gateway(max_concurrent=max_concurrent, max_queue=8, queue_timeout=30, session_rate_per_minute=60,
+                   session_burst=10)
+
+
+def test_hedge_holds_a_slot_until_the_slower_request_finishes():
+    gateway = new_gateway(2)
+    calls = []
+    release_first = threading.Event()
+
+    def request(model):
+        calls.append(model)
+        if len(calls) == 1:
+            release_first.wait(5)  # The first request is slow; the hedge wins
+            return "slow"
+        return "fast"
+
+    with gateway.slot():
+        result, _ = hedging_chain(gateway).call(lambda name: name, request, hedge=True)
+    assert result == "fast"
+    assert gateway.stats()["active"] == 1  # The slow request still runs, in the hedge's slot
+    release_first.set()
+    deadline = time.monotonic() + 5
+    while gateway.stats()["active"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert gateway.stats()["active"] == 0
+
+
+def test_no_hedge_without_a_free_slot():
+    gateway = new_gateway(1)
+    calls = []
+
+    def request(model):
+        calls.append(model)
+        time.sleep(0.1)
+        return "reply"
+
+    with gateway.slot():
+        result, _ = hedging_chain(gateway).call(lambda name: name, request, hedge=True)
+    assert result == "reply"
+    assert len(calls) == 1
+
+
+def test_interrupted_probe_does_not_leave_the_breaker_half_open():
+    chain = ModelChain(["model"], attempts=1)
+    breaker = chain.breakers["model"] = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    def interrupted(model):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        chain.call(lambda name: name, interrupted)
+    assert chain.call(lambda name: name, lambda model: "reply") == ("reply", "model")
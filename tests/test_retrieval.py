@@ -0,0 +1,27 @@
+import catalog
+from retrieval import BM25Index, tokenize
+
+
+def test_conversational_filler_is_not_a_search_term():
+    assert tokenize("Tell me about the ring") == ["ring"]
+
+
+def test_tell_me_about_query_ranks_on_the_topic():
+    documents = [
+        "The battle for Middle-earth is about to begin.",
+        "A thing is about to happen that has not happened since the Elder Days.",
+        "What about second breakfast?",
+        "The Ring has awoken, it has heard its master's call.",
+        "Keep it secret, keep it safe.",
+        "The Ring must be destroyed.",
+        "One ring to rule them all, one ring to find them.",
+        "It is the Ring that binds them, the ring of power.",
+    ]
+    hits = BM25Index(documents).search("Tell me about the ring", k=3)
+    assert {doc_id for doc_id, _ in hits} <= {3, 5, 6, 7}
+
+
+def test_tell_me_about_query_finds_gandalfs_quotes_on_the_topic():
+    quotes = catalog.find_relevant_quotes("GANDALF", "Tell me about the ring", k=4)
+    assert quotes
+    assert all("ring" in quote['dialog'].lower() for quote in quotes)
@@ -0,0 +1,303 @@
+"""
+Voice profiles: how each character speaks, measured from the film scripts.
+
+A profile stands in for the raw example quotes in a character's system
+prompt. It holds the words and phrases the character uses far more than
+everyone else, typical sentence length, how often they ask or exclaim, and how
+they address people. Distinctiveness is the log-odds ratio with an informative
+Dirichlet prior (Monroe et al., "Fightin' Words"), computed for every speaker
+at once from one speaker-by-n-gram count matrix. Only n-grams spread over
+several scenes and free of proper nouns count, so the profile describes how a
+character talks rather than what their scenes are about.
+
+Build it with:
+    python voice.py build
+
+The app loads the file when it is newer than the scripts CSV, and otherwise
+computes the profiles in process on first use (see catalog.get_voice_profiles).
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from retrieval import FUNCTION_WORDS
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent
+DEFAULT_PROFILES_PATH = BASE_DIR / "voice_profiles.json"
+DEFAULT_SCRIPTS_CSV = BASE_DIR / "lotr_scripts.csv"
+
+VERSION = 2
+
+# Speakers with fewer lines get no profile; their few quotes say more than statistics would
+MIN_LINES = 8
+# An n-gram must occur this often in a speaker's lines to describe them
+MIN_COUNT = 2
+# ... and in this many scenes, so one scene's topic ("of moria", "this city") is not a habit. The
+# scripts do not mark scenes: a speaker's lines with fewer than SCENE_GAP of their lines between
+# them count as one scene.
+MIN_SCENES = 3
+SCENE_GAP = 20
+# Only n-grams scoring above this z-value (one-sided 95%) are distinctive
+MIN_Z = 1.65
+# Prior strength of the Dirichlet prior, in pseudo-counts
+PRIOR_STRENGTH = 500.0
+MAX_NGRAM = 3
+
+DISTINCTIVE_WORDS = 6
+SIGNATURE_PHRASES = 4
+ADDRESSES = 3
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:'[A-Za-z]+)?")
+SENTENCE_PATTERN = re.compile(r"[^.!?]+")
+# Parts of a line between punctuation; a vocative stands in one of its own ("Come, Mr Frodo!")
+SEGMENT_PATTERN = re.compile(r"[^,.!?;:\"]+")
+HONORIFIC_PATTERN = re.compile(r"\b(Mr|Mrs)\.")
+ADDRESS_TITLES = frozenset({
+    "my lord", "my lady", "my liege", "sire", "sir", "master", "mister", "lad", "laddie", "lass", "my friend",
+    "my friends", "my dear", "my love", "my son", "my precious", "precious", "my boy", "boys", "lads",
+})
+NAME_PREFIXES = frozenset({"Mr", "Mrs", "Master", "Lord", "Lady", "King", "Captain"})
+
+
+def _ngrams(tokens):
+    """Word n-grams up to MAX_NGRAM long that are not made of stopwords only."""
+    for n in range(1, MAX_NGRAM + 1):
+        for i in range(len(tokens) - n + 1):
+            gram = tokens[i:i + n]
+            if not all(token in FUNCTION_WORDS for token in gram):
+                yield " ".join(gram)
+
+
+def _proper_nouns(lines):
+    """Lower-cased words that are mostly capitalized where they do not start a sentence (names, places)."""
+    capitalized, seen = Counter(), Counter()
+    for line in lines:
+        for sentence in SENTENCE_PATTERN.findall(line):
+            for word in WORD_PATTERN.findall(sentence)[1:]:
+                seen[word.lower()] += 1
+                capitalized[word.lower()] += word[0].isupper()
+    return {word for word, count in seen.items()
+            if capitalized[word] * 2 >= count and word != "i" and not word.startswith("i'")}
+
+
+def _address_terms(line, names):
+    """Names and titles the line addresses someone by, e.g. "Mr Frodo" or "my lord".
+
+    names are the lower-cased words of the speakers' names, so places ("Mordor!") do not count.
+    """
+    for segment in SEGMENT_PATTERN.findall(HONORIFIC_PATTERN.sub(r"\1", line)):
+        words = segment.split()
+        if not 1 <= len(words) <= 3:
+            continue
+        phrase = " ".join(words)
+        if phrase.lower() in ADDRESS_TITLES:
+            yield phrase.lower()
+        elif all(word[0].isupper() and (word in NAME_PREFIXES or word.lower() in names) for word in words) \
+                and any(word.lower() in names for word in words):
+            yield phrase
+
+
+def _log_odds(counts):
+    """z-scores of each n-gram for each speaker against all other speakers, for all speakers at once.
+
+    counts is a (speakers, n-grams) matrix. Log-odds ratio with an informative Dirichlet
+    prior proportional to the overall n-gram frequencies, divided by its standard error.
+    """
+    counts = counts.astype(np.float64)
+    totals = counts.sum(axis=0)
+    prior = PRIOR_STRENGTH * totals / totals.sum()
+    prior_total = PRIOR_STRENGTH
+
+    own = counts
+    rest = totals - counts
+    own_size = own.sum(axis=1, keepdims=True)
+    rest_size = rest.sum(axis=1, keepdims=True)
+
+    delta = (np.log((own + prior) / (own_size + prior_total - own - prior))
+             - np.log((rest + prior) / (rest_size + prior_total - rest - prior)))
+    variance = 1.0 / (own + prior) + 1.0 / (rest + prior)
+    return delta / np.sqrt(variance)
+
+
+def _top_ngrams(scores, counts, scenes, grams, lengths, want_phrases, limit):
+    """The best-scoring distinctive words (want_phrases=False) or multi-word phrases of one speaker.
+
+    scenes counts the speaker's scenes using each n-gram; n-grams with proper nouns have 0 scenes.
+    """
+    eligible = ((counts >= MIN_COUNT) & (scenes >= MIN_SCENES) & (scores >= MIN_Z)
+                & ((lengths > 1) if want_phrases else (lengths == 1)))
+    chosen = []
+    for index in np.flatnonzero(eligible)[np.argsort(-scores[eligible], kind='stable')]:
+        gram = grams[index]
+        # A phrase cut off after a function word ("lord of") is a fragment of a longer one
+        if want_phrases and gram.rsplit(" ", 1)[-1] in FUNCTION_WORDS:
+            continue
+        # Skip a phrase that only repeats part of a better one ("the ring" next to "the one ring")
+        if want_phrases and any(f" {gram} " in f" {other} " or f" {other} " in f" {gram} " for other in chosen):
+            continue
+        chosen.append(gram)
+        if len(chosen) == limit:
+            break
+    return chosen
+
+
+def build_profiles(lines_by_speaker, min_lines=MIN_LINES):
+    """Compute voice profiles for every speaker with at least min_lines lines.
+
+    lines_by_speaker maps a speaker to a sequence of dialog strings. Returns
+    {speaker: profile dict}.
+    """
+    speakers = sorted(speaker for speaker, lines in lines_by_speaker.items() if len(lines) >= min_lines)
+    if not speakers:
+        return {}
+
+    # One (speaker, n-gram) pair per occurrence, counted in a single bincount; new_scene marks
+    # occurrences that start a scene for the n-gram, for counting the scenes it is used in
+    vocabulary = {}
+    speaker_ids, gram_ids, new_scene = [], [], []
+    for speaker_id, speaker in enumerate(speakers):
+        last_seen = {}
+        for line_number, line in enumerate(lines_by_speaker[speaker]):
+            tokens = [word.lower() for word in WORD_PATTERN.findall(line)]
+            for gram in _ngrams(tokens):
+                gram_id = vocabulary.setdefault(gram, len(vocabulary))
+                speaker_ids.append(speaker_id)
+                gram_ids.append(gram_id)
+                new_scene.append(line_number - last_seen.get(gram_id, -SCENE_GAP) >= SCENE_GAP)
+                last_seen[gram_id] = line_number
+    speaker_ids = np.array(speaker_ids, dtype=np.int64)
+    gram_ids = np.array(gram_ids, dtype=np.int64)
+    new_scene = np.array(new_scene, dtype=bool)
+
+    # N-grams seen once in the whole script cannot be anyone's habit; drop them before the matrix
+    occurrences = np.bincount(gram_ids, minlength=len(vocabulary))
+    kept = np.flatnonzero(occurrences >= MIN_COUNT)
+    remap = np.full(len(vocabulary), -1, dtype=np.int64)
+    remap[kept] = np.arange(len(kept))
+    gram_ids = remap[gram_ids]
+    mask = gram_ids >= 0
+    cells = speaker_ids[mask] * len(kept) + gram_ids[mask]
+    counts = np.bincount(cells, minlength=len(speakers) * len(kept)).reshape(len(speakers), len(kept))
+    scenes = np.bincount(cells[new_scene[mask]],
+                         minlength=len(speakers) * len(kept)).reshape(len(speakers), len(kept))
+
+    grams = np.array(list(vocabulary), dtype=object)[kept]
+    lengths = np.array([gram.count(" ") + 1 for gram in grams])
+    scores = _log_odds(counts)
+    names = {word.lower() for speaker in lines_by_speaker for word in WORD_PATTERN.findall(speaker)}
+    # Names and places say what a scene is about, not how the speaker talks
+    proper = _proper_nouns(line for lines in lines_by_speaker.values() for line in lines)
+    scenes[:, [any(word in proper for word in gram.split()) for gram in grams]] = 0
+
+    profiles = {}
+    for speaker_id, speaker in enumerate(speakers):
+        lines = lines_by_speaker[speaker]
+        sentence_lengths = [len(WORD_PATTERN.findall(sentence)) for line in lines
+                            for sentence in SENTENCE_PATTERN.findall(line)]
+        sentence_lengths = [length for length in sentence_lengths if length]
+        # Saying one's own name is not addressing anyone ("Gollum, gollum")
+        own_name = {word.lower() for word in WORD_PATTERN.findall(speaker)}
+        addresses = Counter(term for line in lines for term in _address_terms(line, names)
+                            if not own_name & {word.lower() for word in term.split()})
+        profiles[speaker] = {
+            'lines': len(lines),
+            'words_per_sentence': float(np.median(sentence_lengths)) if sentence_lengths else 0.0,
+            'question_rate': round(sum('?' in line for line in lines) / len(lines), 2),
+            'exclamation_rate': round(sum('!' in line for line in lines) / len(lines), 2),
+            'distinctive_words': _top_ngrams(scores[speaker_id], counts[speaker_id], scenes[speaker_id], grams,
+                                             lengths, want_phrases=False, limit=DISTINCTIVE_WORDS),
+            'signature_phrases': _top_ngrams(scores[speaker_id], counts[speaker_id], scenes[speaker_id], grams,
+                                             lengths, want_phrases=True, limit=SIGNATURE_PHRASES),
+            'addresses': [term for term, count in addresses.most_common(ADDRESSES) if count >= MIN_COUNT],
+        }
+    return profiles
+
+
+def describe_voice(profile):
+    """The profile as prompt text."""
+    length = profile['words_per_sentence']
+    style = "short, clipped" if length < 6 else "measured" if length < 11 else "long, flowing"
+    habits = []
+    for rate, habit in ((profile['question_rate'], "asks questions"), (profile['exclamation_rate'], "exclaims")):
+        if rate >= 0.3:
+            habits.append(f"often {habit}")
+        elif rate < 0.1:
+            habits.append(f"rarely {habit}")
+
+    lines = [f"- {style.capitalize()} sentences (about {length:.0f} words){''.join(f'; {habit}' for habit in habits)}"]
+    if profile['distinctive_words']:
+        lines.append(f"- Favourite words: {', '.join(profile['distinctive_words'])}")
+    if profile['signature_phrases']:
+        lines.append(f"- Signature phrases: {'; '.join(profile['signature_phrases'])}")
+    if profile['addresses']:
+        lines.append(f"- Calls others: {', '.join(profile['addresses'])}")
+    return "\n".join(lines)
+
+
+def write_profiles(profiles, output_path=DEFAULT_PROFILES_PATH):
+    # Write atomically so running servers never read a half-written file
+    output_path = Path(output_path)
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps({'version': VERSION, 'profiles': profiles}, ensure_ascii=False, indent=1),
+                        encoding='utf-8')
+    os.replace(tmp_path, output_path)
+
+
+def load_profiles(path=DEFAULT_PROFILES_PATH):
+    """Read a profiles file; returns None if it is missing or from another version."""
+    try:
+        data = json.loads(Path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cannot read voice profiles {path}: {str(e)}")
+        return None
+    if data.get('version') != VERSION:
+        logger.warning(f"Voice profiles {path} have an unsupported format")
+        return None
+    return data['profiles']
+
+
+# =============================================================================
+# Command Line
+# =============================================================================
+
+def main(argv=None):
+    from corpus import read_script_quotes
+
+    parser = argparse.ArgumentParser(description="Compute the characters' voice profiles for the app.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="analyse the movie scripts and write the profiles")
+    build.add_argument("--scripts", default=DEFAULT_SCRIPTS_CSV, help="movie scripts CSV")
+    build.add_argument("--output", default=DEFAULT_PROFILES_PATH, help="profiles file to write")
+    show = subparsers.add_parser("show", help="print a character's profile as it appears in the prompt")
+    show.add_argument("speaker", help="script speaker, e.g. GOLLUM")
+    show.add_argument("--profiles", default=DEFAULT_PROFILES_PATH, help="profiles file to read")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "show":
+        profile = (load_profiles(args.profiles) or {}).get(args.speaker.upper())
+        if profile is None:
+            logger.error(f"No voice profile for {args.speaker}")
+            return 1
+        print(describe_voice(profile))
+        return 0
+
+    quotes = read_script_quotes(args.scripts)
+    profiles = build_profiles({speaker: [dialog for dialog, _ in lines] for speaker, lines in quotes.items()})
+    write_profiles(profiles, args.output)
+    logger.info(f"Wrote {args.output}: voice profiles for {len(profiles)} of {len(quotes)} speakers")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Background warm-up of the per-process caches.
+
+Loads every available character (wiki page, summary, quotes, voice profile,
+system prompt), builds the retrieval and search indexes and opens the Vertex AI client on
+a daemon thread, so the first visitor to a fresh container does not pay for
+them. Requests that arrive mid-warm-up wait for the piece in progress instead
+of repeating it.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import catalog
+import chat
+from wiki import extract_character_summary
+
+logger = logging.getLogger(__name__)
+
+# Set WARMUP=off to load everything lazily on first use instead
+WARMUP_ENABLED = os.environ.get("WARMUP", "on").lower() not in ("0", "off", "false", "no")
+
+_thread = None
+_lock = threading.Lock()
+
+
+def warm_up():
+    """Fill the catalogue and model caches; errors are logged, never raised."""
+    started = time.perf_counter()
+    try:
+        characters = catalog.get_available_characters()
+        for character in characters:
+            character_info = catalog.load_character_info(character['filename'])
+            catalog.get_character_summary(character['filename'])
+            catalog.get_character_quotes(character['script_name'])
+            # The system prompt summarizes the full page (memoized in wiki.py)
+            extract_character_summary(character_info[1])
+        catalog.get_voice_profiles()
+        catalog.get_quote_index()
+        catalog.get_lore_index()
+        catalog.get_search_index()
+        chat.get_response_cache()
+        logger.info(f"Warm-up: loaded {len(characters)} characters in {time.perf_counter() - started:.2f}s")
+
+        if not chat.initialize_vertex_ai():
+            return
+        try:
+            # Each model opens its own client. Server-side prompt caches are billed, so with the
+            # "vertex" backend they are still created on first use and only the credentials are warmed.
+            if chat.PROMPT_CACHE_BACKEND == "local":
+                for character in characters:
+                    model = chat.get_character_model(
+                        character['display_name'],
+                        catalog.load_character_info(character['filename']),
+                        catalog.get_character_quotes(character['script_name'])
+                    )
+                    chat.warm_model_client(model)
+            else:
+                chat.warm_model_client(chat.get_model())
+        except Exception as e:
+            logger.warning(f"Warm-up: Vertex AI client not ready, it will connect on first use: {str(e)}")
+            return
+        logger.info(f"Warm-up: Vertex AI client ready after {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Warm-up failed, remaining caches load on first use: {str(e)}", exc_info=True)
+
+
+def start_warmup():
+    """Start the warm-up thread once per process (no-op when WARMUP is off)."""
+    global _thread
+    if not WARMUP_ENABLED:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+            _thread.start()
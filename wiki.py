@@ -0,0 +1,194 @@
+"""
+MediaWiki helpers for the character wiki dumps.
+Shared by the Streamlit app and the offline corpus compiler (corpus.py).
+"""
+
+import functools
+import html
+import json
+import re
+
+HEADING_PATTERN = re.compile(r'^(={2,6})\s*(.*?)\s*\1\s*$', re.MULTILINE)
+
+# Every markup construct the single-pass converter reacts to; plain text between matches is copied.
+# The leading lookahead lets the scanner skip ordinary characters without trying each alternative.
+MARKUP_TOKEN = re.compile(r"""
+    (?=[<{}\[\]|='_*#:;])
+    (?:
+      (?P<comment><!--.*?-->)
+    | (?P<tag_single><(?i:ref|gallery|references)\b[^>]*/>)
+    | (?P<tag_open><(?i:ref|gallery)\b[^>]*>)
+    | (?P<tag_close></(?i:ref|gallery)\s*>)
+    | (?P<template_open>\{\{)
+    | (?P<template_close>\}\})
+    | (?P<table_open>^\{\|)
+    | (?P<table_close>^\|\})
+    | (?P<simple_link>\[\[(?P<link_target>[^\[\]|:]+)(?:\|(?P<link_label>[^\[\]|]*))?\]\])
+    | (?P<link_open>\[\[)
+    | (?P<link_close>\]\])
+    | (?P<external>\[(?:https?:)?//[^\s\]]+[ \t]*(?P<external_label>[^\]]*)\])
+    | (?P<heading>^={1,6}[^\n]*?={1,6}[ \t]*$)
+    | (?P<list_marker>^[*#:;]+[ \t]*)
+    | (?P<line_break><(?i:br)\s*/?>)
+    | (?P<html_tag></?[a-zA-Z][^>]*>)
+    | (?P<emphasis>'{2,5})
+    | (?P<magic_word>__[A-Z]+__)
+    )
+""", re.VERBOSE | re.MULTILINE | re.DOTALL)
+
+SKIP_OPENERS = {'template_open', 'table_open', 'tag_open'}
+SKIP_CLOSERS = {'template_close': 'template_open', 'table_close': 'table_open', 'tag_close': 'tag_open'}
+
+DROPPED_NAMESPACES = frozenset({"category", "file", "image", "media"})
+INTERLANGUAGE_PATTERN = re.compile(r'^[a-z]{2,3}(?:-[a-z]+)?$')
+
+# Sections with no in-world prose worth grounding a reply on (compared lower-case)
+SKIPPED_SECTIONS = frozenset({
+    "references", "notes", "external links", "external link", "see also", "gallery",
+    "translations around the world", "translation around the world", "voice dubbing actors",
+    "portrayal in adaptations", "portrayals in adaptations", "behind the scenes",
+    "concept and creation", "trivia", "video games", "appearances",
+})
+
+
+def parse_wiki_page(content):
+    """Extract (title, wiki_content) from a MediaWiki API JSON dump."""
+    data = json.loads(content)
+
+    # Extract the wiki content
+    pages = data.get('query', {}).get('pages', {})
+    for page_id, page_data in pages.items():
+        revisions = page_data.get('revisions', [])
+        if revisions:
+            wiki_content = revisions[0].get('*', '')
+            title = page_data.get('title', '')
+            return title, wiki_content
+
+    return None, None
+
+
+def _link_label(inner):
+    """Display text of an internal link body ("Target|label"), or "" for non-prose links."""
+    target, _, label = inner.partition('|')
+    namespace = target.split(':', 1)[0].strip() if ':' in target else ''
+    if namespace and (namespace.lower() in DROPPED_NAMESPACES or INTERLANGUAGE_PATTERN.match(namespace)):
+        return ''
+    if '|' in label:
+        label = label.rsplit('|', 1)[1]
+    return (label or target).strip()
+
+
+def strip_markup(wiki_text):
+    """Convert wiki markup to plain text in a single pass, keeping paragraph breaks.
+
+    Templates, tables, refs, galleries and comments are dropped, including nested
+    ones; links become their label; file, category and interlanguage links,
+    emphasis, list markers and headings are removed.
+    """
+    buffers = [[]]  # One buffer per open [[link]]; the first holds the output
+    skipping = []   # Open constructs whose content is dropped, innermost last
+    pos = 0
+    for match in MARKUP_TOKEN.finditer(wiki_text):
+        if not skipping:
+            buffers[-1].append(wiki_text[pos:match.start()])
+        pos = match.end()
+        kind = match.lastgroup
+
+        if kind in SKIP_OPENERS:
+            skipping.append(kind)
+        elif kind in SKIP_CLOSERS:
+            opener = SKIP_CLOSERS[kind]
+            if opener in skipping:
+                # Also recovers from constructs left unclosed inside this one
+                del skipping[len(skipping) - 1 - skipping[::-1].index(opener):]
+        elif skipping:
+            continue
+        elif kind == 'simple_link':
+            # Most links are plain [[Target]] or [[Target|label]]; resolve them without a buffer
+            buffers[-1].append((match.group('link_label') or match.group('link_target')).strip())
+        elif kind == 'link_open':
+            buffers.append([])
+        elif kind == 'link_close':
+            if len(buffers) > 1:
+                label = _link_label(''.join(buffers.pop()))
+                buffers[-1].append(label)
+        elif kind == 'external':
+            buffers[-1].append(match.group('external_label'))
+        elif kind in ('heading', 'line_break'):
+            buffers[-1].append('\n')
+    if not skipping:
+        buffers[-1].append(wiki_text[pos:])
+
+    # Unclosed links keep their raw text
+    while len(buffers) > 1:
+        inner = ''.join(buffers.pop())
+        buffers[-1].append(inner)
+
+    text = html.unescape(''.join(buffers[0])).replace('\xa0', ' ')
+    text = re.sub(r'[ \t]{2,}|\t', ' ', text)
+    text = re.sub(r' ?\n[ \n]*\n ?', '\n\n', text)
+    return text.strip()
+
+
+@functools.lru_cache(maxsize=256)
+def extract_character_summary(wiki_content):
+    """Extract a brief summary from wiki content (memoized per page)."""
+    if not wiki_content:
+        return ""
+
+    # Remove wiki markup
+    text = re.sub(r'\s+', ' ', strip_markup(wiki_content))
+
+    # Get first few sentences
+    sentences = text.split('.')
+    summary = '. '.join(sentences[:3]) + '.'
+
+    return summary[:500] if len(summary) > 500 else summary
+
+
+def split_sections(wiki_content):
+    """Split wiki content by its ==Heading== structure into (heading, plain text) pairs.
+
+    Nested headings are joined with their parents ("Biography > War of the Ring");
+    the lead section has an empty heading. Sections without prose (references,
+    galleries, translations, ...) are dropped.
+    """
+    raw_sections = []
+    stack = []  # (level, title) of the enclosing headings
+    heading, skipped, start = "", False, 0
+    for match in HEADING_PATTERN.finditer(wiki_content):
+        raw_sections.append((heading, skipped, wiki_content[start:match.start()]))
+        level = len(match.group(1))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, strip_markup(match.group(2))))
+        heading = " > ".join(title for _, title in stack)
+        skipped = any(title.lower() in SKIPPED_SECTIONS for _, title in stack)
+        start = match.end()
+    raw_sections.append((heading, skipped, wiki_content[start:]))
+
+    sections = []
+    for heading, skipped, body in raw_sections:
+        text = strip_markup(body)
+        if text and not skipped:
+            sections.append((heading, text))
+    return sections
+
+
+def split_passages(wiki_content, max_chars=600):
+    """Split wiki content into (heading, text) passages of at most about max_chars.
+
+    Passages never cross a section boundary; long sections are split between
+    paragraphs, and a single overlong paragraph becomes its own passage.
+    """
+    passages = []
+    for heading, text in split_sections(wiki_content):
+        current = ""
+        for paragraph in text.split("\n\n"):
+            if current and len(current) + len(paragraph) + 2 > max_chars:
+                passages.append((heading, current))
+                current = ""
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+        if current:
+            passages.append((heading, current))
+    return passages